@@ -5,7 +5,7 @@ from bs4.element import Tag
 from tqdm import tqdm
 import re
 
-from src.common.consts import COMPANY_NAME_TO_ID
+from src.common import consts
 from src.common.stock_dispatch import StockExchangeDispatch
 from src.api.scraper.scrapers import scrape_dispatch_from_url, scrape_dispatch_from_url_within_included_companies
 from src.api.scraper.scraper_utils import get_included_companies, ScrapperError, get_page_root
@@ -68,10 +68,11 @@ def scrape_dispatches_for_company(
     year_range = range(year_start, year_end + 1)
     scraped_dispatches_all = []
     for year in year_range:
-        assert company_name in COMPANY_NAME_TO_ID, 'Such company name was not found in corresponding_stocks.json.'
+        assert company_name in consts.COMPANY_NAME_TO_ID, \
+            'Such company name was not found in corresponding_stocks.json.'
         # currently only scraping first site (if too many stock dispatches for a given year, infosfera uses pagination)
         company_dispatches_tag = _get_tag_containing_company_dispatches(
-            company_id=COMPANY_NAME_TO_ID[company_name], year=year, page=1)
+            company_id=consts.COMPANY_NAME_TO_ID[company_name], year=year, page=1)
         scraped_dispatches = _scrape_company_dispatches_from_company_dispatches_tag(
             company_dispatches_tag, sleep_time=sleep_time)
         if scraped_dispatches:
@@ -1,16 +1,12 @@
-import quandl
-
-from src.common.consts import COMPANY_NAME_TO_CODE, QUANDL_API_KEY
+from src.common import consts
 from src.common.utils.dates import previous_working_day, next_working_day
 
-quandl.ApiConfig.api_key = QUANDL_API_KEY
-
 
 def get_stock_prices_for_company_name(
         company_name: str,
         stock_dispatch_date: str,
         stock_exchange_name: str = 'WSE') -> dict:
-    company_code = COMPANY_NAME_TO_CODE[company_name]
+    company_code = consts.COMPANY_NAME_TO_CODE[company_name]
     return get_stock_prices(company_code, stock_dispatch_date, stock_exchange_name)
 
 
@@ -22,6 +18,7 @@ def get_stock_prices(company_code: str, stock_dispatch_date: str, stock_exchange
     Retrieves a stock price for a given stock code, Day before - And day after a given date.
     :return {'before': <price>, 'after': <price>}
     """
+    quandl = _get_quandl()
     previous_working_day_data = quandl.get(f'{stock_exchange_name}/{company_code}',
                                            start_date=previous_working_day(stock_dispatch_date),
                                            end_date=previous_working_day(stock_dispatch_date))
@@ -41,7 +38,7 @@ def compare_stock_prices_for_company_name_to_wig(
         company_name: str,
         stock_dispatch_date: str,
         stock_exchange_name: str = 'WSE') -> float:
-    company_code = COMPANY_NAME_TO_CODE[company_name]
+    company_code = consts.COMPANY_NAME_TO_CODE[company_name]
     return compare_stock_prices_to_wig(
         company_code=company_code,
         stock_dispatch_date=stock_dispatch_date,
@@ -59,6 +56,17 @@ def compare_stock_prices_to_wig(company_code: str, stock_dispatch_date: str, sto
     )
 
 
+def _get_quandl():
+    """
+    Imports quandl and sets the API key on the first request, so that importing this module is fast
+    and does not require the key.
+    """
+    import quandl
+
+    quandl.ApiConfig.api_key = consts.QUANDL_API_KEY
+    return quandl
+
+
 def _calculate_score_using_formula(x1: float, x2: float, y1: float, y2: float):
     """
     Calculating score by using our formula: ((x2-x1)/x1) - ((y2-y1)/y1)
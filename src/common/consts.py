@@ -1,11 +1,37 @@
+from typing import Any, Callable, Dict
+
 from src.common.utils.files_io import load_json
 
-CORRESPONDING_STOCKS = load_json('data/corresponding_stocks.json')
-COMPANY_NAME_TO_ID = {el['company_name']: el['company_infosfera_id'] for el in CORRESPONDING_STOCKS}
-COMPANY_NAME_TO_CODE = {el['company_name']: el['company_code'] for el in CORRESPONDING_STOCKS}
+CORRESPONDING_STOCKS_FILE = 'data/corresponding_stocks.json'
 
 # For this to work, you need to copy apikey from github SECRETS and copy it inside QUANDL_AUTH_FILE file.
 QUANDL_AUTH_FILE = "data/quandl/quandl_auth.json"
-QUANDL_API_KEY = load_json(QUANDL_AUTH_FILE)['apikey']
 
 RANDOM_STATE = 42
+
+SCRAPED_DISPATCHES_DIR = "data/infosfera/scraped_dispatches"
+
+# Ways of combining logits of the windows of a long document, see long_documents.aggregate_chunk_logits.
+AGGREGATIONS = ("mean", "max", "attention")
+
+# Number of texts classified at once during evaluation.
+DEFAULT_CHUNK_SIZE = 10000
+
+# Values read from the data files on first access (e.g. consts.COMPANY_NAME_TO_ID), so that importing
+# this module neither reads the files nor requires them to exist.
+_LAZY_VALUES: Dict[str, Callable[[], Any]] = {
+    'CORRESPONDING_STOCKS': lambda: load_json(CORRESPONDING_STOCKS_FILE),
+    'COMPANY_NAME_TO_ID': lambda: {
+        el['company_name']: el['company_infosfera_id'] for el in __getattr__('CORRESPONDING_STOCKS')},
+    'COMPANY_NAME_TO_CODE': lambda: {
+        el['company_name']: el['company_code'] for el in __getattr__('CORRESPONDING_STOCKS')},
+    'QUANDL_API_KEY': lambda: load_json(QUANDL_AUTH_FILE)['apikey'],
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_VALUES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = _LAZY_VALUES[name]()
+    globals()[name] = value
+    return value
@@ -1,2 +1,6 @@
-from .read import read_klej, KlejType
-from .financial import generate_financial_dataset
\ No newline at end of file
+from .read import read_klej, read_klej_texts_labels, load_klej_split, iter_klej_file, KlejType, KlejSplit
+from .corpus import load_financial_corpus, iter_annotated_file, FinancialCorpus
+from .financial import generate_financial_dataset, generate_financial_split_indices, generate_financial_k_folds
+from .splits import SplitIndices, stratified_split, company_split, group_stratified_k_fold, file_split
+from .labels import label_sentiments, sweep_thresholds, quantile_thresholds, ThresholdSweep, SENTIMENT_LABELS, \
+    POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
@@ -0,0 +1,89 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from src.common.utils.cache import DEFAULT_CACHE_DIR, files_fingerprint, path_key, load_pickle_cache, \
+    store_pickle_cache
+from src.common.utils.files_io import load_json
+
+
+@dataclass
+class FinancialCorpus:
+    """
+    Parsed annotated StockExchangeDispatches. Row i consists of
+    company_names[company_ids[i]], texts[i] and sentiments[i].
+    """
+    company_names: List[str]
+    company_ids: np.ndarray
+    texts: List[str]
+    sentiments: np.ndarray
+
+    def __len__(self):
+        return len(self.texts)
+
+
+# (annotated data dir, fingerprint) to corpus, so that the corpus is parsed at most once per process.
+_LOADED_CORPORA: Dict[Tuple[str, str], FinancialCorpus] = {}
+
+
+def load_financial_corpus(
+        annotated_data_dir: str = "data/annotated",
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        use_cache: bool = True) -> FinancialCorpus:
+    """
+    Loads the annotated financial data. The parsed corpus is stored in cache_dir and reused
+    as long as none of the files in annotated_data_dir was added, removed or modified.
+    :param annotated_data_dir: path to the annotated data.
+    :param cache_dir: directory where the parsed corpus is stored.
+    :param use_cache: if False, the annotated data is always parsed from json files.
+    :return: FinancialCorpus with rows ordered the same way as in the annotated files.
+    """
+    file_paths = [f"{annotated_data_dir}/{filename}" for filename in os.listdir(annotated_data_dir)]
+    if not use_cache:
+        return _parse_financial_corpus(file_paths)
+
+    fingerprint = files_fingerprint(file_paths)
+    memo_key = (os.path.abspath(annotated_data_dir), fingerprint)
+    if memo_key in _LOADED_CORPORA:
+        return _LOADED_CORPORA[memo_key]
+
+    cache_path = f"{cache_dir}/financial_corpus_{path_key(annotated_data_dir)}.pkl"
+    corpus = load_pickle_cache(cache_path, fingerprint)
+    if corpus is None:
+        corpus = _parse_financial_corpus(file_paths)
+        store_pickle_cache(cache_path, fingerprint, corpus)
+
+    _LOADED_CORPORA[memo_key] = corpus
+    return corpus
+
+
+def iter_annotated_file(file_path: str) -> Iterator[Tuple[str, str, float]]:
+    """
+    Reads a single annotated file without building the whole corpus.
+    :param file_path: path to the annotated file.
+    :return: iterator of (company name, content, sentiment) of every annotated dispatch.
+    """
+    for annotated_company_row in load_json(file_path):
+        yield (annotated_company_row['company_name'],
+               annotated_company_row['content'],
+               float(annotated_company_row['sentiment']))
+
+
+def _parse_financial_corpus(file_paths: List[str]) -> FinancialCorpus:
+    company_name_to_id: Dict[str, int] = {}
+    company_ids, texts, sentiments = [], [], []
+    for file_path in file_paths:
+        for company_name, content, sentiment in iter_annotated_file(file_path):
+            if company_name not in company_name_to_id:
+                company_name_to_id[company_name] = len(company_name_to_id)
+            company_ids.append(company_name_to_id[company_name])
+            texts.append(content)
+            sentiments.append(sentiment)
+
+    return FinancialCorpus(
+        company_names=list(company_name_to_id),
+        company_ids=np.array(company_ids, dtype=np.int32),
+        texts=texts,
+        sentiments=np.array(sentiments, dtype=np.float64))
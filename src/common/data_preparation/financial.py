@@ -1,10 +1,11 @@
-import os
-import random
-from typing import Dict, Union, List, Tuple
+from typing import Dict, Union, List, Tuple, Iterator
 
-from sklearn.model_selection import train_test_split
+import numpy as np
 
-from src.common.utils.files_io import load_json
+from src.common.data_preparation.corpus import load_financial_corpus, FinancialCorpus
+from src.common.data_preparation.labels import label_sentiments, SENTIMENT_LABELS
+from src.common.data_preparation.splits import SplitIndices, stratified_split, company_split, \
+    group_stratified_k_fold
 
 DatasetLike = List[Dict[str, Union[str, int]]]
 
@@ -39,158 +40,93 @@ def generate_financial_dataset(
         "label": "positive / neutral / negative"
     }
     """
-
-    if test_size < 0 or val_size < 0 or test_size + val_size >= 1:
-        raise ValueError('Test size and val size should be non-negative and sum up to less than one')
-
-    annotated_data_num = 0
-    annotated_companies_data: Dict[str, DatasetLike] = {}  # name of a company to dataset.
-    for filename in os.listdir(annotated_data_dir):
-        file_path = f"{annotated_data_dir}/{filename}"
-        annotated_company = load_json(file_path)
-
-        for annotated_company_row in annotated_company:
-            company_name, content, label = _read_single_annotated_data_row(
-                annotated_company_row, positive_threshold, negative_threshold)
-
-            if company_name not in annotated_companies_data.keys():
-                annotated_companies_data[company_name] = []
-            if label in possible_labels:
-                annotated_companies_data[company_name].append({'text': content, 'label': label})
-                annotated_data_num += 1
-
-    random.seed(random_state)
+    corpus, label_codes, split = generate_financial_split_indices(
+        positive_threshold=positive_threshold,
+        negative_threshold=negative_threshold,
+        shuffle_companies=shuffle_companies,
+        possible_labels=possible_labels,
+        test_size=test_size,
+        val_size=val_size,
+        random_state=random_state,
+        annotated_data_dir=annotated_data_dir)
+
+    train_data = _materialize(corpus, label_codes, split.train)
+    test_data = _materialize(corpus, label_codes, split.test)
+    val_data = _materialize(corpus, label_codes, split.val)
+    return train_data, test_data, val_data
+
+
+def generate_financial_split_indices(
+        positive_threshold: float,
+        negative_threshold: float,
+        shuffle_companies: bool,
+        possible_labels: Tuple[str, ...],
+        test_size: float = 0.2,
+        val_size: float = 0.1,
+        random_state: int = 42,
+        annotated_data_dir: str = "data/annotated"
+) -> Tuple[FinancialCorpus, np.ndarray, SplitIndices]:
+    """
+    Same as generate_financial_dataset, but instead of copying the data returns indices of the corpus rows.
+    :return: corpus, label codes (indices of SENTIMENT_LABELS) of all corpus rows and the split indices.
+    """
+    corpus = load_financial_corpus(annotated_data_dir)
+    label_codes = label_sentiments(corpus.sentiments, positive_threshold, negative_threshold)
+    indices = _possible_indices(label_codes, possible_labels)
 
     # Shuffle companies means that the companies are shuffled between train / dev / test sets.
-    # Here, the datasets are shuffled, but the company data stays together.
+    # Otherwise, the datasets are shuffled, but the company data stays together.
     # So the result will be that company A is in train set, company B is in dev set,
     # company C is in test set.
-    if not shuffle_companies:
-        company_names = [company_name for company_name in annotated_companies_data]
-        random.shuffle(company_names)
-
-        next_id = 0
-        next_id, test_data = _get_non_shuffled_required_data(
-            annotated_companies_data=annotated_companies_data,
-            companies=company_names,
-            company_id=next_id,
-            possible_labels=possible_labels,
-            requirement=annotated_data_num * test_size)
-
-        next_id, val_data = _get_non_shuffled_required_data(
-            annotated_companies_data=annotated_companies_data,
-            companies=company_names,
-            company_id=next_id,
-            possible_labels=possible_labels,
-            requirement=annotated_data_num * val_size)
-
-        _, train_data = _get_non_shuffled_required_data(
-            annotated_companies_data=annotated_companies_data,
-            companies=company_names,
-            company_id=next_id,
-            possible_labels=possible_labels,
-            requirement=annotated_data_num)
-
-        return train_data, test_data, val_data
-
     if shuffle_companies:
-        annotated_data = []
-        for annotated_company_row in annotated_companies_data:
-            annotated_data.extend(annotated_companies_data[annotated_company_row])
-        random.shuffle(annotated_data)
-
-        train_and_test, val_data = train_test_split(
-            annotated_data,
-            test_size=val_size,
+        # Rows are grouped by company, in the order in which the companies appear in the corpus.
+        indices = indices[np.argsort(corpus.company_ids[indices], kind='stable')]
+        split = stratified_split(
+            label_codes,
+            test_size=test_size,
+            val_size=val_size,
             random_state=random_state,
-            stratify=[d["label"] for d in annotated_data])
-
-        test_size = (test_size / (1 - val_size))
-        train_data, test_data = train_test_split(
-            train_and_test,
+            indices=indices)
+    else:
+        split = company_split(
+            corpus.company_ids,
             test_size=test_size,
+            val_size=val_size,
             random_state=random_state,
-            stratify=[d["label"] for d in train_and_test])
+            indices=indices,
+            n_groups=len(corpus.company_names))
+    return corpus, label_codes, split
 
-        return train_data, test_data, val_data
 
-
-def _read_single_annotated_data_row(
-        annotated_company: dict,
+def generate_financial_k_folds(
         positive_threshold: float,
-        negative_threshold: float):
-    """
-    Reads the content of annotated data file
-    :param annotated_company: current company
-    :param positive_threshold: Lowest value for positive sentiment
-    :param negative_threshold: Highest value for negative sentiment
-    :return: company_name, content, sentiment
-    """
-    company_name = annotated_company['company_name']
-    report_content = annotated_company['content']
-    sentiment_value = annotated_company['sentiment']
-    sentiment_label = _apply_label_for_sentiment(sentiment_value, positive_threshold, negative_threshold)
-
-    return company_name, report_content, sentiment_label
-
-
-def _get_non_shuffled_required_data(
-        annotated_companies_data: Dict[str, DatasetLike],
-        companies: list,
-        company_id: int,
+        negative_threshold: float,
         possible_labels: Tuple[str, ...],
-        requirement: float):
-    """
-    Returns data starting from a company of given id, until requirement is met
-    :param companies: A dictionary of annotations for given company
-    :param companies: Companies to be analysed
-    :param company_id: Highest value for negative sentiment
-    :param requirement: minimal number of needed annotated data items
-    :return: first not analysed company, List of dicts containing content and message for given company
-    """
-    companies_data = []
-    current_data_size = 0
-    while current_data_size < requirement and company_id < len(companies):
-        company_name = companies[company_id]
-        annotated_info = annotated_companies_data[company_name]
-        companies_data += _generate_company_full_data(
-            annotated_companies_data, company_name, possible_labels)
-
-        current_data_size += len(annotated_info)
-        company_id += 1
-
-    return company_id, companies_data
-
-
-def _generate_company_full_data(
-        annotated_companies_data: Dict[str, DatasetLike],
-        company_name: str,
-        possible_labels: Tuple[str, ...]
-):
+        n_splits: int = 5,
+        random_state: int = 42,
+        annotated_data_dir: str = "data/annotated"
+) -> Tuple[FinancialCorpus, np.ndarray, Iterator[Tuple[np.ndarray, np.ndarray]]]:
     """
-    Returns full annotated information for given company name
-    :param annotated_companies_data: Annotated companies
-    :param company_name: Company name
-    :return: List of dicts containing content and message for given company
+    Generates company-disjoint, label-stratified folds for cross-validation over the financial corpus.
+    :param n_splits: number of folds.
+    :return: corpus, label codes (indices of SENTIMENT_LABELS) of all corpus rows
+    and an iterator of (train indices, test indices), one pair per fold.
     """
+    corpus = load_financial_corpus(annotated_data_dir)
+    label_codes = label_sentiments(corpus.sentiments, positive_threshold, negative_threshold)
+    folds = group_stratified_k_fold(
+        label_codes,
+        corpus.company_ids,
+        n_splits=n_splits,
+        random_state=random_state,
+        indices=_possible_indices(label_codes, possible_labels))
+    return corpus, label_codes, folds
 
-    company_full_data = []
-    for company_data in annotated_companies_data[company_name]:
-        if company_data['label'] in possible_labels:
-            company_full_data.append({'text': company_data['text'],
-                                      'label': company_data['label']})
 
-    return company_full_data
+def _possible_indices(label_codes: np.ndarray, possible_labels: Tuple[str, ...]) -> np.ndarray:
+    possible_codes = [code for code, label in enumerate(SENTIMENT_LABELS) if label in possible_labels]
+    return np.flatnonzero(np.isin(label_codes, possible_codes))
 
 
-def _apply_label_for_sentiment(
-        sentiment: float,
-        positive_threshold: float,
-        negative_threshold: float) -> str:
-    if negative_threshold >= positive_threshold:
-        raise ValueError("Negative threshold cannot be equal or greater than positive threshold!")
-    if sentiment <= negative_threshold:
-        return "negative"
-    if negative_threshold < sentiment < positive_threshold:
-        return "neutral"
-    return "positive"
+def _materialize(corpus: FinancialCorpus, label_codes: np.ndarray, indices: np.ndarray) -> DatasetLike:
+    return [{'text': corpus.texts[i], 'label': SENTIMENT_LABELS[label_codes[i]]} for i in indices]
@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+import numpy as np
+
+# Label codes returned by label_sentiments are indices of this tuple.
+SENTIMENT_LABELS = ("negative", "neutral", "positive")
+POSITIVE_THRESHOLD = 0.04
+NEGATIVE_THRESHOLD = -0.07
+
+
+def label_sentiments(
+        sentiments: np.ndarray,
+        positive_threshold: float,
+        negative_threshold: float) -> np.ndarray:
+    """
+    Maps sentiment values to label codes (indices of SENTIMENT_LABELS).
+    Values <= negative_threshold are negative, values >= positive_threshold are positive,
+    values in between are neutral.
+    :param sentiments: array of "sentiment" attributes of StockExchangeDispatches.
+    :param positive_threshold: Lowest value for positive sentiment
+    :param negative_threshold: Highest value for negative sentiment
+    :return: int8 array of label codes of the same shape as sentiments.
+    """
+    if negative_threshold >= positive_threshold:
+        raise ValueError("Negative threshold cannot be equal or greater than positive threshold!")
+    # np.digitize puts values equal to a bin edge into the upper bin. Moving the negative edge to the
+    # next representable float makes the negative threshold itself fall into the negative bin.
+    bins = np.array([np.nextafter(negative_threshold, np.inf), positive_threshold])
+    return np.digitize(np.asarray(sentiments, dtype=np.float64), bins).astype(np.int8)
+
+
+@dataclass
+class ThresholdSweep:
+    """
+    Class balance for each evaluated (negative, positive) threshold pair.
+    counts[i] holds the number of negative, neutral and positive samples
+    for negative_thresholds[i] and positive_thresholds[i].
+    """
+    negative_thresholds: np.ndarray
+    positive_thresholds: np.ndarray
+    counts: np.ndarray
+
+    @property
+    def fractions(self) -> np.ndarray:
+        totals = self.counts.sum(axis=1, keepdims=True)
+        return self.counts / np.maximum(totals, 1)
+
+    @property
+    def balance(self) -> np.ndarray:
+        """
+        Normalized entropy of the label distribution: 1 for perfectly balanced classes, 0 for a single class.
+        """
+        fractions = self.fractions
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -np.where(fractions > 0, fractions * np.log(fractions), 0.).sum(axis=1)
+        return entropy / np.log(len(SENTIMENT_LABELS))
+
+    def most_balanced(self, top: int = 10) -> np.ndarray:
+        """
+        :param top: number of threshold pairs to return.
+        :return: indices of the most balanced threshold pairs, best first.
+        """
+        return np.argsort(-self.balance, kind='stable')[:top]
+
+
+def sweep_thresholds(
+        sentiments: np.ndarray,
+        negative_thresholds: Sequence[float],
+        positive_thresholds: Sequence[float]) -> ThresholdSweep:
+    """
+    Computes the class balance for every valid pair from the grid of negative and positive thresholds.
+    The sentiments are sorted once and the class sizes of all pairs are read with a single searchsorted,
+    so the cost of the sweep barely depends on the number of evaluated pairs.
+    :param sentiments: array of "sentiment" attributes of StockExchangeDispatches.
+    :param negative_thresholds: candidate highest values for negative sentiment.
+    :param positive_thresholds: candidate lowest values for positive sentiment.
+    :return: ThresholdSweep for all pairs with negative threshold lower than positive threshold.
+    """
+    sorted_sentiments = np.sort(np.asarray(sentiments, dtype=np.float64))
+    negative_grid, positive_grid = np.meshgrid(
+        np.asarray(negative_thresholds, dtype=np.float64),
+        np.asarray(positive_thresholds, dtype=np.float64),
+        indexing='ij')
+    valid = negative_grid < positive_grid
+    negative_grid, positive_grid = negative_grid[valid], positive_grid[valid]
+
+    negative_counts = np.searchsorted(sorted_sentiments, negative_grid, side='right')
+    not_positive_counts = np.searchsorted(sorted_sentiments, positive_grid, side='left')
+    counts = np.stack([
+        negative_counts,
+        not_positive_counts - negative_counts,
+        len(sorted_sentiments) - not_positive_counts
+    ], axis=1)
+    return ThresholdSweep(negative_grid, positive_grid, counts)
+
+
+def quantile_thresholds(
+        sentiments: np.ndarray,
+        negative_quantile: float = 1 / 3,
+        positive_quantile: float = 2 / 3) -> Tuple[float, float]:
+    """
+    Chooses thresholds from the distribution of sentiments. With the default quantiles
+    each of the classes gets roughly a third of the samples.
+    :param sentiments: array of "sentiment" attributes of StockExchangeDispatches.
+    :param negative_quantile: fraction of samples that should be labelled as negative.
+    :param positive_quantile: fraction of samples that should not be labelled as positive.
+    :return: negative threshold, positive threshold
+    """
+    if not 0 < negative_quantile < positive_quantile < 1:
+        raise ValueError('Quantiles should satisfy 0 < negative_quantile < positive_quantile < 1')
+    negative_threshold, positive_threshold = np.quantile(
+        np.asarray(sentiments, dtype=np.float64), [negative_quantile, positive_quantile])
+    return float(negative_threshold), float(positive_threshold)
@@ -1,5 +1,11 @@
+from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Dict, List, Union, Tuple
+from typing import Dict, List, Union, Tuple, Iterator, Optional
+
+import numpy as np
+
+from src.common.utils.cache import DEFAULT_CACHE_DIR, files_fingerprint, path_key, load_pickle_cache, \
+    store_pickle_cache
 
 
 class KlejType(Enum):
@@ -19,6 +25,25 @@ KLEJ_FILE_LABEL_TO_LABEL = {
     "__label__meta_minus_m": "negative"
 }
 
+# Label codes stored in KlejSplit are indices of this tuple. Unknown labels are stored as -1.
+KLEJ_LABELS = tuple(KLEJ_FILE_LABEL_TO_LABEL.values())
+
+
+@dataclass
+class KlejSplit:
+    """
+    Parsed klej file. Row i consists of texts[i] and label KLEJ_LABELS[label_codes[i]].
+    """
+    texts: List[str]
+    label_codes: np.ndarray
+
+    def __len__(self):
+        return len(self.texts)
+
+
+# (file path, fingerprint) to parsed file, so that every file is parsed at most once per process.
+_LOADED_SPLITS: Dict[Tuple[str, str], KlejSplit] = {}
+
 
 def read_klej(
         klej_type: KlejType,
@@ -43,25 +68,74 @@ def read_klej(
 
     test_features.tsv are currently not used.
     """
-    dir_path = KLEJ_TYPE_TO_PATH.get(klej_type)
-    return {
-        'train': _read_klej_file(f'{dir_path}/train.tsv', labels_to_return=labels_to_return),
-        'dev': _read_klej_file(f'{dir_path}/dev.tsv', labels_to_return=labels_to_return)
-    }
+    result = {}
+    for split in ('train', 'dev'):
+        texts, labels = read_klej_texts_labels(klej_type, split, labels_to_return)
+        result[split] = [{"text": text, "label": label} for text, label in zip(texts, labels)]
+    return result
+
+
+def read_klej_texts_labels(
+        klej_type: KlejType,
+        split: str,
+        labels_to_return: Tuple[str, ...]) -> Tuple[List[str], List[str]]:
+    """
+    Reads a single split of klej dataset without building a dict per sample.
+    :param klej_type: KlejType.IN or KlejType.OUT.
+    :param split: "train" or "dev".
+    :param labels_to_return: List of labels to return. Possible values: "amb", "positive", "neutral", "negative".
+    :return: texts and labels of the samples with one of labels_to_return.
+    """
+    klej_split = load_klej_split(klej_type, split)
+    codes_to_return = [code for code, label in enumerate(KLEJ_LABELS) if label in labels_to_return]
+    indices = np.flatnonzero(np.isin(klej_split.label_codes, codes_to_return))
+    return [klej_split.texts[i] for i in indices], [KLEJ_LABELS[klej_split.label_codes[i]] for i in indices]
+
+
+def load_klej_split(
+        klej_type: KlejType,
+        split: str,
+        cache_dir: str = DEFAULT_CACHE_DIR) -> KlejSplit:
+    """
+    Loads a parsed klej file. The parsed form is stored in cache_dir and reused as long as the file is not modified.
+    :param klej_type: KlejType.IN or KlejType.OUT.
+    :param split: "train" or "dev".
+    :param cache_dir: directory where the parsed file is stored.
+    :return: KlejSplit with all samples of the file.
+    """
+    filepath = f'{KLEJ_TYPE_TO_PATH.get(klej_type)}/{split}.tsv'
+    fingerprint = files_fingerprint([filepath])
+    memo_key = (filepath, fingerprint)
+    if memo_key in _LOADED_SPLITS:
+        return _LOADED_SPLITS[memo_key]
+
+    cache_path = f'{cache_dir}/klej_{path_key(filepath)}.pkl'
+    klej_split = load_pickle_cache(cache_path, fingerprint)
+    if klej_split is None:
+        klej_split = _parse_klej_file(filepath)
+        store_pickle_cache(cache_path, fingerprint, klej_split)
 
+    _LOADED_SPLITS[memo_key] = klej_split
+    return klej_split
 
-def _read_klej_file(
-        filepath: str,
-        labels_to_return: Tuple[str, ...]) -> List[Dict[str, Union[str, int]]]:
-    result = []
-    with open(filepath, "r") as f:
-        lines = f.readlines()[1:]  # first line contains column names
-        for line in lines:
+
+def iter_klej_file(filepath: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Lazily reads a klej tsv file line by line.
+    :param filepath: path to the tsv file.
+    :return: iterator of (text, label) pairs. Label is None if it is not one of KLEJ_FILE_LABEL_TO_LABEL.
+    """
+    with open(filepath, "r", encoding='utf-8') as f:
+        next(f, None)  # first line contains column names
+        for line in f:
             text, label = line.split('\t')
-            label = KLEJ_FILE_LABEL_TO_LABEL.get(label.strip())
-            if label in labels_to_return:
-                result.append({
-                    "text": text.strip(),
-                    "label": label
-                })
-    return result
+            yield text.strip(), KLEJ_FILE_LABEL_TO_LABEL.get(label.strip())
+
+
+def _parse_klej_file(filepath: str) -> KlejSplit:
+    label_to_code = {label: code for code, label in enumerate(KLEJ_LABELS)}
+    texts, label_codes = [], []
+    for text, label in iter_klej_file(filepath):
+        texts.append(text)
+        label_codes.append(label_to_code.get(label, -1))
+    return KlejSplit(texts=texts, label_codes=np.array(label_codes, dtype=np.int8))
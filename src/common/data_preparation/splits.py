@@ -0,0 +1,161 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class SplitIndices:
+    """
+    Integer indices of the rows of a corpus that belong to each of the sets.
+    """
+    train: np.ndarray
+    val: np.ndarray
+    test: np.ndarray
+
+
+def stratified_split(
+        labels: np.ndarray,
+        test_size: float,
+        val_size: float,
+        random_state: int = 42,
+        indices: Optional[np.ndarray] = None) -> SplitIndices:
+    """
+    Splits rows into train / val / test sets preserving the label distribution in each of them.
+    :param labels: label codes of all rows of the corpus.
+    :param test_size: float between 0-1. A fraction of the rows that should be used as test set.
+    :param val_size: float between 0-1. A fraction of the rows that should be used as validation set.
+    :param random_state: Seed used for generating random split.
+    :param indices: rows taken into account. All rows are used by default.
+    :return: SplitIndices of rows of the corpus.
+    """
+    _validate_sizes(test_size, val_size)
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+
+    order = list(range(len(indices)))
+    random.seed(random_state)
+    random.shuffle(order)
+    shuffled = indices[order]
+
+    from sklearn.model_selection import train_test_split
+
+    train_and_test, val = train_test_split(
+        shuffled,
+        test_size=val_size,
+        random_state=random_state,
+        stratify=labels[shuffled])
+    train, test = train_test_split(
+        train_and_test,
+        test_size=test_size / (1 - val_size),
+        random_state=random_state,
+        stratify=labels[train_and_test])
+    return SplitIndices(train=train, val=val, test=test)
+
+
+def company_split(
+        groups: np.ndarray,
+        test_size: float,
+        val_size: float,
+        random_state: int = 42,
+        indices: Optional[np.ndarray] = None,
+        n_groups: Optional[int] = None) -> SplitIndices:
+    """
+    Splits rows into train / val / test sets so that all rows of a company end up in the same set.
+    Companies are shuffled and assigned to the test set, then to the validation set
+    until each of them holds at least the required fraction of rows. The rest is used for training.
+    :param groups: company ids of all rows of the corpus.
+    :param test_size: float between 0-1. A fraction of the rows that should be used as test set.
+    :param val_size: float between 0-1. A fraction of the rows that should be used as validation set.
+    :param random_state: Seed used for generating random split of companies.
+    :param indices: rows taken into account. All rows are used by default.
+    :param n_groups: number of companies in the corpus, including ones without any of the rows in indices.
+    :return: SplitIndices of rows of the corpus.
+    """
+    _validate_sizes(test_size, val_size)
+    indices = np.arange(len(groups)) if indices is None else np.asarray(indices)
+    row_groups = groups[indices]
+    n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+
+    company_order = list(range(n_groups))
+    random.seed(random_state)
+    random.shuffle(company_order)
+    company_rank = np.empty(n_groups, dtype=np.int64)
+    company_rank[company_order] = np.arange(n_groups)
+
+    # Rows ordered by the shuffled companies, so that every set is a contiguous slice.
+    ordered = indices[np.argsort(company_rank[row_groups], kind='stable')]
+    company_ends = np.cumsum(np.bincount(row_groups, minlength=n_groups)[company_order])
+
+    test_end = _first_end_reaching(company_ends, 0, len(indices) * test_size)
+    val_end = _first_end_reaching(company_ends, test_end, test_end + len(indices) * val_size)
+    return SplitIndices(
+        train=ordered[val_end:],
+        val=ordered[test_end:val_end],
+        test=ordered[:test_end])
+
+
+def group_stratified_k_fold(
+        labels: np.ndarray,
+        groups: np.ndarray,
+        n_splits: int = 5,
+        random_state: int = 42,
+        indices: Optional[np.ndarray] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Generates company-disjoint folds with label distributions as close as possible to the whole set.
+    :param labels: label codes of all rows of the corpus.
+    :param groups: company ids of all rows of the corpus.
+    :param n_splits: number of folds.
+    :param random_state: Seed used for generating random folds.
+    :param indices: rows taken into account. All rows are used by default.
+    :return: iterator of (train indices, test indices) of rows of the corpus, one pair per fold.
+    """
+    from sklearn.model_selection import StratifiedGroupKFold
+
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+    k_fold = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for train, test in k_fold.split(np.empty(len(indices)), labels[indices], groups[indices]):
+        yield indices[train], indices[test]
+
+
+def file_split(
+        file_paths: List[str],
+        test_size: float,
+        val_size: float,
+        random_state: int = 42) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Splits files into train / val / test sets without reading them, using file sizes as a proxy
+    for the number of rows. Files are shuffled and assigned the same way as companies in company_split.
+    :param file_paths: paths of the files, e.g. one annotated file per company.
+    :param test_size: float between 0-1. A fraction of the data that should be used as test set.
+    :param val_size: float between 0-1. A fraction of the data that should be used as validation set.
+    :param random_state: Seed used for generating random split of files.
+    :return: train, val, test file paths.
+    """
+    _validate_sizes(test_size, val_size)
+    file_paths = sorted(file_paths)
+    random.seed(random_state)
+    random.shuffle(file_paths)
+    file_ends = np.cumsum([os.path.getsize(file_path) for file_path in file_paths])
+    total_size = int(file_ends[-1]) if len(file_ends) else 0
+
+    test_end = _first_end_reaching(file_ends, 0, total_size * test_size)
+    val_end = _first_end_reaching(file_ends, test_end, test_end + total_size * val_size)
+    test_count, val_count = np.searchsorted(file_ends, [test_end, val_end], side='right')
+    return file_paths[val_count:], file_paths[test_count:val_count], file_paths[:test_count]
+
+
+def _first_end_reaching(company_ends: np.ndarray, start: int, requirement: float) -> int:
+    """
+    :return: end of the first company, starting after position start, at which requirement is met.
+    """
+    if start >= requirement:
+        return start
+    position = np.searchsorted(company_ends, requirement, side='left')
+    return int(company_ends[position]) if position < len(company_ends) else int(company_ends[-1])
+
+
+def _validate_sizes(test_size: float, val_size: float) -> None:
+    if test_size < 0 or val_size < 0 or test_size + val_size >= 1:
+        raise ValueError('Test size and val size should be non-negative and sum up to less than one')
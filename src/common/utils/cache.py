@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pickle
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = "data/cache"
+
+
+def files_fingerprint(paths: Iterable[str]) -> str:
+    """
+    Computes a fingerprint of the given files based on their paths, sizes and modification times.
+    Adding, removing or modifying any of the files results in a different fingerprint.
+    :param paths: paths of the files to fingerprint.
+    :return: hex digest of the fingerprint.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def path_key(path: str) -> str:
+    """
+    :param path: path to a file or a directory.
+    :return: short, filename-safe key identifying the absolute path.
+    """
+    return hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_pickle_cache(cache_path: str, fingerprint: str) -> Optional[Any]:
+    """
+    Loads a payload stored with store_pickle_cache.
+    :param cache_path: path to the cache file.
+    :param fingerprint: fingerprint of the data the payload was created from.
+    :return: the cached payload or None, if the cache does not exist, is corrupted or is outdated.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            # The fingerprint is stored first, so that an outdated payload is never unpickled.
+            if pickle.load(cache_file) != fingerprint:
+                return None
+            return pickle.load(cache_file)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+
+def store_pickle_cache(cache_path: str, fingerprint: str, payload: Any) -> None:
+    """
+    Atomically stores a payload together with the fingerprint of the data it was created from.
+    :param cache_path: path to the cache file. Missing directories are created.
+    :param fingerprint: fingerprint of the data the payload was created from.
+    :param payload: any picklable object.
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as cache_file:
+        pickle.dump(fingerprint, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(payload, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def text_hashes(texts: Iterable[str]) -> np.ndarray:
+    """
+    :param texts: texts to hash.
+    :return: uint64 array with a 64-bit blake2b hash of every text.
+    """
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') for text in texts),
+        dtype=np.uint64)
+
+
+class HashedShardStore:
+    """
+    Append-only on-disk store of numpy arrays with rows identified by 64-bit hashes.
+    Every add creates a new shard directory with one .npy file per array,
+    so readers memory-map existing shards and concurrent writers never modify the same files.
+    """
+    HASHES = 'hashes'
+
+    def __init__(self, directory: str):
+        """
+        :param directory: directory where the shards are stored.
+        """
+        self._directory = directory
+        self._shards: Dict[str, Dict[str, np.ndarray]] = {}
+        self._shard_names: List[str] = []
+        self._sorted_hashes = np.empty(0, dtype=np.uint64)
+        self._sorted_shard_ids = np.empty(0, dtype=np.int64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Rebuilds the hash index from the shards currently present on disk.
+        """
+        shard_names = sorted(
+            name for name in os.listdir(self._directory)
+            if not name.endswith('.tmp') and os.path.isdir(f'{self._directory}/{name}')
+        ) if os.path.isdir(self._directory) else []
+        hashes, shard_ids, rows = [], [], []
+        for shard_id, shard_name in enumerate(shard_names):
+            shard_hashes = self.shard(shard_name)[self.HASHES]
+            hashes.append(shard_hashes)
+            shard_ids.append(np.full(len(shard_hashes), shard_id, dtype=np.int64))
+            rows.append(np.arange(len(shard_hashes), dtype=np.int64))
+
+        self._shard_names = shard_names
+        if not hashes:
+            return
+        hashes, shard_ids, rows = np.concatenate(hashes), np.concatenate(shard_ids), np.concatenate(rows)
+        order = np.argsort(hashes, kind='stable')
+        self._sorted_hashes, self._sorted_shard_ids, self._sorted_rows = hashes[order], shard_ids[order], rows[order]
+
+    @property
+    def shard_names(self) -> List[str]:
+        return self._shard_names
+
+    def shard(self, shard_name: str) -> Dict[str, np.ndarray]:
+        """
+        :param shard_name: name of the shard.
+        :return: arrays of the shard, memory-mapped from disk.
+        """
+        if shard_name not in self._shards:
+            shard_dir = f'{self._directory}/{shard_name}'
+            self._shards[shard_name] = {
+                filename[:-len('.npy')]: np.load(f'{shard_dir}/{filename}', mmap_mode='r')
+                for filename in os.listdir(shard_dir) if filename.endswith('.npy')
+            }
+        return self._shards[shard_name]
+
+    def lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param hashes: uint64 hashes to look for.
+        :return: shard ids (indices of shard_names) and rows of the hashes; -1 for hashes not found in the store.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(self._sorted_hashes):
+            return np.full(len(hashes), -1, dtype=np.int64), np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._sorted_hashes, hashes), len(self._sorted_hashes) - 1)
+        found = self._sorted_hashes[positions] == hashes
+        return np.where(found, self._sorted_shard_ids[positions], -1), np.where(found, self._sorted_rows[positions], -1)
+
+    def add(self, hashes: np.ndarray, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Stores arrays as a new shard and makes them visible to lookup.
+        :param hashes: uint64 hashes identifying the stored rows.
+        :param arrays: arrays to store. Their meaning is up to the caller.
+        """
+        shard_name = f'{time.time_ns():020d}_{os.getpid()}'
+        tmp_dir = f'{self._directory}/{shard_name}.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(f'{tmp_dir}/{self.HASHES}.npy', np.asarray(hashes, dtype=np.uint64))
+        for name, array in arrays.items():
+            np.save(f'{tmp_dir}/{name}.npy', array)
+        os.rename(tmp_dir, f'{self._directory}/{shard_name}')
+        self.refresh()
@@ -0,0 +1,34 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional, Tuple
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+async def read_http_message(reader: asyncio.StreamReader) -> Optional[Tuple[str, Dict[str, str], bytes]]:
+    """
+    :return: start line, headers (with lowercase names) and body of an HTTP message,
+    or None if the connection was closed.
+    """
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return start_line.decode('latin-1').strip(), headers, body
+
+
+def write_http_message(writer: asyncio.StreamWriter, start_line: str, payload: Any) -> None:
+    """
+    Writes an HTTP message with a JSON body.
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    writer.write(f'{start_line}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'
+                 .encode('latin-1') + body)
@@ -0,0 +1,25 @@
+import os
+import time
+
+
+def seconds_since_start() -> float:
+    """
+    :return: time elapsed since the start of the process, including the start of the interpreter and imports.
+    Where /proc is not available, CPU time of the process is returned instead.
+    """
+    try:
+        with open('/proc/self/stat') as stat_file:
+            # Fields after the command name, which may contain spaces; the start time is field 22 of the file.
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.process_time()
+
+
+def report_startup(stage: str) -> None:
+    """
+    Prints the time elapsed since the start of the process when a stage of the startup is finished.
+    """
+    print(f'[startup {seconds_since_start():.2f}s] {stage}')
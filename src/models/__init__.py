@@ -1,3 +1,9 @@
-from .read import read_from_dir
-
 MODEL_USED = "allegro/herbert-base-cased"
+
+
+def __getattr__(name: str):
+    # read_from_dir imports transformers and torch, so it is imported on first use rather than with the package.
+    if name == "read_from_dir":
+        from .read import read_from_dir
+        return read_from_dir
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
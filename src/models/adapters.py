@@ -0,0 +1,184 @@
+import json
+import math
+import os
+from typing import Any, Dict, Sequence
+
+import torch
+from transformers import PreTrainedModel, PreTrainedTokenizer, BertForSequenceClassification, PretrainedConfig
+
+ADAPTER_CONFIG_FILE = "adapter_config.json"
+ADAPTER_WEIGHTS_FILE = "adapter_model.safetensors"
+PEFT_MODES = ("full", "freeze", "lora")
+LORA_TARGET_MODULES = ("query", "value")
+
+
+class LoRALinear(torch.nn.Module):
+    """
+    Linear layer with a frozen weight W and a trainable low-rank update: y = xW^T + b + (alpha / rank) * xA^TB^T.
+    B starts with zeros, so the wrapped layer initially computes exactly the same output as the original one.
+    """
+
+    def __init__(self, base: torch.nn.Linear, rank: int = 8, alpha: float = 16., dropout: float = 0.1):
+        """
+        :param base: Linear layer whose weight and bias are frozen.
+        :param rank: rank of the update.
+        :param alpha: scaling of the update, divided by the rank.
+        :param dropout: dropout applied to the input of the update.
+        """
+        super().__init__()
+        self.base = base
+        for parameter in self.base.parameters():
+            parameter.requires_grad = False
+        self.lora_A = torch.nn.Parameter(torch.empty(rank, base.in_features))
+        self.lora_B = torch.nn.Parameter(torch.zeros(base.out_features, rank))
+        torch.nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.scaling = alpha / rank
+        self.dropout = torch.nn.Dropout(dropout)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.base(x) + (self.dropout(x) @ self.lora_A.T @ self.lora_B.T) * self.scaling
+
+    def merged(self) -> torch.nn.Linear:
+        """
+        :return: Linear layer with the update added to its weight, computing the same output without the overhead.
+        """
+        merged = torch.nn.Linear(self.base.in_features, self.base.out_features, bias=self.base.bias is not None)
+        with torch.no_grad():
+            merged.weight.copy_(self.base.weight + (self.lora_B @ self.lora_A) * self.scaling)
+            if self.base.bias is not None:
+                merged.bias.copy_(self.base.bias)
+        return merged
+
+
+def prepare_peft_model(
+        model: BertForSequenceClassification,
+        mode: str,
+        base_model: str,
+        freeze_layers: int = 8,
+        lora_rank: int = 8,
+        lora_alpha: float = 16.,
+        lora_dropout: float = 0.1,
+        lora_target_modules: Sequence[str] = LORA_TARGET_MODULES) -> BertForSequenceClassification:
+    """
+    Prepares a pretrained model for parameter-efficient fine-tuning:
+    - "freeze" freezes the embeddings and the lower freeze_layers encoder layers,
+    - "lora" freezes the whole encoder and wraps its target Linear layers in LoRALinear,
+    - "full" leaves all parameters trainable.
+    The classifier is always trained. The settings are kept in model.adapter_config, so that save_adapter_model
+    saves only the trainable parameters and load_adapter_model re-composes them with the base model.
+    :param model: model with pretrained weights of base_model.
+    :param mode: one of PEFT_MODES.
+    :param base_model: name or path of the pretrained model, used to load it again with the adapter.
+    :param freeze_layers: number of the lower encoder layers frozen in the "freeze" mode.
+    :param lora_rank: rank of the LoRA updates.
+    :param lora_alpha: scaling of the LoRA updates.
+    :param lora_dropout: dropout applied to the input of the LoRA updates.
+    :param lora_target_modules: names of the Linear layers of every encoder layer wrapped in LoRALinear.
+    :return: the modified model.
+    """
+    if mode not in PEFT_MODES:
+        raise ValueError(f'Unknown fine-tuning mode {mode}, expected one of {PEFT_MODES}')
+    if mode == "full":
+        return model
+    adapter_config = {'mode': mode, 'base_model': base_model}
+    if mode == "freeze":
+        if not 0 <= freeze_layers <= model.config.num_hidden_layers:
+            raise ValueError(f'Cannot freeze {freeze_layers} of {model.config.num_hidden_layers} encoder layers')
+        adapter_config['freeze_layers'] = freeze_layers
+    else:
+        adapter_config.update(
+            lora_rank=lora_rank,
+            lora_alpha=lora_alpha,
+            lora_dropout=lora_dropout,
+            lora_target_modules=list(lora_target_modules))
+    _apply_adapter_config(model, adapter_config)
+
+    trainable = sum(parameter.numel() for parameter in model.parameters() if parameter.requires_grad)
+    total = sum(parameter.numel() for parameter in model.parameters())
+    print(f'Fine-tuning mode {mode}: {trainable} of {total} parameters trainable ({trainable / total:.2%})')
+    return model
+
+
+def is_adapter_model(model: PreTrainedModel) -> bool:
+    return getattr(model, 'adapter_config', None) is not None
+
+
+def save_adapter_model(model: PreTrainedModel, output_dir: str, tokenizer: PreTrainedTokenizer = None) -> None:
+    """
+    Saves only the trainable parameters of a model prepared by prepare_peft_model, with the adapter settings,
+    the configuration and the tokenizer, so that read_from_dir(output_dir) re-composes the model with the base model.
+    """
+    from safetensors.torch import save_file
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    if tokenizer is not None:
+        tokenizer.save_pretrained(output_dir)
+    with open(f"{output_dir}/{ADAPTER_CONFIG_FILE}", 'w', encoding='utf-8') as config_file:
+        json.dump(model.adapter_config, config_file, indent=2)
+    tensors = {
+        name: parameter.detach().contiguous()
+        for name, parameter in model.named_parameters() if parameter.requires_grad
+    }
+    save_file(tensors, f"{output_dir}/{ADAPTER_WEIGHTS_FILE}")
+
+
+def load_adapter_model(model_dir: str, config: PretrainedConfig) -> BertForSequenceClassification:
+    """
+    Loads the base model and replaces its trainable parameters with the ones saved by save_adapter_model.
+    LoRA updates are merged into the weights, so the returned model has the architecture of the base model
+    and runs, exports and quantizes as a fully fine-tuned one.
+    :param model_dir: directory with the adapter saved by save_adapter_model.
+    :param config: configuration of the model.
+    :return: model in eval mode.
+    """
+    from safetensors.torch import load_file
+
+    with open(f"{model_dir}/{ADAPTER_CONFIG_FILE}", encoding='utf-8') as config_file:
+        adapter_config = json.load(config_file)
+    # The classifier of the base model is missing and initialized randomly, before it is replaced by the saved one.
+    model = BertForSequenceClassification.from_pretrained(adapter_config['base_model'], config=config)
+    _apply_adapter_config(model, adapter_config)
+
+    tensors = load_file(f"{model_dir}/{ADAPTER_WEIGHTS_FILE}")
+    missing = {name for name, parameter in model.named_parameters() if parameter.requires_grad} - tensors.keys()
+    if missing:
+        raise ValueError(f'Adapter in {model_dir} is missing parameters: {sorted(missing)}')
+    model.load_state_dict(tensors, strict=False)
+    return merge_lora_layers(model).eval()
+
+
+def merge_lora_layers(model: PreTrainedModel) -> PreTrainedModel:
+    """
+    Replaces every LoRALinear layer with a Linear layer with the merged weight.
+    :return: the modified model, without the adapter settings.
+    """
+    lora_layers = [(name, module) for name, module in model.named_modules() if isinstance(module, LoRALinear)]
+    for name, module in lora_layers:
+        parent_name, child_name = name.rsplit('.', 1)
+        setattr(model.get_submodule(parent_name), child_name, module.merged())
+    model.adapter_config = None
+    return model
+
+
+def _apply_adapter_config(model: BertForSequenceClassification, adapter_config: Dict[str, Any]) -> None:
+    if adapter_config['mode'] == "freeze":
+        frozen = [model.bert.embeddings, *model.bert.encoder.layer[:adapter_config['freeze_layers']]]
+    else:
+        frozen = [model.bert]
+    for module in frozen:
+        for parameter in module.parameters():
+            parameter.requires_grad = False
+
+    if adapter_config['mode'] == "lora":
+        for layer in model.bert.encoder.layer:
+            for name, module in list(layer.named_modules()):
+                if name.rsplit('.', 1)[-1] in adapter_config['lora_target_modules'] and \
+                        isinstance(module, torch.nn.Linear):
+                    parent_name, child_name = name.rsplit('.', 1)
+                    setattr(layer.get_submodule(parent_name), child_name, LoRALinear(
+                        module,
+                        rank=adapter_config['lora_rank'],
+                        alpha=adapter_config['lora_alpha'],
+                        dropout=adapter_config['lora_dropout']))
+    model.adapter_config = adapter_config
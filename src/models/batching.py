@@ -0,0 +1,174 @@
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Sampler
+
+
+class PaddingCollator:
+    """
+    Pads unpadded items of SentimentAnalysisDataset to the longest item of each batch.
+    """
+
+    def __init__(self, pad_values: Dict[str, int]):
+        """
+        :param pad_values: value used for padding of every key. Keys without a value are padded with 0.
+        """
+        self._pad_values = pad_values
+
+    def __call__(self, items: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        batch = {}
+        for key in items[0]:
+            values = [item[key] for item in items]
+            # Values of whole texts, e.g. labels or logits of a teacher model, are not padded.
+            if values[0].dim() == 0 or values[0].is_floating_point():
+                batch[key] = torch.stack(values)
+            else:
+                batch[key] = pad_sequence(
+                    values, batch_first=True, padding_value=self._pad_values.get(key, 0)).long()
+        return batch
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Yields indices so that consecutive batches of batch_size indices contain texts of similar length.
+    Indices are randomly divided into buckets of batch_size * bucket_size_multiplier texts,
+    each bucket is sorted by length and cut into batches, and the order of the batches is shuffled.
+    """
+
+    def __init__(
+            self,
+            lengths: np.ndarray,
+            batch_size: int,
+            bucket_size_multiplier: int = 50,
+            shuffle: bool = True,
+            seed: int = 42):
+        """
+        :param lengths: number of tokens of every text of the dataset.
+        :param batch_size: number of texts in a batch.
+        :param bucket_size_multiplier: number of batches in a bucket. The larger, the more similar
+        lengths within a batch and the less random the batches are.
+        :param shuffle: if False, batches are ordered from the longest to the shortest texts.
+        :param seed: random seed. The order changes with every epoch.
+        """
+        super().__init__()
+        self._lengths = np.asarray(lengths)
+        self._batch_size = batch_size
+        self._bucket_size = batch_size * bucket_size_multiplier
+        self._shuffle = shuffle
+        self._seed = seed
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch = epoch
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __iter__(self) -> Iterator[int]:
+        if not self._shuffle:
+            yield from np.argsort(-self._lengths, kind='stable').tolist()
+            return
+
+        generator = np.random.default_rng((self._seed, self._epoch))
+        self._epoch += 1
+        indices = generator.permutation(len(self._lengths))
+        batches = []
+        for bucket_start in range(0, len(indices), self._bucket_size):
+            bucket = indices[bucket_start:bucket_start + self._bucket_size]
+            bucket = bucket[np.argsort(-self._lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self._batch_size] for i in range(0, len(bucket), self._batch_size))
+        for batch_id in generator.permutation(len(batches)):
+            yield from batches[batch_id].tolist()
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    Yields batches of indices packed with texts of similar length, so that the padded batch
+    (number of texts * length of the longest of them) holds at most max_tokens tokens.
+    A text longer than max_tokens forms a batch on its own.
+    """
+
+    def __init__(
+            self,
+            lengths: np.ndarray,
+            max_tokens: int,
+            shuffle: bool = True,
+            bucket_size: int = 4096,
+            seed: int = 42):
+        """
+        :param lengths: number of tokens of every text of the dataset.
+        :param max_tokens: maximal number of tokens of a padded batch.
+        :param shuffle: if False, all texts are sorted from the longest to the shortest and the order
+        of the batches is deterministic. Otherwise texts are packed within random buckets and batches are shuffled.
+        :param bucket_size: number of texts in a bucket sorted by length when shuffling.
+        :param seed: random seed. The batches change with every epoch.
+        """
+        super().__init__()
+        self._lengths = np.asarray(lengths)
+        self._max_tokens = max_tokens
+        self._shuffle = shuffle
+        self._bucket_size = bucket_size
+        self._seed = seed
+        self._epoch = 0
+        self._batches = self._create_batches()
+
+    def set_epoch(self, epoch: int) -> None:
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._batches = self._create_batches()
+
+    @property
+    def batches(self) -> List[np.ndarray]:
+        """
+        :return: batches that will be yielded by the next iteration.
+        """
+        return self._batches
+
+    def __len__(self):
+        return len(self._batches)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._batches
+        self.set_epoch(self._epoch + 1)
+        for batch in batches:
+            yield batch.tolist()
+
+    def _create_batches(self) -> List[np.ndarray]:
+        if not self._shuffle:
+            return self._pack(np.argsort(-self._lengths, kind='stable'))
+
+        generator = np.random.default_rng((self._seed, self._epoch))
+        indices = generator.permutation(len(self._lengths))
+        batches = []
+        for bucket_start in range(0, len(indices), self._bucket_size):
+            bucket = indices[bucket_start:bucket_start + self._bucket_size]
+            batches.extend(self._pack(bucket[np.argsort(-self._lengths[bucket], kind='stable')]))
+        return [batches[batch_id] for batch_id in generator.permutation(len(batches))]
+
+    def _pack(self, sorted_indices: np.ndarray) -> List[np.ndarray]:
+        """
+        :param sorted_indices: indices of texts sorted from the longest to the shortest.
+        """
+        batches, start = [], 0
+        while start < len(sorted_indices):
+            # The first text of a batch is the longest one, so it determines the padded length.
+            batch_size = max(self._max_tokens // max(int(self._lengths[sorted_indices[start]]), 1), 1)
+            batches.append(sorted_indices[start:start + batch_size])
+            start += batch_size
+        return batches
+
+
+def padding_efficiency(lengths: np.ndarray, batches: Iterable[Sequence[int]]) -> float:
+    """
+    :param lengths: number of tokens of every text.
+    :param batches: batches of indices of texts.
+    :return: fraction of the tokens of padded batches that are not padding.
+    """
+    real_tokens, padded_tokens = 0, 0
+    for batch in batches:
+        batch_lengths = lengths[np.asarray(batch)]
+        real_tokens += int(batch_lengths.sum())
+        padded_tokens += int(batch_lengths.max()) * len(batch_lengths) if len(batch_lengths) else 0
+    return real_tokens / padded_tokens if padded_tokens else 1.
@@ -1,42 +1,62 @@
-from typing import Tuple, Dict, Union, List
+from typing import Tuple, Dict, Union, List, Optional
 
+import numpy as np
 import torch
 from abc import ABC, abstractmethod
-from sklearn.model_selection import train_test_split
 from transformers import PreTrainedTokenizer
 
-from src.common.data_preparation import read_klej, KlejType, generate_financial_dataset
+from src.common.data_preparation import read_klej, read_klej_texts_labels, KlejType, generate_financial_dataset, \
+    POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
+from src.models.encoding_cache import EncodingCache
+from src.models.batching import PaddingCollator
+from src.models.encodings import RaggedEncodings, encode_texts, get_pad_values
 
-POSITIVE_THRESHOLD = 0.04
-NEGATIVE_THRESHOLD = -0.07
 DEFAULT_POSSIBLE_LABELS = ("positive", "negative", "neutral")
 TorchDataset = torch.utils.data.Dataset
 DatasetLike = List[Dict[str, Union[str, int]]]
 
 
 class SentimentAnalysisDataset(TorchDataset):
-    def __init__(self, encodings, labels):
+    def __init__(self, encodings: RaggedEncodings, labels: List[int]):
+        """
+        The encodings are converted to contiguous tensors once, so that items are returned as views of them.
+        :param encodings: unpadded encodings of the texts. Items are padded per batch by PaddingCollator.
+        :param labels: label of every text.
+        """
         self.encodings = encodings
         self.labels = labels
+        # Copies memory-mapped arrays into memory, as tensors cannot share read-only buffers.
+        self._tensors = {key: torch.from_numpy(np.array(values)) for key, values in encodings.values.items()}
+        self._offsets = encodings.offsets.tolist()
+        self._labels = torch.tensor(labels, dtype=torch.long)
 
     def __getitem__(self, idx):
-        item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-        item['labels'] = torch.tensor(self.labels[idx])
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        item = {key: tensor[start:end] for key, tensor in self._tensors.items()}
+        item['labels'] = self._labels[idx]
         return item
 
     def __len__(self):
         return len(self.labels)
 
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.encodings.lengths
+
 
 class Dataset(ABC):
 
     def __init__(
             self,
             tokenizer: PreTrainedTokenizer,
-            possible_labels: Tuple[str, ...]):
+            possible_labels: Tuple[str, ...],
+            encoding_cache: Optional[EncodingCache] = None,
+            tokenize_workers: Optional[int] = None):
         self._tokenizer = tokenizer
         self._possible_labels = possible_labels
         self._label_mapper = {label: i for i, label in enumerate(possible_labels)}
+        self._encoding_cache = encoding_cache
+        self._tokenize_workers = tokenize_workers
 
     def prepare_data_sets(
             self,
@@ -60,9 +80,9 @@ class Dataset(ABC):
         val_labels = [self._label_mapper[label] for label in val_labels]
         test_labels = [self._label_mapper[label] for label in test_labels]
 
-        train_encodings = self._tokenizer(train_texts, truncation=True, padding=True)
-        val_encodings = self._tokenizer(val_texts, truncation=True, padding=True)
-        test_encodings = self._tokenizer(test_texts, truncation=True, padding=True)
+        train_encodings = self._encode(train_texts)
+        val_encodings = self._encode(val_texts)
+        test_encodings = self._encode(test_texts)
 
         train_dataset = SentimentAnalysisDataset(train_encodings, train_labels)
         val_dataset = SentimentAnalysisDataset(val_encodings, val_labels)
@@ -70,6 +90,22 @@ class Dataset(ABC):
 
         return train_dataset, val_dataset, test_dataset
 
+    @property
+    def data_collator(self) -> PaddingCollator:
+        """
+        :return: collator padding the items of the prepared datasets to the longest item of a batch.
+        """
+        return PaddingCollator(get_pad_values(self._tokenizer))
+
+    def _encode(self, texts: List[str]) -> RaggedEncodings:
+        """
+        Tokenizes texts without padding, reusing the cached encodings if the encoding cache is set.
+        Without the cache, texts are tokenized by tokenize_workers processes.
+        """
+        if self._encoding_cache is not None:
+            return self._encoding_cache.encode(texts)
+        return encode_texts(self._tokenizer, texts, workers=self._tokenize_workers)
+
     @abstractmethod
     def get(self) -> Tuple[SentimentAnalysisDataset, SentimentAnalysisDataset, SentimentAnalysisDataset]:
         pass
@@ -83,19 +119,23 @@ class KlejDataset(Dataset):
             klej_type: KlejType,
             possible_labels: Tuple[str, ...] = DEFAULT_POSSIBLE_LABELS,
             validation_size: float = 0.1,
-            random_state: int = 42):
+            random_state: int = 42,
+            encoding_cache: Optional[EncodingCache] = None,
+            tokenize_workers: Optional[int] = None):
         """
         :param tokenizer: Transformers tokenizer.
         :param klej_type: One of KlejType values.
         :param possible_labels: Tuple of klej type labels that will be used for the training / eval.
         :param validation_size: A part of training dataset that will be used as validation set.
         :param random_state: random state that makes the experiments repeatable.
+        :param encoding_cache: if set, encodings are read from and stored in the cache.
+        :param tokenize_workers: number of processes tokenizing the texts, see encode_texts.
         """
         self.klej_type = klej_type
         self.validation_size = validation_size
         self.random_state = random_state
 
-        super().__init__(tokenizer, possible_labels)
+        super().__init__(tokenizer, possible_labels, encoding_cache, tokenize_workers)
 
     def get(self) -> Tuple[SentimentAnalysisDataset, SentimentAnalysisDataset, SentimentAnalysisDataset]:
         """
@@ -105,6 +145,8 @@ class KlejDataset(Dataset):
         klej_in = read_klej(self.klej_type, self._possible_labels)
         train_data, test_data = klej_in["train"], klej_in["dev"]
 
+        from sklearn.model_selection import train_test_split
+
         train_data, val_data = train_test_split(
             train_data,
             test_size=self.validation_size,
@@ -126,7 +168,9 @@ class FinancialDataset(Dataset):
             test_size: float = 0.2,
             val_size: float = 0.1,
             random_state: int = 42,
-            annotated_data_dir: str = "data/annotated"):
+            annotated_data_dir: str = "data/annotated",
+            encoding_cache: Optional[EncodingCache] = None,
+            tokenize_workers: Optional[int] = None):
         """
         :param tokenizer: Transformer tokenizer
         :param positive_threshold: Lowest value for positive sentiment
@@ -137,6 +181,8 @@ class FinancialDataset(Dataset):
         :param val_size: float between 0-1. A fraction of the dataset that should be used as validation set.
         :param random_state: Seed used for generating random split of companies
         :param annotated_data_dir: path to the annotated data.
+        :param encoding_cache: if set, encodings are read from and stored in the cache.
+        :param tokenize_workers: number of processes tokenizing the texts, see encode_texts.
         """
 
         self._positive_threshold = positive_threshold
@@ -147,7 +193,7 @@ class FinancialDataset(Dataset):
         self._random_state = random_state
         self._annotated_data_dir = annotated_data_dir
 
-        super().__init__(tokenizer, possible_labels)
+        super().__init__(tokenizer, possible_labels, encoding_cache, tokenize_workers)
 
     def get(self) -> Tuple[SentimentAnalysisDataset, SentimentAnalysisDataset, SentimentAnalysisDataset]:
         """
@@ -170,10 +216,8 @@ class FinancialDataset(Dataset):
 def get_klej_test_set(
         klej_type: KlejType,
         possible_labels: Tuple[str, ...] = DEFAULT_POSSIBLE_LABELS) -> Tuple[List[str], List[int]]:
-    klej = read_klej(klej_type, possible_labels)
+    test_texts, test_labels = read_klej_texts_labels(klej_type, "dev", possible_labels)
     label_mapper = {label: i for i, label in enumerate(possible_labels)}
-    test_data = klej["dev"]
-    test_texts, test_labels = _get_texts_labels_from_data(test_data)
     return test_texts, [label_mapper[label] for label in test_labels]
 
 
@@ -0,0 +1,207 @@
+import copy
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import PreTrainedModel, PreTrainedTokenizer, BertForSequenceClassification
+
+from src.models.datasets import SentimentAnalysisDataset
+from src.models.encoding_cache import EncodingCache
+from src.models.encodings import RaggedEncodings, encode_texts
+from src.models.eval import predict_logits
+from src.models.inference import InferenceEngine
+from src.models.logits_cache import LogitsCache
+from src.models.metrics import compute_metrics
+from src.models.training import BucketedTrainer
+
+# Label of unlabelled texts, ignored by the cross-entropy.
+IGNORED_LABEL = -100
+
+
+class DistillationDataset(SentimentAnalysisDataset):
+    """
+    Texts with logits of the teacher model (soft labels) and true labels, if known.
+    Unlabelled texts, e.g. scraped dispatches, have IGNORED_LABEL.
+    """
+
+    def __init__(self, encodings: RaggedEncodings, labels: List[int], teacher_logits: np.ndarray):
+        """
+        :param encodings: unpadded encodings of the texts.
+        :param labels: label of every text or IGNORED_LABEL.
+        :param teacher_logits: logits of the teacher model with shape (number of texts, number of labels).
+        """
+        super().__init__(encodings, labels)
+        self._teacher_logits = torch.from_numpy(np.asarray(teacher_logits, dtype=np.float32))
+
+    def __getitem__(self, idx):
+        item = super().__getitem__(idx)
+        item['teacher_logits'] = self._teacher_logits[idx]
+        return item
+
+
+def build_distillation_dataset(
+        tokenizer: PreTrainedTokenizer,
+        teacher: PreTrainedModel,
+        texts: List[str],
+        labels: List[int],
+        encoding_cache: Optional[EncodingCache] = None,
+        logits_cache: Optional[LogitsCache] = None,
+        **kwargs) -> DistillationDataset:
+    """
+    Tokenizes the texts once and computes soft labels with the teacher on the same encodings.
+    :param tokenizer: tokenizer of the teacher, shared by the student.
+    :param teacher: model whose logits are the soft labels.
+    :param texts: training texts.
+    :param labels: label of every text or IGNORED_LABEL.
+    :param encoding_cache: if set, encodings are read from and stored in the cache.
+    :param logits_cache: if set, logits of the teacher are read from the cache and only new texts are classified.
+    :param kwargs: arguments of iter_logits, e.g. batch_size or max_tokens.
+    :return: dataset for DistillationTrainer.
+    """
+    encodings = encoding_cache.encode(texts) if encoding_cache is not None else encode_texts(tokenizer, texts)
+    start = time.perf_counter()
+    teacher_logits = predict_logits(tokenizer, teacher, texts, encodings=encodings, logits_cache=logits_cache,
+                                    **kwargs)
+    print(f'Soft labels of {len(texts)} texts computed in {time.perf_counter() - start:.1f}s')
+    return DistillationDataset(encodings, labels, teacher_logits)
+
+
+def create_student(
+        teacher: BertForSequenceClassification,
+        num_layers: int = 4,
+        hidden_size: Optional[int] = None) -> BertForSequenceClassification:
+    """
+    Creates a smaller model with the vocabulary and labels of the teacher. With the hidden size of the teacher,
+    the student starts from the embeddings, the classifier and evenly spaced encoder layers of the teacher
+    (the first and the last included). With a smaller hidden size the student is initialized randomly.
+    :param teacher: model to distill.
+    :param num_layers: number of encoder layers of the student.
+    :param hidden_size: hidden size of the student, a multiple of the size of the attention heads of the teacher.
+    Defaults to the hidden size of the teacher.
+    :return: student model.
+    """
+    if not 1 <= num_layers <= teacher.config.num_hidden_layers:
+        raise ValueError(f'The student needs between 1 and {teacher.config.num_hidden_layers} layers, got {num_layers}')
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    if hidden_size is None or hidden_size == teacher.config.hidden_size:
+        student = BertForSequenceClassification(config)
+        layer_ids = np.linspace(0, teacher.config.num_hidden_layers - 1, num_layers).round().astype(int)
+        teacher_state = teacher.state_dict()
+        state = {}
+        for key in student.state_dict():
+            if key.startswith('bert.encoder.layer.'):
+                layer_id, rest = key[len('bert.encoder.layer.'):].split('.', 1)
+                state[key] = teacher_state[f'bert.encoder.layer.{layer_ids[int(layer_id)]}.{rest}']
+            else:
+                state[key] = teacher_state[key]
+        student.load_state_dict(state)
+        print(f'Student initialized with teacher layers {layer_ids.tolist()}')
+    else:
+        head_size = teacher.config.hidden_size // teacher.config.num_attention_heads
+        if hidden_size % head_size:
+            raise ValueError(f'Hidden size of the student has to be a multiple of {head_size}')
+        config.hidden_size = hidden_size
+        config.num_attention_heads = hidden_size // head_size
+        config.intermediate_size = teacher.config.intermediate_size * hidden_size // teacher.config.hidden_size
+        student = BertForSequenceClassification(config)
+        print('Student with a smaller hidden size initialized randomly')
+    print(f'Student: {count_parameters(student)} parameters, teacher: {count_parameters(teacher)}')
+    return student
+
+
+def count_parameters(model: PreTrainedModel) -> int:
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+def distillation_loss(
+        student_logits: torch.Tensor,
+        teacher_logits: torch.Tensor,
+        labels: torch.Tensor,
+        temperature: float = 2.,
+        alpha: float = 0.5) -> torch.Tensor:
+    """
+    :param student_logits: logits of the student.
+    :param teacher_logits: logits of the teacher.
+    :param labels: true labels, IGNORED_LABEL for unlabelled texts.
+    :param temperature: temperature softening both distributions in the KL divergence.
+    :param alpha: weight of the KL divergence, the cross-entropy with the true labels has weight 1 - alpha.
+    :return: alpha * T^2 * KL(teacher || student) + (1 - alpha) * cross-entropy, averaged over the batch.
+    The KL divergence is scaled by T^2, so that its gradients do not shrink with the temperature.
+    """
+    kl = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=-1),
+        F.log_softmax(teacher_logits.float() / temperature, dim=-1),
+        reduction='batchmean',
+        log_target=True) * temperature ** 2
+    if not (labels != IGNORED_LABEL).any():
+        return alpha * kl
+    return alpha * kl + (1 - alpha) * F.cross_entropy(student_logits, labels, ignore_index=IGNORED_LABEL)
+
+
+class DistillationTrainer(BucketedTrainer):
+    """
+    Trainer of a student model on DistillationDataset, minimizing distillation_loss.
+    """
+
+    def __init__(self, *args, temperature: float = 2., alpha: float = 0.5, **kwargs):
+        """
+        :param temperature: see distillation_loss.
+        :param alpha: see distillation_loss.
+        """
+        super().__init__(*args, **kwargs)
+        self._temperature = temperature
+        self._alpha = alpha
+        # The loss is a mean over the batch, so the Trainer scales it for gradient accumulation.
+        self.model_accepts_loss_kwargs = False
+
+    def _set_signature_columns_if_needed(self) -> None:
+        super()._set_signature_columns_if_needed()
+        if 'teacher_logits' not in self._signature_columns:
+            self._signature_columns.append('teacher_logits')
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        inputs = dict(inputs)
+        teacher_logits = inputs.pop('teacher_logits')
+        labels = inputs.pop('labels')
+        outputs = model(**inputs)
+        loss = distillation_loss(outputs.logits, teacher_logits, labels, self._temperature, self._alpha)
+        return (loss, outputs) if return_outputs else loss
+
+
+def compare_student(
+        tokenizer: PreTrainedTokenizer,
+        teacher: PreTrainedModel,
+        student: PreTrainedModel,
+        test_dataset: Tuple[List[str], List[int]],
+        batch_size: int = 32,
+        max_tokens: Optional[int] = None,
+        encoding_cache: Optional[EncodingCache] = None) -> Dict[str, float]:
+    """
+    Evaluates both models on the same encodings of the test set.
+    :return: dict with metrics of both models (prefixed with "teacher_" and "student_"), the macro F1 delta
+    (student - teacher), the number of parameters and the inference time in seconds of both models,
+    the speedup of the student and the fraction of equal predictions.
+    """
+    texts, labels = test_dataset
+    report = {}
+    engines = {
+        'teacher': InferenceEngine(tokenizer, teacher, batch_size=batch_size, max_tokens=max_tokens,
+                                   encoding_cache=encoding_cache),
+        'student': InferenceEngine(tokenizer, student, batch_size=batch_size, max_tokens=max_tokens),
+    }
+    encodings = engines['teacher'].encode(texts)
+    predictions = {}
+    for name, model in (('teacher', teacher), ('student', student)):
+        start = time.perf_counter()
+        logits = engines[name].predict_encodings(encodings)
+        report[f'{name}_seconds'] = time.perf_counter() - start
+        report[f'{name}_parameters'] = count_parameters(model)
+        report.update({f'{name}_{metric}': value for metric, value in compute_metrics((logits, labels)).items()})
+        predictions[name] = logits.argmax(axis=-1)
+    report['f1_delta'] = report['student_f1'] - report['teacher_f1']
+    report['speedup'] = report['teacher_seconds'] / report['student_seconds']
+    report['prediction_agreement'] = float(np.mean(predictions['teacher'] == predictions['student']))
+    return report
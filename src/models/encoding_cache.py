@@ -0,0 +1,118 @@
+import hashlib
+import json
+from typing import List, Optional
+
+import numpy as np
+from transformers import PreTrainedTokenizer
+
+from src.common.utils.cache import DEFAULT_CACHE_DIR, HashedShardStore, text_hashes
+from src.models.encodings import RaggedEncodings, encode_texts
+
+OFFSETS = 'offsets'
+
+
+class EncodingCache:
+    """
+    On-disk cache of unpadded tokenizer encodings. Encodings are stored as memory-mapped int arrays
+    in a directory specific to the tokenizer (vocabulary, special tokens) and truncation settings,
+    and identified by the hash of the text. Only texts missing in the cache are tokenized.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            cache_dir: str = f"{DEFAULT_CACHE_DIR}/encodings",
+            truncation: bool = True,
+            max_length: Optional[int] = None,
+            workers: Optional[int] = None):
+        """
+        :param tokenizer: Transformers tokenizer.
+        :param cache_dir: directory where encodings of all tokenizers are stored.
+        :param truncation: whether texts longer than max_length should be truncated.
+        :param max_length: maximal number of tokens. Defaults to the maximal length of the tokenizer's model.
+        :param workers: number of processes tokenizing the texts missing in the cache, see encode_texts.
+        """
+        self._tokenizer = tokenizer
+        self._truncation = truncation
+        self._max_length = max_length
+        self._workers = workers
+        self._store = HashedShardStore(f"{cache_dir}/{tokenizer_fingerprint(tokenizer, truncation, max_length)}")
+
+    @property
+    def truncation(self) -> bool:
+        return self._truncation
+
+    def encode(self, texts: List[str]) -> RaggedEncodings:
+        """
+        :param texts: texts to encode.
+        :return: RaggedEncodings of the texts, in order. If all the texts were stored together,
+        in the same order, the returned arrays are views of the memory-mapped cache.
+        """
+        hashes = text_hashes(texts)
+        shard_ids, rows = self._store.lookup(hashes)
+
+        missing = np.flatnonzero(shard_ids < 0)
+        if len(missing):
+            # Duplicated texts are tokenized and stored once, in the order of their first occurrence.
+            _, first_positions = np.unique(hashes[missing], return_index=True)
+            missing_positions = missing[np.sort(first_positions)]
+            encodings = self._encode_missing([texts[i] for i in missing_positions])
+            self._store.add(hashes[missing_positions], {OFFSETS: encodings.offsets, **encodings.values})
+            shard_ids, rows = self._store.lookup(hashes)
+
+        return self._gather(shard_ids, rows)
+
+    def _encode_missing(self, texts: List[str]) -> RaggedEncodings:
+        return encode_texts(
+            self._tokenizer, texts, truncation=self._truncation, max_length=self._max_length, workers=self._workers)
+
+    def _gather(self, shard_ids: np.ndarray, rows: np.ndarray) -> RaggedEncodings:
+        unique_shard_ids = np.unique(shard_ids)
+        if len(unique_shard_ids) == 1:
+            shard = self._shard_encodings(int(unique_shard_ids[0]))
+            if len(rows) == len(shard) and np.array_equal(rows, np.arange(len(rows))):
+                return shard
+
+        parts, positions = [], np.empty(len(rows), dtype=np.int64)
+        part_start = 0
+        for shard_id in unique_shard_ids:
+            in_shard = np.flatnonzero(shard_ids == shard_id)
+            parts.append(self._shard_encodings(int(shard_id)).take(rows[in_shard]))
+            positions[in_shard] = np.arange(part_start, part_start + len(in_shard))
+            part_start += len(in_shard)
+        if not parts:
+            return encode_texts(self._tokenizer, [])
+        return RaggedEncodings.concatenate(parts).take(positions)
+
+    def _shard_encodings(self, shard_id: int) -> RaggedEncodings:
+        shard = self._store.shard(self._store.shard_names[shard_id])
+        values = {key: array for key, array in shard.items() if key not in (OFFSETS, HashedShardStore.HASHES)}
+        return RaggedEncodings(values, shard[OFFSETS])
+
+
+def tokenizer_fingerprint(
+        tokenizer: PreTrainedTokenizer,
+        truncation: bool = True,
+        max_length: Optional[int] = None) -> str:
+    """
+    Identifies a tokenizer by its vocabulary and settings rather than its path, so that encodings
+    created during the training are reused when the saved model is evaluated.
+    :return: hex digest identifying the tokenizer together with its truncation settings.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps({
+        'model_max_length': tokenizer.model_max_length,
+        'special_tokens': {str(key): str(value) for key, value in tokenizer.special_tokens_map.items()},
+        'truncation': truncation,
+        'max_length': max_length
+    }, sort_keys=True).encode('utf-8'))
+    if getattr(tokenizer, 'is_fast', False):
+        # Contains normalization and pre-tokenization rules next to the vocabulary.
+        # Truncation and padding are call-time state of the backend tokenizer, so they are skipped.
+        backend = json.loads(tokenizer.backend_tokenizer.to_str())
+        backend.pop('truncation', None)
+        backend.pop('padding', None)
+        digest.update(json.dumps(backend, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
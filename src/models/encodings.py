@@ -0,0 +1,209 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from transformers import PreTrainedTokenizer
+
+ENCODING_DTYPE = np.int32
+# Number of chunks per worker process, so that workers finishing early pick up the remaining chunks.
+CHUNKS_PER_WORKER = 4
+
+
+@dataclass
+class RaggedEncodings:
+    """
+    Unpadded encodings of many texts stored as flat arrays.
+    Tokens of text i for every key (e.g. "input_ids") are values[key][offsets[i]:offsets[i + 1]].
+    """
+    values: Dict[str, np.ndarray]
+    offsets: np.ndarray
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def get(self, idx: int) -> Dict[str, np.ndarray]:
+        """
+        :param idx: index of the text.
+        :return: views of the encodings of a single text.
+        """
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return {key: values[start:end] for key, values in self.values.items()}
+
+    def take(self, indices: Sequence[int]) -> 'RaggedEncodings':
+        """
+        :param indices: indices of the texts to take.
+        :return: new RaggedEncodings with encodings of the given texts, in the given order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return RaggedEncodings({key: np.asarray(values[positions]) for key, values in self.values.items()}, offsets)
+
+    def pad(
+            self,
+            indices: Sequence[int],
+            pad_values: Dict[str, int],
+            dtype=np.int64) -> Dict[str, np.ndarray]:
+        """
+        Pads encodings of the given texts to the length of the longest of them.
+        :param indices: indices of the texts to pad.
+        :param pad_values: value used for padding of every key. Keys without a value are padded with 0.
+        :param dtype: dtype of the returned arrays.
+        :return: dict of 2-D arrays with shape (len(indices), longest length).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths[indices]
+        width = int(lengths.max()) if len(indices) else 0
+        columns = np.arange(width)
+        mask = columns < lengths[:, None]
+        positions = (self.offsets[indices][:, None] + columns)[mask]
+
+        padded = {}
+        for key, values in self.values.items():
+            result = np.full((len(indices), width), pad_values.get(key, 0), dtype=dtype)
+            result[mask] = values[positions]
+            padded[key] = result
+        return padded
+
+    @classmethod
+    def from_lists(cls, encodings: Dict[str, List[List[int]]]) -> 'RaggedEncodings':
+        """
+        :param encodings: unpadded output of a tokenizer, e.g. {"input_ids": [[...], [...]], ...}.
+        """
+        first = next(iter(encodings.values()))
+        offsets = np.zeros(len(first) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in first], out=offsets[1:])
+        values = {
+            key: np.fromiter((token for row in rows for token in row), dtype=ENCODING_DTYPE, count=offsets[-1])
+            for key, rows in encodings.items()
+        }
+        return cls(values, offsets)
+
+    @classmethod
+    def concatenate(cls, parts: Sequence['RaggedEncodings']) -> 'RaggedEncodings':
+        """
+        :param parts: RaggedEncodings with the same keys.
+        :return: RaggedEncodings with texts of all parts, in order.
+        """
+        parts = [part for part in parts if part.values] or parts[:1]
+        keys = parts[0].values.keys()
+        lengths = np.concatenate([part.lengths for part in parts])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = {key: np.concatenate([part.values[key][part.offsets[0]:part.offsets[-1]] for part in parts])
+                  for key in keys}
+        return cls(values, offsets)
+
+
+def encode_texts(
+        tokenizer: PreTrainedTokenizer,
+        texts: List[str],
+        truncation: bool = True,
+        max_length: Optional[int] = None,
+        workers: Optional[int] = None) -> RaggedEncodings:
+    """
+    Tokenizes texts without padding.
+    :param tokenizer: Transformers tokenizer.
+    :param texts: texts to tokenize.
+    :param truncation: whether texts longer than max_length should be truncated.
+    :param max_length: maximal number of tokens. Defaults to the maximal length of the tokenizer's model.
+    :param workers: if set, the number of processes tokenizing contiguous chunks of the texts
+    (0 means one per CPU core) and the tokenization throughput is printed.
+    By default, texts are tokenized in the current process without any report.
+    :return: RaggedEncodings of the texts.
+    """
+    if not texts:
+        return RaggedEncodings({}, np.zeros(1, dtype=np.int64))
+    if workers is None:
+        return _encode_chunk(tokenizer, texts, truncation, max_length)
+
+    workers = resolve_workers(workers, len(texts))
+    start = time.perf_counter()
+    if workers == 1:
+        encodings = _encode_chunk(tokenizer, texts, truncation, max_length)
+    else:
+        encodings = _encode_in_processes(tokenizer, texts, truncation, max_length, workers)
+    elapsed = time.perf_counter() - start
+    print(f'Tokenized {len(texts)} texts ({int(encodings.offsets[-1])} tokens) in {elapsed:.2f}s '
+          f'using {workers} process{"es" if workers > 1 else ""} ({len(texts) / max(elapsed, 1e-9):.0f} texts/s)')
+    return encodings
+
+
+def resolve_workers(workers: int, n_tasks: int) -> int:
+    """
+    :param workers: requested number of worker processes, 0 means one per available CPU core.
+    :param n_tasks: number of texts (or batches) to process.
+    :return: number of processes actually used, never more than the number of tasks.
+    """
+    if workers < 0:
+        raise ValueError('Number of workers should be non-negative')
+    if workers == 0:
+        workers = available_cpus()
+    return max(min(workers, n_tasks), 1)
+
+
+def available_cpus() -> int:
+    """
+    :return: number of CPUs available to this process, which may be fewer than the CPUs of the machine.
+    """
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def _encode_in_processes(
+        tokenizer: PreTrainedTokenizer,
+        texts: List[str],
+        truncation: bool,
+        max_length: Optional[int],
+        workers: int) -> RaggedEncodings:
+    chunk_size = -(-len(texts) // (workers * CHUNKS_PER_WORKER))
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    # The tokenizer is sent to every worker once. Fast tokenizers are limited to a single thread per worker,
+    # as the processes already occupy the cores.
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(tokenizer, truncation, max_length)) as executor:
+        # map returns the results in the order of the chunks.
+        return RaggedEncodings.concatenate(list(executor.map(_encode_worker_chunk, chunks)))
+
+
+# Tokenizer and its settings, set once in every worker process by _init_worker.
+_WORKER_STATE: Dict[str, object] = {}
+
+
+def _init_worker(tokenizer: PreTrainedTokenizer, truncation: bool, max_length: Optional[int]) -> None:
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _WORKER_STATE.update(tokenizer=tokenizer, truncation=truncation, max_length=max_length)
+
+
+def _encode_worker_chunk(texts: List[str]) -> RaggedEncodings:
+    return _encode_chunk(
+        _WORKER_STATE['tokenizer'], texts, _WORKER_STATE['truncation'], _WORKER_STATE['max_length'])
+
+
+def _encode_chunk(
+        tokenizer: PreTrainedTokenizer,
+        texts: List[str],
+        truncation: bool,
+        max_length: Optional[int]) -> RaggedEncodings:
+    return RaggedEncodings.from_lists(dict(tokenizer(texts, truncation=truncation, max_length=max_length)))
+
+
+def get_pad_values(tokenizer: PreTrainedTokenizer) -> Dict[str, int]:
+    """
+    :return: values used for padding of every key produced by the tokenizer.
+    """
+    return {
+        'input_ids': tokenizer.pad_token_id,
+        'token_type_ids': getattr(tokenizer, 'pad_token_type_id', 0),
+        'attention_mask': 0
+    }
@@ -1,50 +1,211 @@
-from typing import Dict, List, Tuple, Union
+from typing import Dict, Iterator, List, Tuple, Optional
 
 import numpy as np
-from tqdm import tqdm
 from transformers import PreTrainedModel, PreTrainedTokenizer
 
-from src.models.metrics import get_classification_report, get_confusion_matrix
-
-
-def _get_model_predictions(model: PreTrainedModel,
-                           encodings) -> np.array:
-    model.eval()
-    predictions = model(**encodings)
-    return predictions.logits.detach().numpy()
-
-
-def _gather_prediction(text: Union[str, List[str]], tokenizer: PreTrainedTokenizer, model: PreTrainedModel) -> np.array:
-    encoding = tokenizer(text, padding=True, truncation=True, return_tensors="pt")
-    return _get_model_predictions(model, encoding)
+from src.common.consts import DEFAULT_CHUNK_SIZE
+from src.models.encoding_cache import EncodingCache
+from src.models.encodings import RaggedEncodings, encode_texts
+from src.models.inference import InferenceEngine
+from src.models.logits_cache import LogitsCache
+from src.models.onnx_inference import create_inference_engine
+from src.models.long_documents import chunk_encodings, aggregate_chunk_logits
+from src.models.metrics import MetricsAccumulator, bootstrap_confidence_intervals
 
 
 def evaluate(
         tokenizer: PreTrainedTokenizer,
         model: PreTrainedModel,
         test_dataset: Tuple[List[str], List[int]],
-        batch_size: int = 10) -> Dict[str, float]:
+        batch_size: int = 10,
+        encoding_cache: Optional[EncodingCache] = None,
+        max_tokens: Optional[int] = None,
+        long_documents: bool = False,
+        stride: int = 128,
+        aggregation: str = "mean",
+        encodings: Optional[RaggedEncodings] = None,
+        workers: int = 1,
+        threads_per_worker: Optional[int] = None,
+        logits_cache: Optional[LogitsCache] = None,
+        bootstrap_samples: int = 0,
+        keep_logits: bool = False,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE) -> Dict[str, float]:
     """
     Evaluates the dataset and returns a dict containing classification_report and confusion matrix.
+    Texts are classified in chunks and their logits are fed to a MetricsAccumulator, so that memory
+    does not grow with the size of the dataset, unless the logits are retained.
     :param tokenizer: tokenizer used for model training.
-    :param model: model for evaluation.
+    :param model: model for evaluation, PyTorch model or OnnxClassifier.
     :param test_dataset: test dataset for evaluation.
     :param batch_size: evaluation batch size.
-    :return: dict with keys: 'classification_report' and 'confusion_matrix'
+    :param encoding_cache: if set, encodings are read from the cache instead of tokenizing the texts.
+    :param max_tokens: if set, texts sorted by length are packed into batches of up to max_tokens
+    padded tokens and batch_size is ignored.
+    :param long_documents: if True, texts are not truncated but split into overlapping windows,
+    which are classified in batches packed across texts. The encoding cache has to be created
+    with truncation disabled.
+    :param stride: number of tokens shared by consecutive windows of a text.
+    :param aggregation: how logits of the windows are reduced to logits of a text, one of AGGREGATIONS.
+    :param encodings: pre-tokenized texts of the dataset. If set, the texts are not tokenized again.
+    :param workers: number of processes running the model, see InferenceEngine.
+    :param threads_per_worker: number of intra-op threads of every worker process.
+    :param logits_cache: if set, logits are read from the cache and only the missing texts are run through the model.
+    :param bootstrap_samples: if positive, 95% bootstrap confidence intervals of the metrics are computed
+    from this number of resampled test sets. The logits are then retained.
+    :param keep_logits: if True, logits of all texts are returned.
+    :param chunk_size: number of texts tokenized and sorted by length at once. None means all texts.
+    :return: dict with keys: 'classification_report', 'confusion_matrix', 'metrics' (macro averaged,
+    with log-loss and expected calibration error), 'confidence_intervals' (only with bootstrap_samples)
+    and 'logits' (only with keep_logits)
     """
     texts, labels = test_dataset
     if not texts:
         return {}
-    predictions = []
-
-    for i in tqdm(range(0, len(texts), batch_size)):
-        texts_batch = texts[i: i + batch_size]
-        prediction = _gather_prediction(texts_batch, tokenizer, model)
-        predictions.append(prediction)
-    predictions = np.array(predictions)
-    predictions = np.concatenate(predictions, axis=0)
-    eval_pred = (predictions, labels)
+    labels = np.asarray(labels, dtype=np.int64)
+    accumulator = MetricsAccumulator(model.config.num_labels, keep_logits=keep_logits or bootstrap_samples > 0)
+    for positions, logits in iter_logits(
+            tokenizer, model, texts, batch_size=batch_size, encoding_cache=encoding_cache, max_tokens=max_tokens,
+            long_documents=long_documents, stride=stride, aggregation=aggregation, encodings=encodings,
+            workers=workers, threads_per_worker=threads_per_worker, logits_cache=logits_cache,
+            chunk_size=chunk_size):
+        accumulator.update(logits, labels[positions], positions)
+    return _evaluation_result(accumulator, bootstrap_samples, keep_logits)
+
+
+def evaluate_many(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        test_datasets: Dict[str, Tuple[List[str], List[int]]],
+        bootstrap_samples: int = 0,
+        keep_logits: bool = False,
+        **kwargs) -> Dict[str, Dict[str, float]]:
+    """
+    Evaluates many datasets with a single run of the model. Texts shared by the datasets are classified once.
+    :param test_datasets: test datasets by their names.
+    :param bootstrap_samples: see evaluate.
+    :param keep_logits: see evaluate.
+    :param kwargs: arguments of evaluate, except encodings.
+    :return: result of evaluate of every dataset, by its name.
+    """
+    text_ids: Dict[str, int] = {}
+    dataset_positions = {}
+    for name, (texts, _) in test_datasets.items():
+        dataset_positions[name] = np.array([text_ids.setdefault(text, len(text_ids)) for text in texts],
+                                           dtype=np.int64)
+    n_texts = sum(len(texts) for texts, _ in test_datasets.values())
+    print(f'{len(text_ids)} unique texts in {n_texts} texts of {len(test_datasets)} datasets')
+
+    accumulators = {
+        name: MetricsAccumulator(model.config.num_labels, keep_logits=keep_logits or bootstrap_samples > 0)
+        for name in test_datasets
+    }
+    dataset_labels = {name: np.asarray(labels, dtype=np.int64) for name, (_, labels) in test_datasets.items()}
+    for positions, logits in iter_logits(tokenizer, model, list(text_ids), **kwargs):
+        # Chunks cover consecutive ids of unique texts.
+        first_id = positions[0]
+        for name, ids in dataset_positions.items():
+            in_chunk = np.flatnonzero((ids >= first_id) & (ids < first_id + len(positions)))
+            accumulators[name].update(logits[ids[in_chunk] - first_id], dataset_labels[name][in_chunk], in_chunk)
     return {
-        'classification_report': get_classification_report(eval_pred),
-        'confusion_matrix': get_confusion_matrix(eval_pred)
+        name: _evaluation_result(accumulators[name], bootstrap_samples, keep_logits) if labels else {}
+        for name, (_, labels) in test_datasets.items()
     }
+
+
+def predict_logits(tokenizer: PreTrainedTokenizer, model: PreTrainedModel, texts: List[str], **kwargs) -> np.ndarray:
+    """
+    :param texts: texts to classify.
+    :param kwargs: arguments of iter_logits.
+    :return: logits of the texts, in order.
+    """
+    chunks = [logits for _, logits in iter_logits(tokenizer, model, texts, **kwargs)]
+    return np.concatenate(chunks) if chunks else np.empty((0, model.config.num_labels), dtype=np.float32)
+
+
+def iter_logits(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        texts: List[str],
+        batch_size: int = 10,
+        encoding_cache: Optional[EncodingCache] = None,
+        max_tokens: Optional[int] = None,
+        long_documents: bool = False,
+        stride: int = 128,
+        aggregation: str = "mean",
+        encodings: Optional[RaggedEncodings] = None,
+        workers: int = 1,
+        threads_per_worker: Optional[int] = None,
+        logits_cache: Optional[LogitsCache] = None,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    :param texts: texts to classify. The rest of the parameters are described in evaluate.
+    :return: iterator of positions of consecutive chunks of the texts and their logits.
+    """
+    engine = create_inference_engine(tokenizer, model, batch_size=batch_size, max_tokens=max_tokens,
+                                     encoding_cache=encoding_cache, workers=workers,
+                                     threads_per_worker=threads_per_worker)
+
+    def predict(positions: np.ndarray) -> np.ndarray:
+        subset_texts = [texts[i] for i in positions]
+        subset_encodings = encodings.take(positions) if encodings is not None else None
+        if long_documents:
+            return _predict_long_documents(subset_texts, tokenizer, model, engine, encoding_cache, stride,
+                                           aggregation, subset_encodings)
+        if subset_encodings is not None:
+            return engine.predict_encodings(subset_encodings)
+        return engine.predict(subset_texts)
+
+    settings = {'long_documents': long_documents}
+    if long_documents:
+        settings.update(stride=stride, aggregation=aggregation)
+    chunk_size = chunk_size or max(len(texts), 1)
+    for start in range(0, len(texts), chunk_size):
+        positions = np.arange(start, min(start + chunk_size, len(texts)))
+        if logits_cache is None:
+            yield positions, predict(positions)
+        else:
+            yield positions, logits_cache.get(
+                texts[start:start + chunk_size], lambda missing: predict(positions[missing]), settings)
+
+
+def _evaluation_result(
+        accumulator: MetricsAccumulator,
+        bootstrap_samples: int = 0,
+        keep_logits: bool = False) -> Dict[str, float]:
+    result = {'confusion_matrix': accumulator.confusion, 'metrics': accumulator.metrics()}
+    confidence_intervals = None
+    if bootstrap_samples > 0:
+        confidence_intervals = bootstrap_confidence_intervals(accumulator.eval_pred(), n_samples=bootstrap_samples)
+        result['confidence_intervals'] = confidence_intervals
+    result['classification_report'] = accumulator.classification_report(confidence_intervals)
+    if keep_logits:
+        result['logits'] = accumulator.eval_pred()[0]
+    return result
+
+
+def _predict_long_documents(
+        texts: List[str],
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        engine: InferenceEngine,
+        encoding_cache: Optional[EncodingCache],
+        stride: int,
+        aggregation: str,
+        encodings: Optional[RaggedEncodings]) -> np.ndarray:
+    if encodings is None:
+        if encoding_cache is not None and encoding_cache.truncation:
+            raise ValueError('Long documents require an encoding cache created with truncation disabled')
+        encodings = (
+            encoding_cache.encode(texts) if encoding_cache is not None
+            else encode_texts(tokenizer, texts, truncation=False))
+    chunks, doc_ids = chunk_encodings(encodings, tokenizer, _max_model_length(tokenizer, model), stride)
+    print(f'{len(texts)} texts split into {len(chunks)} windows')
+    # Windows of all texts are sorted by length together, so that batches are full regardless of the texts.
+    return aggregate_chunk_logits(engine.predict_encodings(chunks), doc_ids, aggregation)
+
+
+def _max_model_length(tokenizer: PreTrainedTokenizer, model: PreTrainedModel) -> int:
+    """
+    :return: maximal number of tokens of an input. Tokenizers without a configured limit report a huge value.
+    """
+    return min(tokenizer.model_max_length, getattr(model.config, 'max_position_embeddings', tokenizer.model_max_length))
@@ -0,0 +1,213 @@
+import pickle
+import queue
+import traceback
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from tqdm import tqdm
+from transformers import PreTrainedModel, PreTrainedTokenizer
+
+from src.models.batching import TokenBudgetBatchSampler, padding_efficiency
+from src.models.encoding_cache import EncodingCache
+from src.models.encodings import RaggedEncodings, encode_texts, get_pad_values, resolve_workers, available_cpus
+
+
+class InferenceEngine:
+    """
+    Computes logits of many texts. Texts are tokenized at once (or read from the encoding cache),
+    sorted by length and padded per batch, and the logits are written to a preallocated array
+    in the original order of the texts. The model is put into eval mode once and run without autograd.
+    Subclasses running the model with other backends override _forward.
+    With several workers, processes started by a fork server take batches from a queue. Weights of an unquantized
+    PyTorch model are moved to shared memory, so the workers use a single copy of them.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            model: PreTrainedModel,
+            batch_size: int = 32,
+            max_tokens: Optional[int] = None,
+            encoding_cache: Optional[EncodingCache] = None,
+            workers: int = 1,
+            threads_per_worker: Optional[int] = None,
+            verbose: bool = True):
+        """
+        :param tokenizer: tokenizer used for model training.
+        :param model: model returning logits.
+        :param batch_size: number of texts in a batch.
+        :param max_tokens: if set, texts are packed into batches of up to max_tokens padded tokens
+        and batch_size is ignored.
+        :param encoding_cache: if set, encodings are read from the cache instead of tokenizing the texts.
+        :param workers: number of processes running the model (0 means one per available CPU core).
+        With 1, the model runs in the current process.
+        :param threads_per_worker: number of intra-op threads of every worker. By default the available cores
+        are divided evenly between the workers, so that they do not compete for them.
+        :param verbose: if False, batching statistics and progress bars are not printed, e.g. when serving requests.
+        """
+        self._tokenizer = tokenizer
+        self._model = model
+        self._model.eval()
+        self._batch_size = batch_size
+        self._max_tokens = max_tokens
+        self._encoding_cache = encoding_cache
+        self._workers = workers
+        self._threads_per_worker = threads_per_worker
+        self._verbose = verbose
+        self._pad_values = get_pad_values(tokenizer)
+
+    @property
+    def num_labels(self) -> int:
+        return self._model.config.num_labels
+
+    def encode(self, texts: List[str]) -> RaggedEncodings:
+        """
+        :return: unpadded encodings of the texts, read from the encoding cache if it is set.
+        """
+        if self._encoding_cache is not None:
+            return self._encoding_cache.encode(texts)
+        return encode_texts(self._tokenizer, texts)
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        """
+        :param texts: texts to classify.
+        :return: logits with shape (len(texts), number of labels), in the order of the texts.
+        """
+        return self.predict_encodings(self.encode(texts))
+
+    def predict_encodings(self, encodings: RaggedEncodings) -> np.ndarray:
+        """
+        :param encodings: pre-tokenized texts, e.g. encodings from the cache or windows of long texts.
+        :return: logits with shape (len(encodings), number of labels), in the order of the encodings.
+        """
+        logits = np.empty((len(encodings), self.num_labels), dtype=np.float32)
+        if not len(encodings):
+            return logits
+        batches = self.batches(encodings.lengths)
+        if self._verbose:
+            print(f'{len(encodings)} texts in {len(batches)} batches, padding efficiency: '
+                  f'{padding_efficiency(encodings.lengths, batches):.1%}')
+        workers = resolve_workers(self._workers, len(batches))
+        if workers == 1:
+            with torch.inference_mode():
+                for batch in tqdm(batches, disable=not self._verbose):
+                    logits[batch] = self._forward(encodings.pad(batch, self._pad_values))
+        else:
+            self._predict_in_workers(encodings, batches, logits, workers)
+        return logits
+
+    def batches(self, lengths: np.ndarray) -> List[np.ndarray]:
+        """
+        :param lengths: number of tokens of every text.
+        :return: batches of indices of texts sorted from the longest to the shortest,
+        so that the memory needed by the first batch is not exceeded later.
+        """
+        if self._max_tokens is not None:
+            return TokenBudgetBatchSampler(lengths, max_tokens=self._max_tokens, shuffle=False).batches
+        order = np.argsort(-np.asarray(lengths), kind='stable')
+        return [order[i:i + self._batch_size] for i in range(0, len(order), self._batch_size)]
+
+    def _predict_in_workers(
+            self,
+            encodings: RaggedEncodings,
+            batches: List[np.ndarray],
+            logits: np.ndarray,
+            workers: int) -> None:
+        """
+        Starts workers that receive the engine, the encodings and the batches. Workers take ids
+        of the batches from a queue and send back their logits, which are written to logits in place.
+        """
+        threads = self._threads_per_worker or max(available_cpus() // workers, 1)
+        print(f'Running the model in {workers} processes with {threads} threads each')
+        # Processes forked from this one would inherit the OpenMP thread pool of any parallel op run here,
+        # and hang in their first op with more than one thread. Workers are forked from a fork server instead,
+        # which imported torch but never ran an op.
+        context = mp.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        if _is_quantized(self._model):
+            # Quantized tensors cannot be moved to shared memory, so every worker unpickles a copy of the model.
+            engine = pickle.dumps(self)
+        else:
+            if isinstance(self._model, torch.nn.Module):
+                # Tensors in shared memory are sent to the workers as handles rather than copies.
+                self._model.share_memory()
+            engine = self
+        # Queue.put hands items to a feeder thread, so enqueueing never blocks on a full pipe, however many batches
+        # there are.
+        tasks, results = context.Queue(), context.Queue()
+        processes = [
+            context.Process(
+                target=InferenceEngine._work, args=(engine, encodings, batches, tasks, results, threads), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for batch_id in range(len(batches)):
+            tasks.put(batch_id)
+        for _ in range(workers):
+            tasks.put(None)
+        completed = 0
+        try:
+            with tqdm(total=len(batches)) as progress:
+                while completed < len(batches):
+                    try:
+                        batch_id, batch_logits = results.get(timeout=1.)
+                    except queue.Empty:
+                        if any(process.exitcode not in (None, 0) for process in processes):
+                            raise RuntimeError('An inference worker died unexpectedly')
+                        continue
+                    if batch_id is None:
+                        raise RuntimeError(f'An inference worker failed:\n{batch_logits}')
+                    logits[batches[batch_id]] = batch_logits
+                    completed += 1
+                    progress.update()
+        finally:
+            for process in processes:
+                if completed < len(batches):
+                    process.terminate()
+                process.join()
+
+    @staticmethod
+    def _work(
+            engine,
+            encodings: RaggedEncodings,
+            batches: List[np.ndarray],
+            tasks,
+            results,
+            threads: int) -> None:
+        if isinstance(engine, bytes):
+            engine = pickle.loads(engine)
+        engine._set_threads(threads)
+        try:
+            with torch.inference_mode():
+                for batch_id in iter(tasks.get, None):
+                    results.put((batch_id, engine._forward(encodings.pad(batches[batch_id], engine._pad_values))))
+        except Exception:
+            results.put((None, traceback.format_exc()))
+
+    def __getstate__(self) -> Dict:
+        # Workers only run the model on encoded batches.
+        state = self.__dict__.copy()
+        state.update(_tokenizer=None, _encoding_cache=None)
+        return state
+
+    def _set_threads(self, threads: int) -> None:
+        """
+        Sets the number of intra-op threads of the backend in a worker process.
+        """
+        torch.set_num_threads(threads)
+
+    def _forward(self, batch: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        :param batch: padded encodings of a batch of texts.
+        :return: logits of the texts of the batch.
+        """
+        inputs = {key: torch.from_numpy(value).to(self._model.device) for key, value in batch.items()}
+        return self._model(**inputs).logits.float().cpu().numpy()
+
+
+def _is_quantized(model) -> bool:
+    return isinstance(model, torch.nn.Module) and \
+        any(isinstance(module, torch.ao.nn.quantized.Linear) for module in model.modules())
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from transformers import PreTrainedModel, PreTrainedTokenizer
+
+from src.common.utils.cache import DEFAULT_CACHE_DIR, HashedShardStore, text_hashes
+from src.models.encoding_cache import tokenizer_fingerprint
+
+LOGITS = 'logits'
+
+
+class LogitsCache:
+    """
+    On-disk cache of logits computed by a model. Logits are stored as float32 arrays in a directory
+    specific to the model weights and configuration, the tokenizer and the inference settings,
+    and identified by the hash of the text. Only texts missing in the cache are run through the model.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            model: PreTrainedModel,
+            cache_dir: str = f"{DEFAULT_CACHE_DIR}/logits"):
+        """
+        :param tokenizer: tokenizer used with the model.
+        :param model: PyTorch model or OnnxClassifier.
+        :param cache_dir: directory where logits of all models are stored.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(model_fingerprint(model).encode('utf-8'))
+        digest.update(tokenizer_fingerprint(tokenizer).encode('utf-8'))
+        self._directory = f"{cache_dir}/{digest.hexdigest()}"
+        self._stores: Dict[str, HashedShardStore] = {}
+
+    def get(
+            self,
+            texts: List[str],
+            compute: Callable[[np.ndarray], np.ndarray],
+            settings: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """
+        :param texts: texts to classify.
+        :param compute: function returning logits of the texts at the given positions, called for cache misses.
+        :param settings: inference settings that change the logits, e.g. splitting long texts into windows.
+        :return: logits of the texts, in order.
+        """
+        store = self._store(settings or {})
+        hashes = text_hashes(texts)
+        shard_ids, rows = store.lookup(hashes)
+
+        missing = np.flatnonzero(shard_ids < 0)
+        print(f'Logits cache: {len(texts) - len(missing)} hits, {len(missing)} misses')
+        if len(missing):
+            # Duplicated texts are computed and stored once.
+            _, first_positions = np.unique(hashes[missing], return_index=True)
+            missing_positions = missing[np.sort(first_positions)]
+            store.add(hashes[missing_positions], {LOGITS: np.asarray(compute(missing_positions), dtype=np.float32)})
+            shard_ids, rows = store.lookup(hashes)
+
+        logits = None
+        for shard_id in np.unique(shard_ids):
+            in_shard = np.flatnonzero(shard_ids == shard_id)
+            shard_logits = store.shard(store.shard_names[shard_id])[LOGITS]
+            if logits is None:
+                logits = np.empty((len(texts), shard_logits.shape[1]), dtype=np.float32)
+            logits[in_shard] = shard_logits[rows[in_shard]]
+        return logits
+
+    def _store(self, settings: Dict[str, Any]) -> HashedShardStore:
+        settings_key = hashlib.blake2b(
+            json.dumps(settings, sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+        if settings_key not in self._stores:
+            self._stores[settings_key] = HashedShardStore(f"{self._directory}/{settings_key}")
+        return self._stores[settings_key]
+
+
+def model_fingerprint(model: PreTrainedModel) -> str:
+    """
+    Identifies a model by its configuration and weights rather than its path, so that retraining
+    a model in the same directory or quantizing it never returns stale logits.
+    :param model: PyTorch model or OnnxClassifier.
+    :return: hex digest identifying the model.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model.config.to_json_string(use_diff=False).encode('utf-8'))
+    onnx_path = getattr(model, 'onnx_path', None)
+    if onnx_path is not None:
+        # Weights of large models are stored next to the graph.
+        for path in (onnx_path, f'{onnx_path}.data'):
+            if os.path.exists(path):
+                with open(path, 'rb') as model_file:
+                    for block in iter(lambda: model_file.read(1 << 20), b''):
+                        digest.update(block)
+        return digest.hexdigest()
+
+    for name, value in sorted(model.state_dict().items()):
+        digest.update(name.encode('utf-8'))
+        _update_digest(digest, value)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value: Any) -> None:
+    """
+    Hashes a value of a state dict. Quantized layers store tuples of packed tensors and dtypes.
+    """
+    if isinstance(value, torch.Tensor):
+        tensor = value.detach().cpu()
+        if tensor.is_quantized:
+            tensor = tensor.dequantize()
+        digest.update(str(tensor.dtype).encode('utf-8'))
+        digest.update(tensor.contiguous().view(-1).view(torch.uint8).numpy())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode('utf-8'))
@@ -0,0 +1,102 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from transformers import PreTrainedTokenizer
+
+from src.common.consts import AGGREGATIONS
+from src.models.encodings import RaggedEncodings
+
+
+def chunk_encodings(
+        encodings: RaggedEncodings,
+        tokenizer: PreTrainedTokenizer,
+        max_length: Optional[int] = None,
+        stride: int = 128) -> Tuple[RaggedEncodings, np.ndarray]:
+    """
+    Splits untruncated encodings of documents into overlapping windows of at most max_length tokens.
+    Every window keeps the special tokens of its document (e.g. [CLS] and [SEP]), so that it can be
+    classified on its own. Windows of a document are consecutive, in the order of the document.
+    :param encodings: encodings of the documents created with truncation disabled.
+    :param tokenizer: tokenizer that created the encodings.
+    :param max_length: maximal number of tokens of a window. Defaults to the maximal length of the tokenizer's model.
+    :param stride: number of tokens shared by consecutive windows of a document.
+    :return: encodings of the windows and the index of the document of every window.
+    """
+    max_length = max_length or tokenizer.model_max_length
+    prefix, suffix = _special_tokens_counts(tokenizer)
+    window = max_length - prefix - suffix
+    if window <= 0 or not 0 <= stride < window:
+        raise ValueError(f'Stride should be non-negative and shorter than the window of {window} tokens')
+    step = window - stride
+
+    # Tokens between the special tokens of every document.
+    body_lengths = np.maximum(encodings.lengths - prefix - suffix, 0)
+    n_windows = 1 + np.maximum(-(-(body_lengths - window) // step), 0)
+    doc_ids = np.repeat(np.arange(len(encodings)), n_windows)
+    window_ids = np.arange(len(doc_ids)) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    window_starts = window_ids * step
+    window_lengths = np.minimum(window, body_lengths[doc_ids] - window_starts)
+
+    # Positions of the tokens of every window in the flat arrays of the documents:
+    # prefix special tokens, the window of the body and suffix special tokens.
+    doc_starts = encodings.offsets[:-1][doc_ids]
+    doc_ends = encodings.offsets[1:][doc_ids]
+    chunk_lengths = prefix + window_lengths + suffix
+    offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    np.cumsum(chunk_lengths, out=offsets[1:])
+    within_chunk = np.arange(offsets[-1]) - np.repeat(offsets[:-1], chunk_lengths)
+    chunk_ids = np.repeat(np.arange(len(doc_ids)), chunk_lengths)
+    positions = np.where(
+        within_chunk < prefix,
+        doc_starts[chunk_ids] + within_chunk,
+        np.where(
+            within_chunk < prefix + window_lengths[chunk_ids],
+            doc_starts[chunk_ids] + window_starts[chunk_ids] + within_chunk,
+            doc_ends[chunk_ids] - (chunk_lengths[chunk_ids] - within_chunk)))
+    values = {key: np.asarray(values[positions]) for key, values in encodings.values.items()}
+    return RaggedEncodings(values, offsets), doc_ids
+
+
+def aggregate_chunk_logits(
+        logits: np.ndarray,
+        doc_ids: np.ndarray,
+        aggregation: str = "mean") -> np.ndarray:
+    """
+    Reduces logits of the windows of every document to a single row with segment reductions.
+    :param logits: logits of the windows, with shape (number of windows, number of labels).
+    :param doc_ids: index of the document of every window. Windows of a document have to be consecutive
+    and every document has to have at least one window, as returned by chunk_encodings.
+    :param aggregation: one of AGGREGATIONS. "mean" and "max" reduce every label separately,
+    "attention" averages the logits weighted by the softmax of the confidence of the windows,
+    so that windows strongly indicating a label dominate the neutral ones.
+    :return: logits of the documents, with shape (number of documents, number of labels).
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f'Aggregation should be one of {AGGREGATIONS}')
+    segment_starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    counts = np.diff(np.r_[segment_starts, len(doc_ids)])
+
+    if aggregation == "max":
+        return np.maximum.reduceat(logits, segment_starts, axis=0)
+    if aggregation == "mean":
+        return np.add.reduceat(logits, segment_starts, axis=0) / counts[:, None]
+
+    # Confidence of a window is the log-probability of its most probable label.
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    scores = -np.log(np.exp(shifted).sum(axis=1))
+    scores = scores - np.repeat(np.maximum.reduceat(scores, segment_starts), counts)
+    weights = np.exp(scores)
+    weights /= np.repeat(np.add.reduceat(weights, segment_starts), counts)
+    return np.add.reduceat(logits * weights[:, None], segment_starts, axis=0)
+
+
+def _special_tokens_counts(tokenizer: PreTrainedTokenizer) -> Tuple[int, int]:
+    """
+    :return: number of special tokens added by the tokenizer before and after a single text.
+    """
+    text_ids = tokenizer("a", add_special_tokens=False)['input_ids']
+    with_special_tokens = tokenizer("a")['input_ids']
+    for position in range(len(with_special_tokens) - len(text_ids) + 1):
+        if with_special_tokens[position:position + len(text_ids)] == text_ids:
+            return position, len(with_special_tokens) - position - len(text_ids)
+    raise ValueError('Tokenizer changes the tokens of a text when adding special tokens')
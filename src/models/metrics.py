@@ -1,30 +1,262 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import numpy as np
-from sklearn import metrics
-from sklearn.metrics import classification_report, confusion_matrix
 
 from src.models.datasets import DEFAULT_POSSIBLE_LABELS
 
+MACRO_METRICS = ("f1", "recall", "precision", "accuracy")
+
 
 def compute_metrics(eval_pred: tuple):
     logits, labels = eval_pred
-    predictions = np.argmax(logits, axis=-1)
-    return {
-        "f1": metrics.f1_score(y_pred=predictions, y_true=labels, average="macro"),
-        "recall": metrics.recall_score(y_pred=predictions, y_true=labels, average="macro"),
-        "precision": metrics.precision_score(y_pred=predictions, y_true=labels, average="macro"),
-        "accuracy": metrics.accuracy_score(y_pred=predictions, y_true=labels)
-    }
+    scores = metrics_from_confusion(confusion_counts(labels, np.argmax(logits, axis=-1), _n_labels(logits)))
+    return {metric: float(scores[metric]) for metric in MACRO_METRICS}
 
 
-def get_classification_report(eval_pred: tuple):
+def get_classification_report(eval_pred: tuple, confidence_intervals: Optional[Dict[str, np.ndarray]] = None):
     logits, labels = eval_pred
-    predictions = np.argmax(logits, axis=-1)
-    # If our default 3 values are used, show target names, if not - don't
-    target_names = DEFAULT_POSSIBLE_LABELS if len(logits) and len(logits[0]) == 3 else None
-    return classification_report(labels, predictions, target_names=target_names)
+    n_labels = _n_labels(logits)
+    scores = metrics_from_confusion(confusion_counts(labels, np.argmax(logits, axis=-1), n_labels))
+    return format_classification_report(scores, label_names(n_labels), confidence_intervals)
 
 
 def get_confusion_matrix(eval_pred: tuple):
     logits, labels = eval_pred
-    predictions = np.argmax(logits, axis=-1)
-    return confusion_matrix(labels, predictions)
+    return confusion_counts(labels, np.argmax(logits, axis=-1), _n_labels(logits))
+
+
+def label_names(n_labels: int) -> Sequence[str]:
+    """
+    :return: names of the labels of a model. If our default 3 values are used, show target names,
+    if not - show label indices.
+    """
+    return DEFAULT_POSSIBLE_LABELS if n_labels == 3 else [str(label) for label in range(n_labels)]
+
+
+class MetricsAccumulator:
+    """
+    Accumulates metrics of logits fed batch by batch: a running confusion matrix, calibration bins
+    of the confidence of predicted labels and the sum of log-losses. Memory does not grow with
+    the number of texts, unless the logits are retained.
+    """
+
+    def __init__(self, n_labels: int, n_bins: int = 15, keep_logits: bool = False):
+        """
+        :param n_labels: number of possible labels.
+        :param n_bins: number of equal-width confidence bins used for the expected calibration error.
+        :param keep_logits: if True, logits and labels of all texts are retained, e.g. for bootstrapping.
+        """
+        self._n_labels = n_labels
+        self._n_bins = n_bins
+        self._keep_logits = keep_logits
+        self._n_texts = 0
+        self._confusion = np.zeros((n_labels, n_labels), dtype=np.int64)
+        self._bin_counts = np.zeros(n_bins, dtype=np.int64)
+        self._bin_confidence = np.zeros(n_bins)
+        self._bin_correct = np.zeros(n_bins)
+        self._log_loss = 0.
+        self._kept: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+    @property
+    def n_texts(self) -> int:
+        return self._n_texts
+
+    @property
+    def confusion(self) -> np.ndarray:
+        return self._confusion.copy()
+
+    def update(self, logits: np.ndarray, labels: Sequence[int], indices: Optional[np.ndarray] = None) -> None:
+        """
+        :param logits: logits of a batch of texts.
+        :param labels: true labels of the texts.
+        :param indices: positions of the texts in the dataset, used to order retained logits.
+        Defaults to the order in which the texts are fed.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        if not len(labels):
+            return
+        log_probabilities = _log_softmax(np.asarray(logits, dtype=np.float64))
+        predictions = np.argmax(log_probabilities, axis=-1)
+        self._confusion += confusion_counts(labels, predictions, self._n_labels)
+        self._log_loss -= log_probabilities[np.arange(len(labels)), labels].sum()
+
+        confidence = np.exp(log_probabilities.max(axis=-1))
+        bins = np.minimum((confidence * self._n_bins).astype(np.int64), self._n_bins - 1)
+        self._bin_counts += np.bincount(bins, minlength=self._n_bins)
+        self._bin_confidence += np.bincount(bins, weights=confidence, minlength=self._n_bins)
+        self._bin_correct += np.bincount(bins, weights=predictions == labels, minlength=self._n_bins)
+
+        if self._keep_logits:
+            if indices is None:
+                indices = np.arange(self._n_texts, self._n_texts + len(labels))
+            self._kept.append((np.asarray(indices), np.asarray(logits, dtype=np.float32), labels))
+        self._n_texts += len(labels)
+
+    def eval_pred(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: retained logits and labels of all texts, ordered by their indices.
+        """
+        if not self._keep_logits:
+            raise ValueError('Logits are not retained, create the accumulator with keep_logits=True')
+        if not self._kept:
+            return np.empty((0, self._n_labels), dtype=np.float32), np.empty(0, dtype=np.int64)
+        indices, logits, labels = (np.concatenate(values) for values in zip(*self._kept))
+        order = np.argsort(indices, kind='stable')
+        return logits[order], labels[order]
+
+    def calibration_bins(self) -> Dict[str, np.ndarray]:
+        """
+        :return: dict with the number of texts, their mean confidence and accuracy in every confidence bin.
+        """
+        return {
+            'counts': self._bin_counts.copy(),
+            'confidence': _safe_divide(self._bin_confidence, self._bin_counts),
+            'accuracy': _safe_divide(self._bin_correct, self._bin_counts),
+        }
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: macro averaged metrics, the mean log-loss and the expected calibration error.
+        """
+        scores = metrics_from_confusion(self._confusion)
+        result = {metric: float(scores[metric]) for metric in MACRO_METRICS}
+        result['log_loss'] = float(_safe_divide(self._log_loss, self._n_texts))
+        result['expected_calibration_error'] = float(
+            _safe_divide(np.abs(self._bin_correct - self._bin_confidence).sum(), self._n_texts))
+        return result
+
+    def classification_report(self, confidence_intervals: Optional[Dict[str, np.ndarray]] = None) -> str:
+        scores = metrics_from_confusion(self._confusion)
+        return format_classification_report(scores, label_names(self._n_labels), confidence_intervals)
+
+
+def confusion_counts(labels: Sequence[int], predictions: Sequence[int], n_labels: int) -> np.ndarray:
+    """
+    :param labels: true label of every text.
+    :param predictions: predicted label of every text.
+    :param n_labels: number of possible labels.
+    :return: confusion matrix with true labels in rows and predicted labels in columns.
+    """
+    codes = np.asarray(labels, dtype=np.int64) * n_labels + np.asarray(predictions, dtype=np.int64)
+    return np.bincount(codes, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+
+
+def metrics_from_confusion(confusion: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Derives all metrics from confusion matrices. Macro averages, as in sklearn, take into account
+    labels that are either true or predicted for at least one text. Undefined ratios are 0.
+    :param confusion: confusion matrix or an array of them, with shape (..., n_labels, n_labels).
+    :return: dict of per-class arrays ("class_precision", "class_recall", "class_f1", "support",
+    shape (..., n_labels)) and macro averages with accuracy ("precision", "recall", "f1", "accuracy", shape (...)).
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    true_positives = np.diagonal(confusion, axis1=-2, axis2=-1)
+    support = confusion.sum(axis=-1)
+    predicted = confusion.sum(axis=-2)
+    precision = _safe_divide(true_positives, predicted)
+    recall = _safe_divide(true_positives, support)
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+
+    present = (support > 0) | (predicted > 0)
+    n_present = present.sum(axis=-1)
+    return {
+        "class_precision": precision,
+        "class_recall": recall,
+        "class_f1": f1,
+        "support": support,
+        "precision": _safe_divide((precision * present).sum(axis=-1), n_present),
+        "recall": _safe_divide((recall * present).sum(axis=-1), n_present),
+        "f1": _safe_divide((f1 * present).sum(axis=-1), n_present),
+        "accuracy": _safe_divide(true_positives.sum(axis=-1), support.sum(axis=-1)),
+    }
+
+
+def bootstrap_confidence_intervals(
+        eval_pred: tuple,
+        n_samples: int = 10000,
+        confidence: float = 0.95,
+        seed: int = 42,
+        max_elements: int = 10 ** 7) -> Dict[str, np.ndarray]:
+    """
+    Percentile bootstrap confidence intervals of the macro metrics. Texts are resampled with replacement
+    as one array of indices per chunk of samples, and confusion matrices of all samples of a chunk
+    are counted with a single bincount.
+    :param eval_pred: logits and labels.
+    :param n_samples: number of bootstrap samples.
+    :param confidence: confidence level of the intervals.
+    :param seed: random seed.
+    :param max_elements: maximal number of resampled indices held in memory at once.
+    :return: dict with (lower, upper) bound of every metric in MACRO_METRICS.
+    """
+    logits, labels = eval_pred
+    n_labels = _n_labels(logits)
+    codes = np.asarray(labels, dtype=np.int64) * n_labels + np.argmax(logits, axis=-1)
+    n_cells = n_labels * n_labels
+    generator = np.random.default_rng(seed)
+    chunk_size = max(max_elements // max(len(codes), 1), 1)
+
+    samples = {metric: [] for metric in MACRO_METRICS}
+    for chunk_start in range(0, n_samples, chunk_size):
+        n_chunk = min(chunk_size, n_samples - chunk_start)
+        indices = generator.integers(0, len(codes), size=(n_chunk, len(codes)))
+        # Every sample counts its cells in a separate range of bins.
+        sample_codes = codes[indices] + (np.arange(n_chunk) * n_cells)[:, None]
+        confusions = np.bincount(sample_codes.ravel(), minlength=n_chunk * n_cells).reshape(n_chunk, n_labels,
+                                                                                           n_labels)
+        scores = metrics_from_confusion(confusions)
+        for metric in MACRO_METRICS:
+            samples[metric].append(scores[metric])
+
+    tail = (1 - confidence) / 2 * 100
+    return {
+        metric: np.percentile(np.concatenate(values), [tail, 100 - tail])
+        for metric, values in samples.items()
+    }
+
+
+def format_classification_report(
+        scores: Dict[str, np.ndarray],
+        target_names: Sequence[str],
+        confidence_intervals: Optional[Dict[str, np.ndarray]] = None) -> str:
+    """
+    :param scores: output of metrics_from_confusion for a single confusion matrix.
+    :param target_names: name of every label.
+    :param confidence_intervals: if set, bounds of the macro metrics printed below the report.
+    :return: text report in the layout of sklearn classification_report.
+    """
+    width = max(len("weighted avg"), *(len(name) for name in target_names))
+    header = f"{'':>{width}} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}"
+    lines = [header, ""]
+    for i, name in enumerate(target_names):
+        lines.append(f"{name:>{width}} {scores['class_precision'][i]:>9.2f} {scores['class_recall'][i]:>9.2f} "
+                     f"{scores['class_f1'][i]:>9.2f} {int(scores['support'][i]):>9}")
+    total = int(scores['support'].sum())
+    weights = _safe_divide(scores['support'], total)
+    lines.append("")
+    lines.append(f"{'accuracy':>{width}} {'':>9} {'':>9} {scores['accuracy']:>9.2f} {total:>9}")
+    lines.append(f"{'macro avg':>{width}} {scores['precision']:>9.2f} {scores['recall']:>9.2f} "
+                 f"{scores['f1']:>9.2f} {total:>9}")
+    lines.append(f"{'weighted avg':>{width}} {(scores['class_precision'] * weights).sum():>9.2f} "
+                 f"{(scores['class_recall'] * weights).sum():>9.2f} {(scores['class_f1'] * weights).sum():>9.2f} "
+                 f"{total:>9}")
+    if confidence_intervals is not None:
+        lines.append("")
+        for metric, (lower, upper) in confidence_intervals.items():
+            lines.append(f"{metric:>{width}} {scores[metric]:>9.2f}   CI [{lower:.2f}, {upper:.2f}]")
+    return "\n".join(lines) + "\n"
+
+
+def _log_softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+def _n_labels(logits) -> int:
+    logits = np.asarray(logits)
+    return logits.shape[-1] if logits.ndim == 2 else 0
+
+
+def _safe_divide(numerator, denominator):
+    numerator, denominator = np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
@@ -0,0 +1,196 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoTokenizer, PreTrainedModel, PreTrainedTokenizer
+
+from src.common.utils.startup import report_startup
+from src.models.inference import InferenceEngine
+from src.models.read import read_from_dir
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def export_onnx(model_dir: str, output_dir: Optional[str] = None, opset: int = 18) -> str:
+    """
+    Exports a model saved by train_model.py to ONNX with dynamic batch and sequence axes.
+    The tokenizer and the configuration are saved next to the ONNX model, so that the output
+    directory can be read by read_onnx_from_dir on its own.
+    :param model_dir: path to the dir where tokenizer and model are stored.
+    :param output_dir: directory of the exported model. Defaults to model_dir.
+    :param opset: ONNX opset version.
+    :return: path to the ONNX model.
+    """
+    output_dir = output_dir or model_dir
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer, model = read_from_dir(model_dir)
+    model.eval()
+
+    sample = tokenizer(["Przykładowy komunikat", "Drugi, nieco dłuższy komunikat giełdowy"],
+                       padding=True, return_tensors="pt")
+    input_names = [name for name in ONNX_INPUTS if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    onnx_path = f"{output_dir}/{ONNX_MODEL_FILE}"
+    torch.onnx.export(
+        _LogitsOnly(model),
+        tuple(sample[name] for name in input_names),
+        onnx_path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset)
+
+    if output_dir != model_dir:
+        tokenizer.save_pretrained(output_dir)
+        model.config.save_pretrained(output_dir)
+    return onnx_path
+
+
+class OnnxClassifier:
+    """
+    Sequence classifier exported by export_onnx, run by onnxruntime on CPU.
+    The session is created lazily in every process, so the classifier can be sent to worker processes.
+    """
+
+    def __init__(self, onnx_path: str, config: AutoConfig, threads: Optional[int] = None):
+        """
+        :param onnx_path: path to the ONNX model.
+        :param config: configuration of the exported model.
+        :param threads: number of intra-op threads. Defaults to the onnxruntime default (all cores).
+        """
+        self.config = config
+        self._onnx_path = onnx_path
+        self._threads = threads
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def onnx_path(self) -> str:
+        return self._onnx_path
+
+    def eval(self) -> 'OnnxClassifier':
+        return self
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state.update(_session=None, _session_pid=None)
+        return state
+
+    def set_num_threads(self, threads: int) -> None:
+        if threads != self._threads:
+            self._threads = threads
+            self._session = None
+
+    def logits(self, batch: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        :param batch: padded encodings of a batch of texts.
+        :return: logits of the texts of the batch.
+        """
+        session = self._get_session()
+        input_names = {model_input.name for model_input in session.get_inputs()}
+        feed = {name: values.astype(np.int64, copy=False) for name, values in batch.items() if name in input_names}
+        return session.run(["logits"], feed)[0]
+
+    def _get_session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self._threads is not None:
+                options.intra_op_num_threads = self._threads
+                options.inter_op_num_threads = 1
+            self._session = onnxruntime.InferenceSession(
+                self._onnx_path, options, providers=["CPUExecutionProvider"])
+            self._session_pid = os.getpid()
+        return self._session
+
+
+class OnnxInferenceEngine(InferenceEngine):
+    """
+    InferenceEngine running an OnnxClassifier instead of a PyTorch model.
+    """
+
+    def _forward(self, batch: Dict[str, np.ndarray]) -> np.ndarray:
+        return self._model.logits(batch)
+
+    def _set_threads(self, threads: int) -> None:
+        self._model.set_num_threads(threads)
+
+
+def read_onnx_from_dir(model_dir: str) -> Tuple[PreTrainedTokenizer, OnnxClassifier]:
+    """
+    Reads a model exported by export_onnx and its tokenizer. The ONNX Runtime session is created
+    on the first prediction, in the process that runs it. The time of every stage is reported.
+    :param model_dir: path to the dir where tokenizer and ONNX model are stored.
+    :return: tokenizer and the ONNX classifier.
+    """
+    report_startup('Imported modules')
+    start = time.perf_counter()
+    model_config = AutoConfig.from_pretrained(model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    print(f'Loaded configuration and tokenizer in {time.perf_counter() - start:.2f}s')
+    model = OnnxClassifier(f"{model_dir}/{ONNX_MODEL_FILE}", model_config)
+    report_startup('Model ready')
+    return tokenizer, model
+
+
+def create_inference_engine(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        **kwargs) -> InferenceEngine:
+    """
+    :param model: PyTorch model or OnnxClassifier.
+    :param kwargs: arguments of InferenceEngine.
+    :return: inference engine running the model with its backend.
+    """
+    engine_class = OnnxInferenceEngine if isinstance(model, OnnxClassifier) else InferenceEngine
+    return engine_class(tokenizer, model, **kwargs)
+
+
+def compare_backends(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        onnx_model: OnnxClassifier,
+        texts: List[str],
+        batch_size: int = 32) -> Dict[str, float]:
+    """
+    Runs both models on the same encodings and compares their logits and speed.
+    :return: dict with the maximal absolute difference of logits, the fraction of equal predictions
+    and the throughput (texts per second) of both backends.
+    """
+    report = {}
+    engines = {
+        'pytorch': InferenceEngine(tokenizer, model, batch_size=batch_size),
+        'onnx': OnnxInferenceEngine(tokenizer, onnx_model, batch_size=batch_size),
+    }
+    encodings = engines['pytorch'].encode(texts)
+    logits = {}
+    for name, engine in engines.items():
+        # The first batch initializes the backend and is not measured.
+        engine.predict_encodings(encodings.take([0]))
+        start = time.perf_counter()
+        logits[name] = engine.predict_encodings(encodings)
+        report[f'{name}_texts_per_second'] = len(texts) / (time.perf_counter() - start)
+    report['max_abs_diff'] = float(np.abs(logits['pytorch'] - logits['onnx']).max())
+    report['prediction_agreement'] = float(
+        np.mean(logits['pytorch'].argmax(axis=-1) == logits['onnx'].argmax(axis=-1)))
+    report['speedup'] = report['onnx_texts_per_second'] / report['pytorch_texts_per_second']
+    return report
+
+
+class _LogitsOnly(torch.nn.Module):
+    """
+    Exposes the classifier as a function of positional inputs returning a single tensor.
+    """
+
+    def __init__(self, model: PreTrainedModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
@@ -0,0 +1,114 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import PreTrainedModel, PreTrainedTokenizer, BertForSequenceClassification, PretrainedConfig
+
+from src.models.encoding_cache import EncodingCache
+from src.models.inference import InferenceEngine
+from src.models.metrics import compute_metrics
+
+QUANTIZED_WEIGHTS_FILE = "quantized_model.safetensors"
+
+
+def quantize_model(model: PreTrainedModel) -> PreTrainedModel:
+    """
+    Applies dynamic INT8 quantization to the Linear layers of the model. Weights are stored as int8
+    and activations are quantized on the fly, which speeds up CPU inference. The model is not modified.
+    :param model: full-precision model.
+    :return: quantized model in eval mode.
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized_model(model: PreTrainedModel, tokenizer: PreTrainedTokenizer, output_dir: str) -> None:
+    """
+    Saves the quantized weights with the configuration and the tokenizer, so that
+    read_from_dir(output_dir, quantized=True) recreates the model without the full-precision weights.
+    Packed int8 weights are stored as plain int8 tensors with their scales, so that the file
+    can be read safely, without unpickling.
+    """
+    from safetensors.torch import save_file
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    tensors = {}
+    quantized_layers = _quantized_linear_layers(model)
+    for name, layer in quantized_layers.items():
+        weight, bias = layer.weight(), layer.bias()
+        tensors[f"{name}.weight.int8"] = weight.int_repr()
+        tensors[f"{name}.weight.scale"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+        tensors[f"{name}.weight.zero_point"] = torch.tensor(weight.q_zero_point(), dtype=torch.int64)
+        if bias is not None:
+            tensors[f"{name}.bias"] = bias
+    for key, value in model.state_dict().items():
+        if isinstance(value, torch.Tensor) and key.rsplit('.', 1)[0] not in quantized_layers:
+            tensors[key] = value.contiguous()
+    save_file(tensors, f"{output_dir}/{QUANTIZED_WEIGHTS_FILE}")
+
+
+def load_quantized_model(model_dir: str, config: PretrainedConfig) -> PreTrainedModel:
+    """
+    :param model_dir: directory with weights saved by save_quantized_model.
+    :param config: configuration of the model.
+    :return: quantized model in eval mode.
+    """
+    from safetensors.torch import load_file
+
+    model = quantize_model(BertForSequenceClassification(config))
+    tensors = load_file(f"{model_dir}/{QUANTIZED_WEIGHTS_FILE}")
+    quantized_layers = _quantized_linear_layers(model)
+    for name, layer in quantized_layers.items():
+        values = tensors.pop(f"{name}.weight.int8")
+        scale = float(tensors.pop(f"{name}.weight.scale"))
+        zero_point = int(tensors.pop(f"{name}.weight.zero_point"))
+        # Dequantized values are quantized back to exactly the same integers.
+        weight = torch.quantize_per_tensor((values.float() - zero_point) * scale, scale, zero_point, torch.qint8)
+        layer.set_weight_bias(weight, tensors.pop(f"{name}.bias", None))
+    # Quantized layers expect their own (already set) entries, so the remaining weights update the full state.
+    state = model.state_dict()
+    state.update(tensors)
+    model.load_state_dict(state)
+    return model
+
+
+def _quantized_linear_layers(model: PreTrainedModel) -> Dict[str, torch.nn.Module]:
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+
+    return {name: module for name, module in model.named_modules() if isinstance(module, DynamicQuantizedLinear)}
+
+
+def compare_quantized(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        quantized_model: PreTrainedModel,
+        test_dataset: Tuple[List[str], List[int]],
+        batch_size: int = 32,
+        max_tokens: Optional[int] = None,
+        encoding_cache: Optional[EncodingCache] = None) -> Dict[str, float]:
+    """
+    Evaluates both models on the same encodings of the test set.
+    :return: dict with metrics of both models (prefixed with "fp32_" and "int8_"), the macro F1 delta
+    (int8 - fp32), the inference time of both models in seconds and the speedup of the quantized model.
+    """
+    texts, labels = test_dataset
+    report = {}
+    engines = {
+        'fp32': InferenceEngine(tokenizer, model, batch_size=batch_size, max_tokens=max_tokens,
+                                encoding_cache=encoding_cache),
+        'int8': InferenceEngine(tokenizer, quantized_model, batch_size=batch_size, max_tokens=max_tokens),
+    }
+    encodings = engines['fp32'].encode(texts)
+    for name, engine in engines.items():
+        start = time.perf_counter()
+        logits = engine.predict_encodings(encodings)
+        report[f'{name}_seconds'] = time.perf_counter() - start
+        report.update({f'{name}_{metric}': value for metric, value in compute_metrics((logits, labels)).items()})
+    report['f1_delta'] = report['int8_f1'] - report['fp32_f1']
+    report['speedup'] = report['fp32_seconds'] / report['int8_seconds']
+    return report
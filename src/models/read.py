@@ -1,21 +1,52 @@
+import os
+import time
 from typing import Tuple
 
 from transformers import PreTrainedTokenizer, PreTrainedModel, AutoConfig, AutoTokenizer, BertForSequenceClassification
 
+from src.common.utils.startup import report_startup
+from src.models.adapters import ADAPTER_CONFIG_FILE, load_adapter_model
+from src.models.quantization import QUANTIZED_WEIGHTS_FILE, load_quantized_model, quantize_model
 
-def read_from_dir(model_dir: str) -> Tuple[PreTrainedTokenizer, PreTrainedModel]:
+SAFETENSORS_WEIGHTS_FILE = "model.safetensors"
+
+
+def read_from_dir(model_dir: str, quantized: bool = False) -> Tuple[PreTrainedTokenizer, PreTrainedModel]:
     """
-    Reads model and tokenizer from a path on the local machine.
+    Reads model and tokenizer from a path on the local machine. Weights saved as safetensors are memory-mapped
+    instead of being read and unpickled. The time of every stage is reported.
     :param model_dir: path to the dir where tokenizer and model are stored
+    :param quantized: if True, the model with dynamically quantized INT8 Linear layers is returned.
+    Weights saved by save_quantized_model are used if present, otherwise the full-precision model is quantized.
+    A directory with an adapter saved by save_adapter_model is re-composed with its base model.
     :return: tokenizer and model saved in the src dir.
     """
-    print('Loading configuraiton...')
+    report_startup('Imported modules')
+    start = time.perf_counter()
     model_config = AutoConfig.from_pretrained(model_dir)
-    print('Loading tokenizer...')
     tokenizer = AutoTokenizer.from_pretrained(model_dir)
-    print('Loading model...')
-    model = BertForSequenceClassification.from_pretrained(
-        model_dir,
-        config=model_config
-    )
+    print(f'Loaded configuration and tokenizer in {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    if quantized and os.path.exists(f"{model_dir}/{QUANTIZED_WEIGHTS_FILE}"):
+        model = load_quantized_model(model_dir, model_config)
+        print(f'Loaded quantized model in {time.perf_counter() - start:.2f}s')
+        report_startup('Model ready')
+        return tokenizer, model
+    if os.path.exists(f"{model_dir}/{ADAPTER_CONFIG_FILE}"):
+        model = load_adapter_model(model_dir, model_config)
+        print(f'Loaded base model with adapter in {time.perf_counter() - start:.2f}s')
+    else:
+        model = BertForSequenceClassification.from_pretrained(
+            model_dir,
+            config=model_config,
+            # Older models saved only as pytorch_model.bin are still read.
+            use_safetensors=True if os.path.exists(f"{model_dir}/{SAFETENSORS_WEIGHTS_FILE}") else None
+        )
+        print(f'Loaded model in {time.perf_counter() - start:.2f}s')
+    if quantized:
+        start = time.perf_counter()
+        model = quantize_model(model)
+        print(f'Quantized model in {time.perf_counter() - start:.2f}s')
+    report_startup('Model ready')
     return tokenizer, model
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Sequence, Set, TextIO, Tuple
+
+import numpy as np
+from transformers import PreTrainedModel, PreTrainedTokenizer
+
+from src.common.consts import SCRAPED_DISPATCHES_DIR
+from src.common.stock_dispatch import StockExchangeDispatch
+from src.common.utils.files_io import load_json
+from src.models.inference import InferenceEngine
+from src.models.metrics import label_names
+from src.models.onnx_inference import create_inference_engine
+
+
+def score_dispatches(
+        tokenizer: PreTrainedTokenizer,
+        model: PreTrainedModel,
+        output_path: str,
+        dispatches_dir: str = SCRAPED_DISPATCHES_DIR,
+        chunk_size: int = 1000,
+        **kwargs) -> Dict[str, float]:
+    """
+    Classifies scraped dispatches and appends their predicted class probabilities to a JSONL file.
+    Dispatch files are read one by one and the dispatches are classified in chunks, sorted by length
+    within a chunk. Every chunk is flushed to disk before the next one is read, so an interrupted run
+    can be resumed: dispatches whose fingerprints are already in the output file are skipped.
+    The output file is meant for a single model.
+    :param tokenizer: tokenizer used for model training.
+    :param model: PyTorch model or OnnxClassifier.
+    :param output_path: path to the JSONL file, one line per dispatch.
+    :param dispatches_dir: directory with JSON files of StockExchangeDispatch lists, e.g. one per company.
+    :param chunk_size: number of dispatches classified at once.
+    :param kwargs: arguments of InferenceEngine, e.g. batch_size, max_tokens or workers.
+    :return: dict with the number of scored and skipped dispatches, the time in seconds and the throughput.
+    """
+    engine = create_inference_engine(tokenizer, model, **kwargs)
+    labels = label_names(engine.num_labels)
+    scored = read_scored_fingerprints(output_path)
+    print(f'{len(scored)} dispatches already scored in {output_path}')
+
+    report = {'scored': 0, 'skipped': 0, 'seconds': 0.}
+    chunk: List[Tuple[str, str, StockExchangeDispatch]] = []
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'a', encoding='utf-8') as output_file:
+        for source, dispatch in iter_dispatches(dispatches_dir):
+            fingerprint = dispatch_fingerprint(dispatch)
+            if fingerprint in scored:
+                report['skipped'] += 1
+                continue
+            scored.add(fingerprint)
+            chunk.append((fingerprint, source, dispatch))
+            if len(chunk) == chunk_size:
+                _score_chunk(engine, chunk, labels, output_file, report)
+                chunk = []
+        if chunk:
+            _score_chunk(engine, chunk, labels, output_file, report)
+
+    report['dispatches_per_second'] = report['scored'] / report['seconds'] if report['seconds'] else 0.
+    print(f"Scored {report['scored']} dispatches ({report['skipped']} skipped) in {report['seconds']:.1f}s, "
+          f"{report['dispatches_per_second']:.1f} dispatches/s")
+    return report
+
+
+def iter_dispatches(dispatches_dir: str) -> Iterator[Tuple[str, StockExchangeDispatch]]:
+    """
+    :param dispatches_dir: directory with JSON files written by scrape_company_dispatches.
+    :return: iterator of (file name, dispatch) pairs, reading one file at a time.
+    Files that are not valid JSON, e.g. cut off by an interrupted scrape, are skipped.
+    """
+    for filename in sorted(os.listdir(dispatches_dir)):
+        if filename.endswith(".json"):
+            try:
+                items = load_json(f"{dispatches_dir}/{filename}")
+            except ValueError as error:
+                print(f'Skipping {filename}, which is not a valid JSON file: {error}')
+                continue
+            for item in items:
+                yield filename, StockExchangeDispatch(**item)
+
+
+def dispatch_fingerprint(dispatch: StockExchangeDispatch) -> str:
+    """
+    :return: hex digest identifying a dispatch by its company, date and content.
+    """
+    key = f'{dispatch.company_name}\0{dispatch.date}\0{dispatch.content}'
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def read_scored_fingerprints(output_path: str) -> Set[str]:
+    """
+    Reads fingerprints of dispatches already written to the output file. A line cut off by
+    an interrupted run (the last one, without a newline) is removed, so that new lines are appended
+    after the last complete one. Complete lines that cannot be read are skipped and kept in the file,
+    so their dispatches are scored again.
+    :param output_path: path to the JSONL file written by score_dispatches.
+    :return: fingerprints of the scored dispatches.
+    """
+    fingerprints = set()
+    if not os.path.exists(output_path):
+        return fingerprints
+    complete_size, malformed = 0, 0
+    with open(output_path, 'rb') as output_file:
+        for line in output_file:
+            if not line.endswith(b'\n'):
+                break
+            complete_size += len(line)
+            try:
+                fingerprints.add(json.loads(line)['fingerprint'])
+            except (ValueError, KeyError, TypeError):
+                malformed += 1
+    if malformed:
+        print(f'Skipped {malformed} malformed lines in {output_path}')
+    if complete_size < os.path.getsize(output_path):
+        print(f'Removing an incomplete line at the end of {output_path}')
+        with open(output_path, 'r+b') as output_file:
+            output_file.truncate(complete_size)
+    return fingerprints
+
+
+def _score_chunk(
+        engine: InferenceEngine,
+        chunk: List[Tuple[str, str, StockExchangeDispatch]],
+        labels: Sequence[str],
+        output_file: TextIO,
+        report: Dict[str, float]) -> None:
+    start = time.perf_counter()
+    logits = engine.predict([dispatch.content for _, _, dispatch in chunk])
+    probabilities = _softmax(logits)
+    lines = []
+    for (fingerprint, source, dispatch), text_probabilities in zip(chunk, probabilities):
+        lines.append(json.dumps({
+            'fingerprint': fingerprint,
+            'file': source,
+            'company_name': dispatch.company_name,
+            'date': dispatch.date,
+            'probabilities': {label: float(p) for label, p in zip(labels, text_probabilities)},
+            'prediction': labels[int(np.argmax(text_probabilities))],
+        }, ensure_ascii=False))
+    output_file.write('\n'.join(lines) + '\n')
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+    seconds = time.perf_counter() - start
+    report['scored'] += len(chunk)
+    report['seconds'] += seconds
+    print(f'{len(chunk)} dispatches in {seconds:.1f}s ({len(chunk) / seconds:.1f} dispatches/s), '
+          f"{report['scored']} scored so far")
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exponents = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exponents / exponents.sum(axis=-1, keepdims=True)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.common.utils.http import HTTP_REASONS, read_http_message, write_http_message
+from src.models.inference import InferenceEngine
+from src.models.metrics import label_names
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class MicroBatcher:
+    """
+    Coalesces single-text requests into micro-batches. Requests wait in an asyncio queue; a batch is run
+    as soon as it has max_batch_size texts or the oldest text waited max_wait_ms. The model runs in a separate
+    thread, so that new requests are queued while a batch is computed and form the next batch.
+    """
+
+    def __init__(
+            self,
+            engine: InferenceEngine,
+            max_batch_size: int = 32,
+            max_wait_ms: float = 5.,
+            latency_window: int = 10000):
+        """
+        :param engine: inference engine running the model, created with verbose=False.
+        :param max_batch_size: maximal number of texts in a batch.
+        :param max_wait_ms: maximal time the first text of a batch waits for other texts.
+        :param latency_window: number of the most recent requests used for latency percentiles.
+        """
+        self._engine = engine
+        self._labels = label_names(engine.num_labels)
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._latencies = deque(maxlen=latency_window)
+        self._requests = 0
+        self._batches = 0
+
+    async def classify(self, text: str) -> Dict[str, Any]:
+        """
+        :param text: text to classify.
+        :return: dict with class probabilities, the predicted label and the latency of the request in ms.
+        """
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self._get_queue().put((text, future))
+        probabilities = await future
+        latency_ms = (time.perf_counter() - start) * 1000
+        self._latencies.append(latency_ms)
+        return {
+            'probabilities': {label: float(p) for label, p in zip(self._labels, probabilities)},
+            'prediction': self._labels[int(np.argmax(probabilities))],
+            'latency_ms': latency_ms,
+        }
+
+    async def run(self) -> None:
+        """
+        Collects and runs batches until cancelled.
+        """
+        queue = self._get_queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and queue.empty():
+                    break
+                try:
+                    batch.append(queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._run_batch(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :return: dict with the queue depth, numbers of requests and batches, the mean batch size
+        and percentiles of the latency (ms) of the recent requests.
+        """
+        latencies = np.asarray(self._latencies)
+        return {
+            'queue_depth': self._get_queue().qsize(),
+            'requests': self._requests,
+            'batches': self._batches,
+            'mean_batch_size': self._requests / self._batches if self._batches else 0.,
+            'latency_ms': {
+                f'p{percentile}': float(np.percentile(latencies, percentile)) if len(latencies) else 0.
+                for percentile in LATENCY_PERCENTILES
+            },
+        }
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            logits = await asyncio.get_running_loop().run_in_executor(self._executor, self._engine.predict, texts)
+        except Exception as exception:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+        exponents = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probabilities = exponents / exponents.sum(axis=-1, keepdims=True)
+        for (_, future), text_probabilities in zip(batch, probabilities):
+            # Requests of disconnected clients are cancelled.
+            if not future.done():
+                future.set_result(text_probabilities)
+        self._requests += len(batch)
+        self._batches += 1
+
+    def _get_queue(self) -> asyncio.Queue:
+        # The queue is created in the running event loop.
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+
+async def serve(batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8000) -> None:
+    """
+    Serves the model over HTTP/1.1 with keep-alive connections until cancelled:
+    - POST /classify with {"text": "..."} returns the result of MicroBatcher.classify,
+    - GET /stats returns MicroBatcher.stats,
+    - GET /health returns {"status": "ok"}.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_http_message(reader)
+                if request is None:
+                    break
+                start_line, headers, body = request
+                method, path = start_line.split(' ')[:2]
+                status, response = await _route(batcher, method, path, body)
+                write_http_message(writer, f'HTTP/1.1 {status} {HTTP_REASONS[status]}', response)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    batching = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(handle, host, port)
+    print(f'Serving on http://{host}:{port}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batching.cancel()
+
+
+async def _route(batcher: MicroBatcher, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+    if path == '/classify':
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            text = json.loads(body)['text']
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'Expected a JSON object with a "text" field'}
+        if not isinstance(text, str):
+            return 400, {'error': '"text" has to be a string'}
+        try:
+            return 200, await batcher.classify(text)
+        except Exception as exception:
+            return 500, {'error': str(exception)}
+    if path == '/stats' and method == 'GET':
+        return 200, batcher.stats()
+    if path == '/health' and method == 'GET':
+        return 200, {'status': 'ok'}
+    return 404, {'error': f'Unknown path {path}'}
@@ -0,0 +1,272 @@
+import hashlib
+import os
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from transformers import PreTrainedTokenizer
+
+from src.common.data_preparation import KlejType, iter_klej_file, iter_annotated_file, label_sentiments, \
+    SENTIMENT_LABELS, file_split
+from src.common.data_preparation.read import KLEJ_TYPE_TO_PATH
+from src.models.batching import PaddingCollator
+from src.models.datasets import SentimentAnalysisDataset, DEFAULT_POSSIBLE_LABELS, POSITIVE_THRESHOLD, \
+    NEGATIVE_THRESHOLD
+from src.models.encodings import encode_texts, get_pad_values
+
+Record = Tuple[str, str]  # text, label
+RecordReader = Callable[[str], Iterable[Record]]
+
+
+class HashRange:
+    """
+    Deterministically assigns texts to a fraction of the data based on their hash,
+    so that a hold-out set can be selected without reading the whole corpus.
+    """
+
+    def __init__(self, start: float, end: float):
+        """
+        Texts with a hash falling into [start, end) fraction of the hash space are kept.
+        """
+        self._start = start
+        self._end = end
+
+    def __call__(self, text: str) -> bool:
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+        position = int.from_bytes(digest, 'little') / 2 ** 64
+        return self._start <= position < self._end
+
+
+class StreamingSentimentDataset(IterableDataset):
+    """
+    Dataset reading records lazily from the source files and tokenizing them on the fly.
+    With DataLoader workers, the sources (or, if there are fewer sources than workers, the records)
+    are divided between the workers, which tokenize in parallel and prefetch the batches.
+    Examples are shuffled within a bounded buffer, so the memory usage does not depend on the corpus size.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            sources: List[str],
+            read_records: RecordReader,
+            possible_labels: Tuple[str, ...] = DEFAULT_POSSIBLE_LABELS,
+            keep: Optional[Callable[[str], bool]] = None,
+            shuffle_buffer_size: int = 10000,
+            tokenize_batch_size: int = 256,
+            seed: int = 42):
+        """
+        :param tokenizer: Transformers tokenizer.
+        :param sources: paths of the files with records.
+        :param read_records: function returning (text, label) records of a source. Has to be picklable.
+        :param possible_labels: records with other labels are skipped.
+        :param keep: if set, only records with texts for which it returns True are used. Has to be picklable.
+        :param shuffle_buffer_size: number of examples in the shuffle buffer. 1 disables shuffling.
+        :param tokenize_batch_size: number of texts tokenized at once.
+        :param seed: random seed. The order changes with every epoch.
+        """
+        super().__init__()
+        self._tokenizer = tokenizer
+        self._sources = sources
+        self._read_records = read_records
+        self._label_mapper = {label: i for i, label in enumerate(possible_labels)}
+        self._keep = keep
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._tokenize_batch_size = tokenize_batch_size
+        self._seed = seed
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch = epoch
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        epoch = self._epoch
+        # Persistent DataLoader workers keep their own copies of the dataset, which set_epoch does not reach.
+        self._epoch += 1
+        generator = np.random.default_rng((self._seed, epoch, worker_id))
+        # All workers shuffle the sources the same way, so that each of them gets a different part.
+        sources = [self._sources[i] for i in np.random.default_rng((self._seed, epoch)).permutation(
+            len(self._sources))]
+
+        if len(sources) >= num_workers:
+            records = self.records(sources[worker_id::num_workers])
+        else:
+            records = (record for i, record in enumerate(self.records(sources)) if i % num_workers == worker_id)
+        return self._shuffle(self._tokenize(records), generator)
+
+    def records(self, sources: Optional[List[str]] = None) -> Iterator[Record]:
+        """
+        :param sources: sources to read. All sources by default.
+        :return: iterator of (text, label) records with possible labels.
+        """
+        for source in self._sources if sources is None else sources:
+            for text, label in self._read_records(source):
+                if label in self._label_mapper and (self._keep is None or self._keep(text)):
+                    yield text, label
+
+    def materialize(self) -> SentimentAnalysisDataset:
+        """
+        Reads and tokenizes all records. Meant for small sets, e.g. the validation set.
+        """
+        texts, labels = [], []
+        for text, label in self.records():
+            texts.append(text)
+            labels.append(self._label_mapper[label])
+        return SentimentAnalysisDataset(encode_texts(self._tokenizer, texts), labels)
+
+    @property
+    def data_collator(self) -> PaddingCollator:
+        return PaddingCollator(get_pad_values(self._tokenizer))
+
+    def _tokenize(self, records: Iterator[Record]) -> Iterator[Dict[str, torch.Tensor]]:
+        texts, labels = [], []
+        for text, label in records:
+            texts.append(text)
+            labels.append(self._label_mapper[label])
+            if len(texts) == self._tokenize_batch_size:
+                yield from self._tokenize_batch(texts, labels)
+                texts, labels = [], []
+        if texts:
+            yield from self._tokenize_batch(texts, labels)
+
+    def _tokenize_batch(self, texts: List[str], labels: List[int]) -> Iterator[Dict[str, torch.Tensor]]:
+        encodings = self._tokenizer(texts, truncation=True)
+        for i, label in enumerate(labels):
+            item = {key: torch.tensor(values[i]) for key, values in encodings.items()}
+            item['labels'] = torch.tensor(label)
+            yield item
+
+    def _shuffle(
+            self,
+            examples: Iterator[Dict[str, torch.Tensor]],
+            generator: np.random.Generator) -> Iterator[Dict[str, torch.Tensor]]:
+        buffer = []
+        for example in examples:
+            if len(buffer) < self._shuffle_buffer_size:
+                buffer.append(example)
+                continue
+            position = generator.integers(len(buffer))
+            yield buffer[position]
+            buffer[position] = example
+        for position in generator.permutation(len(buffer)):
+            yield buffer[position]
+
+
+class StreamingKlejDataset:
+    """
+    Streaming counterpart of KlejDataset. The validation set is selected by text hashes from the training file.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            klej_type: KlejType,
+            possible_labels: Tuple[str, ...] = DEFAULT_POSSIBLE_LABELS,
+            validation_size: float = 0.1,
+            shuffle_buffer_size: int = 10000,
+            random_state: int = 42):
+        self._tokenizer = tokenizer
+        self._dir_path = KLEJ_TYPE_TO_PATH.get(klej_type)
+        self._possible_labels = possible_labels
+        self._validation_size = validation_size
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._random_state = random_state
+
+    def get(self) -> Tuple[StreamingSentimentDataset, SentimentAnalysisDataset, SentimentAnalysisDataset]:
+        """
+        :return: streamed train dataset, validation and test datasets loaded into memory.
+        """
+        train = self._dataset([f'{self._dir_path}/train.tsv'], HashRange(self._validation_size, 1.))
+        val = self._dataset([f'{self._dir_path}/train.tsv'], HashRange(0., self._validation_size))
+        test = self._dataset([f'{self._dir_path}/dev.tsv'])
+        return train, val.materialize(), test.materialize()
+
+    @property
+    def data_collator(self) -> PaddingCollator:
+        return PaddingCollator(get_pad_values(self._tokenizer))
+
+    def _dataset(self, sources: List[str], keep: Optional[HashRange] = None) -> StreamingSentimentDataset:
+        return StreamingSentimentDataset(
+            tokenizer=self._tokenizer,
+            sources=sources,
+            read_records=iter_klej_file,
+            possible_labels=self._possible_labels,
+            keep=keep,
+            shuffle_buffer_size=self._shuffle_buffer_size,
+            seed=self._random_state)
+
+
+class StreamingFinancialDataset:
+    """
+    Streaming counterpart of FinancialDataset. Without shuffling companies, annotated files (one per company)
+    are split by their sizes. Otherwise, the dispatches are split by text hashes.
+    """
+
+    def __init__(
+            self,
+            tokenizer: PreTrainedTokenizer,
+            possible_labels: Tuple[str, ...] = DEFAULT_POSSIBLE_LABELS,
+            positive_threshold: float = POSITIVE_THRESHOLD,
+            negative_threshold: float = NEGATIVE_THRESHOLD,
+            shuffle_companies: bool = False,
+            test_size: float = 0.2,
+            val_size: float = 0.1,
+            shuffle_buffer_size: int = 10000,
+            random_state: int = 42,
+            annotated_data_dir: str = "data/annotated"):
+        self._tokenizer = tokenizer
+        self._possible_labels = possible_labels
+        self._read_records = partial(
+            _read_annotated_records, positive_threshold=positive_threshold, negative_threshold=negative_threshold)
+        self._shuffle_companies = shuffle_companies
+        self._test_size = test_size
+        self._val_size = val_size
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._random_state = random_state
+        self._annotated_data_dir = annotated_data_dir
+
+    def get(self) -> Tuple[StreamingSentimentDataset, SentimentAnalysisDataset, SentimentAnalysisDataset]:
+        """
+        :return: streamed train dataset, validation and test datasets loaded into memory.
+        """
+        file_paths = [f"{self._annotated_data_dir}/{filename}" for filename in os.listdir(self._annotated_data_dir)]
+        if self._shuffle_companies:
+            val_end = self._val_size
+            test_end = self._val_size + self._test_size
+            train = self._dataset(file_paths, HashRange(test_end, 1.))
+            val = self._dataset(file_paths, HashRange(0., val_end))
+            test = self._dataset(file_paths, HashRange(val_end, test_end))
+        else:
+            train_files, val_files, test_files = file_split(
+                file_paths, test_size=self._test_size, val_size=self._val_size, random_state=self._random_state)
+            train, val, test = self._dataset(train_files), self._dataset(val_files), self._dataset(test_files)
+        return train, val.materialize(), test.materialize()
+
+    @property
+    def data_collator(self) -> PaddingCollator:
+        return PaddingCollator(get_pad_values(self._tokenizer))
+
+    def _dataset(self, sources: List[str], keep: Optional[HashRange] = None) -> StreamingSentimentDataset:
+        return StreamingSentimentDataset(
+            tokenizer=self._tokenizer,
+            sources=sources,
+            read_records=self._read_records,
+            possible_labels=self._possible_labels,
+            keep=keep,
+            shuffle_buffer_size=self._shuffle_buffer_size,
+            seed=self._random_state)
+
+
+def _read_annotated_records(
+        file_path: str,
+        positive_threshold: float,
+        negative_threshold: float) -> Iterator[Record]:
+    rows = list(iter_annotated_file(file_path))
+    sentiments = np.array([sentiment for _, _, sentiment in rows], dtype=np.float64)
+    label_codes = label_sentiments(sentiments, positive_threshold, negative_threshold)
+    for (_, content, _), label_code in zip(rows, label_codes):
+        yield content, SENTIMENT_LABELS[label_code]
@@ -0,0 +1,177 @@
+import time
+from typing import Any, Dict, Optional, Union
+
+import torch
+from torch.utils.data import Sampler, DataLoader
+from transformers import Trainer
+
+from src.models.adapters import is_adapter_model, save_adapter_model
+from src.models.batching import LengthBucketSampler, TokenBudgetBatchSampler, padding_efficiency
+from src.models.datasets import SentimentAnalysisDataset
+from src.models.encodings import available_cpus
+
+TRAINING_PROFILES = ("default", "cpu")
+
+
+def training_profile_arguments(
+        profile: str,
+        gradient_accumulation_steps: Optional[int] = None,
+        gradient_checkpointing: bool = False,
+        dataloader_workers: Optional[int] = None,
+        threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Returns TrainingArguments of a training profile. The "cpu" profile trains on CPU even if a GPU is present:
+    - bf16 autocast is used if the CPU supports bf16 instructions,
+    - intra-op threads use the cores not taken by DataLoader workers and inter-op parallelism is disabled,
+    since layers of BERT run one after another,
+    - gradients are accumulated over 4 batches by default, giving large effective batches at a small memory cost,
+    - one persistent DataLoader worker prepares batches if there are more than 2 cores, and memory is not pinned,
+    as there is no device to copy the batches to.
+    Thread counts are set in this process, so the function should be called before the model is run.
+    :param profile: one of TRAINING_PROFILES.
+    :param gradient_accumulation_steps: number of batches per optimizer step. Defaults to the value of the profile.
+    :param gradient_checkpointing: if True, activations are recomputed in the backward pass instead of being stored,
+    which bounds memory at the cost of about one more forward pass.
+    :param dataloader_workers: number of DataLoader worker processes. Defaults to the value of the profile.
+    :param threads: number of intra-op threads of the "cpu" profile. Defaults to the free cores.
+    :return: keyword arguments of TrainingArguments.
+    """
+    if profile not in TRAINING_PROFILES:
+        raise ValueError(f'Unknown training profile {profile}, expected one of {TRAINING_PROFILES}')
+    arguments = {'gradient_checkpointing': gradient_checkpointing}
+    if profile == "default":
+        arguments.update(
+            gradient_accumulation_steps=gradient_accumulation_steps or 1,
+            dataloader_num_workers=dataloader_workers or 0)
+        return arguments
+
+    if dataloader_workers is None:
+        dataloader_workers = 1 if available_cpus() > 2 else 0
+    threads = threads or max(available_cpus() - dataloader_workers, 1)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # The number of inter-op threads cannot be changed after any inter-op parallel work has started.
+        pass
+    bf16 = cpu_supports_bf16()
+    print(f'CPU profile: {threads} threads, {dataloader_workers} DataLoader workers, bf16: {bf16}')
+    arguments.update(
+        use_cpu=True,
+        bf16=bf16,
+        gradient_accumulation_steps=gradient_accumulation_steps or 4,
+        dataloader_num_workers=dataloader_workers,
+        dataloader_pin_memory=False,
+        dataloader_persistent_workers=dataloader_workers > 0)
+    return arguments
+
+
+def cpu_supports_bf16() -> bool:
+    """
+    :return: True if oneDNN can run bf16 kernels on this CPU (e.g. with AVX512-BF16 or AMX), otherwise
+    bf16 would be emulated and slower than fp32.
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class ThroughputTrainer(Trainer):
+    """
+    Trainer reporting the training throughput in (non-padding) tokens per second with every log
+    and after the training, so that training configurations can be compared. Models prepared by
+    prepare_peft_model are saved (also in checkpoints) as adapters holding only the trainable parameters.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tokens = 0
+        self._logged_tokens = 0
+        self._logged_at = None
+
+    def train(self, *args, **kwargs):
+        self._tokens = self._logged_tokens = 0
+        start = self._logged_at = time.perf_counter()
+        output = super().train(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        print(f'Trained on {self._tokens} tokens in {seconds:.1f}s, {self._tokens / seconds:.1f} tokens/s')
+        return output
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        mask = inputs.get('attention_mask')
+        self._tokens += int(mask.sum()) if mask is not None else inputs['input_ids'].numel()
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs: Dict[str, float], *args, **kwargs) -> None:
+        if 'loss' in logs and self._logged_at is not None:
+            now = time.perf_counter()
+            logs['tokens_per_second'] = round((self._tokens - self._logged_tokens) / (now - self._logged_at), 1)
+            self._logged_tokens, self._logged_at = self._tokens, now
+        super().log(logs, *args, **kwargs)
+
+    def _save(self, output_dir: Optional[str] = None, state_dict: Optional[dict] = None) -> None:
+        if not is_adapter_model(self.model):
+            return super()._save(output_dir, state_dict)
+        save_adapter_model(self.model, output_dir or self.args.output_dir, self.processing_class)
+
+
+class BucketedTrainer(ThroughputTrainer):
+    """
+    Trainer that groups training texts of similar length into batches, so that
+    the per-batch padding of PaddingCollator wastes as little computation as possible.
+    If max_tokens is set, batches are packed up to a token budget instead of a fixed number of texts.
+    """
+
+    def __init__(self, *args, bucket_size_multiplier: int = 50, max_tokens: Optional[int] = None, **kwargs):
+        """
+        :param bucket_size_multiplier: number of batches in a bucket of LengthBucketSampler.
+        :param max_tokens: maximal number of tokens of a padded batch. If set, overrides the batch sizes.
+        """
+        super().__init__(*args, **kwargs)
+        self._bucket_size_multiplier = bucket_size_multiplier
+        self._max_tokens = max_tokens
+
+    def _get_train_sampler(self, *args, **kwargs) -> Optional[Sampler]:
+        lengths = getattr(self.train_dataset, 'lengths', None)
+        if lengths is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return LengthBucketSampler(
+            lengths,
+            batch_size=self._train_batch_size,
+            bucket_size_multiplier=self._bucket_size_multiplier,
+            seed=self.args.seed)
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self._max_tokens is None or not isinstance(self.train_dataset, SentimentAnalysisDataset):
+            return super().get_train_dataloader()
+        return self._token_budget_dataloader(self.train_dataset, shuffle=True, description='Training')
+
+    def get_eval_dataloader(self, eval_dataset: Optional[Union[str, SentimentAnalysisDataset]] = None) -> DataLoader:
+        dataset = self.eval_dataset if eval_dataset is None else eval_dataset
+        if isinstance(dataset, str):
+            dataset = self.eval_dataset[dataset]
+        if self._max_tokens is None or not isinstance(dataset, SentimentAnalysisDataset):
+            return super().get_eval_dataloader(eval_dataset)
+        # Metrics do not depend on the order of the texts, so they are evaluated from the longest to the shortest.
+        return self._token_budget_dataloader(dataset, shuffle=False, description='Evaluation')
+
+    def _token_budget_dataloader(
+            self,
+            dataset: SentimentAnalysisDataset,
+            shuffle: bool,
+            description: str) -> DataLoader:
+        batch_sampler = TokenBudgetBatchSampler(
+            dataset.lengths,
+            max_tokens=self._max_tokens,
+            shuffle=shuffle,
+            seed=self.args.seed)
+        print(f'{description}: {len(batch_sampler)} batches of up to {self._max_tokens} tokens, padding efficiency: '
+              f'{padding_efficiency(dataset.lengths, batch_sampler.batches):.1%}')
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory)
+        return self.accelerator.prepare(dataloader)
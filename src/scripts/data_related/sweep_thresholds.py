@@ -0,0 +1,72 @@
+import click
+import numpy as np
+from click import FLOAT, INT, STRING
+
+from src.common.data_preparation import load_financial_corpus, sweep_thresholds, quantile_thresholds, \
+    label_sentiments, SENTIMENT_LABELS, POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
+
+
+def _format_counts(counts: np.ndarray) -> str:
+    total = max(int(counts.sum()), 1)
+    return ', '.join(f'{label}: {count} ({count / total:.1%})' for label, count in zip(SENTIMENT_LABELS, counts))
+
+
+@click.command()
+@click.option(
+    "--annotated_data_dir",
+    type=STRING,
+    default="data/annotated",
+    help="Directory with the annotated data."
+)
+@click.option(
+    "--min_threshold",
+    type=FLOAT,
+    default=-0.2,
+    help="Lowest threshold value in the grid."
+)
+@click.option(
+    "--max_threshold",
+    type=FLOAT,
+    default=0.2,
+    help="Highest threshold value in the grid."
+)
+@click.option(
+    "--steps",
+    type=INT,
+    default=45,
+    help="Number of negative and positive threshold candidates. The grid contains up to steps^2 pairs."
+)
+@click.option(
+    "--top",
+    type=INT,
+    default=10,
+    help="Number of the most balanced threshold pairs to print."
+)
+def main(
+        annotated_data_dir: STRING,
+        min_threshold: FLOAT,
+        max_threshold: FLOAT,
+        steps: INT,
+        top: INT
+):
+    sentiments = load_financial_corpus(annotated_data_dir).sentiments
+
+    current_codes = label_sentiments(sentiments, POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD)
+    print(f"Current thresholds ({NEGATIVE_THRESHOLD}, {POSITIVE_THRESHOLD}): "
+          f"{_format_counts(np.bincount(current_codes, minlength=len(SENTIMENT_LABELS)))}")
+
+    negative_threshold, positive_threshold = quantile_thresholds(sentiments)
+    quantile_codes = label_sentiments(sentiments, positive_threshold, negative_threshold)
+    print(f"Quantile thresholds ({negative_threshold:.4f}, {positive_threshold:.4f}): "
+          f"{_format_counts(np.bincount(quantile_codes, minlength=len(SENTIMENT_LABELS)))}")
+
+    candidates = np.linspace(min_threshold, max_threshold, steps)
+    sweep = sweep_thresholds(sentiments, candidates, candidates)
+    print(f"The most balanced of {len(sweep.counts)} threshold pairs:")
+    for i in sweep.most_balanced(top):
+        print(f"({sweep.negative_thresholds[i]:.4f}, {sweep.positive_thresholds[i]:.4f}) "
+              f"balance: {sweep.balance[i]:.4f}, {_format_counts(sweep.counts[i])}")
+
+
+if __name__ == '__main__':
+    main()
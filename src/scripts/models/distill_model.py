@@ -0,0 +1,219 @@
+import click
+from click import STRING, INT, FLOAT
+
+from src.common.consts import SCRAPED_DISPATCHES_DIR
+from src.common.data_preparation import KlejType
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_dir",
+    type=STRING,
+    required=True,
+    help="Directory where the teacher model and tokenizer is stored."
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    type=STRING,
+    required=True,
+    help="Directory where the student model, tokenizer and the distillation report will be stored."
+)
+@click.option(
+    "--student_layers",
+    type=INT,
+    default=4,
+    help="Number of encoder layers of the student. Default to 4."
+)
+@click.option(
+    "--student_hidden_size",
+    type=INT,
+    default=None,
+    help="Hidden size of the student. By default the hidden size of the teacher, in which case the student "
+         "starts from the embeddings and evenly spaced layers of the teacher."
+)
+@click.option(
+    "--temperature",
+    type=FLOAT,
+    default=2.,
+    help="Temperature of the soft labels. Default to 2."
+)
+@click.option(
+    "--alpha",
+    type=FLOAT,
+    default=0.5,
+    help="Weight of the KL divergence from the teacher; the cross-entropy with true labels has weight 1 - alpha. "
+         "Default to 0.5."
+)
+@click.option(
+    "--unlabelled/--no_unlabelled",
+    default=True,
+    help="Train also on soft labels of the scraped dispatches. Enabled by default."
+)
+@click.option(
+    "-d",
+    "--dispatches_dir",
+    type=STRING,
+    default=SCRAPED_DISPATCHES_DIR,
+    help=f"Directory with JSON files of scraped dispatches. Default to {SCRAPED_DISPATCHES_DIR}."
+)
+@click.option(
+    "--max_unlabelled",
+    type=INT,
+    default=None,
+    help="If set, at most this number of scraped dispatches is used."
+)
+@click.option(
+    "--test_dataset",
+    type=click.Choice(["klej_in", "klej_out", "financial_mixed", "financial"]),
+    default="financial",
+    help="Dataset on which the teacher and the student are compared. Default to financial."
+)
+@click.option(
+    "--epochs",
+    type=INT,
+    default=3,
+    help="Choose the number of epochs."
+)
+@click.option(
+    "--batch_size",
+    type=INT,
+    default=8,
+    help="Choose the batch size."
+)
+@click.option(
+    "--teacher_batch_size",
+    type=INT,
+    default=32,
+    help="Number of texts in a batch of the teacher computing soft labels and of the comparison. Default to 32."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, texts of similar length are packed into batches of up to this number of padded tokens "
+         "instead of --batch_size and --teacher_batch_size texts."
+)
+@click.option(
+    "--encoding_cache/--no_encoding_cache",
+    default=True,
+    help="Reuse tokenized texts stored in data/cache/encodings. Enabled by default."
+)
+@click.option(
+    "--logits_cache/--no_logits_cache",
+    default=True,
+    help="Reuse logits of the teacher stored in data/cache/logits, computing only new texts. Enabled by default."
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["default", "cpu"]),
+    default="default",
+    help="Training setup, as in train_model. Default to default."
+)
+def main(
+        input_dir: STRING,
+        output_dir: STRING,
+        student_layers: INT,
+        student_hidden_size: INT,
+        temperature: FLOAT,
+        alpha: FLOAT,
+        unlabelled: bool,
+        dispatches_dir: STRING,
+        max_unlabelled: INT,
+        test_dataset: click.Choice,
+        epochs: INT,
+        batch_size: INT,
+        teacher_batch_size: INT,
+        max_tokens: INT,
+        encoding_cache: bool,
+        logits_cache: bool,
+        profile: click.Choice
+):
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from transformers import TrainingArguments
+    from src.common.data_preparation import read_klej_texts_labels
+    from src.common.utils.files_io import write_json
+    from src.models import read_from_dir
+    from src.models.batching import PaddingCollator
+    from src.models.datasets import DEFAULT_POSSIBLE_LABELS, get_klej_test_set, get_financial_test_set
+    from src.models.distillation import IGNORED_LABEL, DistillationTrainer, build_distillation_dataset, \
+        compare_student, create_student
+    from src.models.encoding_cache import EncodingCache
+    from src.models.encodings import get_pad_values
+    from src.models.logits_cache import LogitsCache
+    from src.models.scoring import iter_dispatches
+    from src.models.training import training_profile_arguments
+
+    profile_arguments = training_profile_arguments(profile)
+    tokenizer, teacher = read_from_dir(input_dir)
+    cache = EncodingCache(tokenizer) if encoding_cache else None
+
+    texts, labels = read_klej_texts_labels(KlejType.IN, "train", DEFAULT_POSSIBLE_LABELS)
+    label_mapper = {label: i for i, label in enumerate(DEFAULT_POSSIBLE_LABELS)}
+    labels = [label_mapper[label] for label in labels]
+    if unlabelled:
+        dispatches = list(dict.fromkeys(dispatch.content for _, dispatch in iter_dispatches(dispatches_dir)))
+        dispatches = dispatches[:max_unlabelled] if max_unlabelled is not None else dispatches
+        texts += dispatches
+        labels += [IGNORED_LABEL] * len(dispatches)
+        print(f'{len(labels) - len(dispatches)} labelled KLEJ texts and {len(dispatches)} unlabelled dispatches')
+    dataset = build_distillation_dataset(
+        tokenizer,
+        teacher,
+        texts,
+        labels,
+        encoding_cache=cache,
+        logits_cache=LogitsCache(tokenizer, teacher) if logits_cache else None,
+        batch_size=teacher_batch_size,
+        max_tokens=max_tokens
+    )
+
+    student = create_student(teacher, num_layers=student_layers, hidden_size=student_hidden_size)
+    training_args = TrainingArguments(
+        output_dir='./results',
+        num_train_epochs=epochs,
+        per_device_train_batch_size=batch_size,
+        warmup_steps=500,
+        weight_decay=0.01,
+        logging_steps=10,
+        **profile_arguments
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=dataset,
+        data_collator=PaddingCollator(get_pad_values(tokenizer)),
+        max_tokens=max_tokens,
+        temperature=temperature,
+        alpha=alpha
+    )
+    trainer.train()
+    trainer.save_model(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    if "klej" in test_dataset:
+        test_set = get_klej_test_set(klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT)
+    else:
+        test_set = get_financial_test_set(shuffle_companies="mixed" in test_dataset)
+    report = compare_student(
+        tokenizer,
+        teacher,
+        student,
+        test_set,
+        batch_size=teacher_batch_size,
+        max_tokens=max_tokens,
+        encoding_cache=cache
+    )
+    print(f"Parameters: teacher {report['teacher_parameters']}, student {report['student_parameters']}")
+    print(f"Macro F1: teacher {report['teacher_f1']:.4f}, student {report['student_f1']:.4f}, "
+          f"delta {report['f1_delta']:+.4f}")
+    print(f"Accuracy: teacher {report['teacher_accuracy']:.4f}, student {report['student_accuracy']:.4f}, "
+          f"prediction agreement {report['prediction_agreement']:.4f}")
+    print(f"Inference time: teacher {report['teacher_seconds']:.2f}s, student {report['student_seconds']:.2f}s, "
+          f"speedup: {report['speedup']:.2f}x")
+    write_json(f"{output_dir}/distillation_report.json", {'test_dataset': test_dataset, **report})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
+from typing import List, Tuple
+
 import click
 from click import STRING, INT
 
+from src.common.consts import AGGREGATIONS, DEFAULT_CHUNK_SIZE
 from src.common.data_preparation import KlejType
-from src.models import read_from_dir
-from src.models.datasets import get_klej_test_set, get_financial_test_set
-from src.models.eval import evaluate
+from src.common.utils.files_io import write_json
 
 
 @click.command()
@@ -19,7 +20,27 @@ from src.models.eval import evaluate
     "--test_dataset",
     type=click.Choice(["klej_in", "klej_out", "financial_mixed", "financial"]),
     required=True,
-    help="Choose the dataset for the evaluation."
+    multiple=True,
+    help="Choose the dataset for the evaluation. Can be given many times, texts shared by the datasets "
+         "are classified once."
+)
+@click.option(
+    "--report_path",
+    type=STRING,
+    default=None,
+    help="If set, metrics and confusion matrices of all datasets are written to this JSON file."
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["pytorch", "onnx"]),
+    default="pytorch",
+    help="Run the PyTorch model or the model exported by export_onnx with ONNX Runtime. Default to pytorch."
+)
+@click.option(
+    "--quantized",
+    is_flag=True,
+    default=False,
+    help="Run the PyTorch model with dynamically quantized INT8 Linear layers."
 )
 @click.option(
     "--eval_batch",
@@ -27,28 +48,145 @@ from src.models.eval import evaluate
     default=10,
     help="Choose your evaluation batch size. Default to 10."
 )
+@click.option(
+    "--encoding_cache/--no_encoding_cache",
+    default=True,
+    help="Reuse tokenized texts stored in data/cache/encodings. Enabled by default."
+)
+@click.option(
+    "--logits_cache/--no_logits_cache",
+    default=True,
+    help="Reuse logits of the same model stored in data/cache/logits, computing only new texts. Enabled by default."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, texts of similar length are packed into batches of up to this number of padded tokens "
+         "instead of --eval_batch texts."
+)
+@click.option(
+    "--long_documents",
+    is_flag=True,
+    default=False,
+    help="Classify whole texts split into overlapping windows instead of truncating them."
+)
+@click.option(
+    "--stride",
+    type=INT,
+    default=128,
+    help="Number of tokens shared by consecutive windows with --long_documents. Default to 128."
+)
+@click.option(
+    "--aggregation",
+    type=click.Choice(AGGREGATIONS),
+    default="mean",
+    help="How logits of the windows are combined with --long_documents. Default to mean."
+)
+@click.option(
+    "--workers",
+    type=INT,
+    default=1,
+    help="Number of processes running the model on CPU (0 - one per CPU core). Default to 1."
+)
+@click.option(
+    "--threads_per_worker",
+    type=INT,
+    default=None,
+    help="Number of threads of every process. By default the cores are divided evenly between the processes."
+)
+@click.option(
+    "--chunk_size",
+    type=INT,
+    default=DEFAULT_CHUNK_SIZE,
+    help="Number of texts classified at once. Metrics are accumulated chunk by chunk, so memory does not grow "
+         f"with the size of the datasets. Default to {DEFAULT_CHUNK_SIZE}."
+)
+@click.option(
+    "--bootstrap",
+    type=INT,
+    default=0,
+    help="If positive, 95% confidence intervals of the metrics are estimated from this number of bootstrap "
+         "samples of the test set, e.g. 10000. Disabled by default."
+)
 def main(
         input_dir: STRING,
-        test_dataset: click.Choice,
-        eval_batch: INT
+        test_dataset: Tuple[str, ...],
+        report_path: STRING,
+        backend: click.Choice,
+        quantized: bool,
+        eval_batch: INT,
+        encoding_cache: bool,
+        logits_cache: bool,
+        max_tokens: INT,
+        long_documents: bool,
+        stride: INT,
+        aggregation: click.Choice,
+        workers: INT,
+        threads_per_worker: INT,
+        chunk_size: INT,
+        bootstrap: INT
 ):
-    tokenizer, model = read_from_dir(input_dir)
-    if "klej" in test_dataset:
-        test_dataset = get_klej_test_set(
-            klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT
-        )
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from src.models import read_from_dir
+    from src.models.encoding_cache import EncodingCache
+    from src.models.eval import evaluate_many
+    from src.models.logits_cache import LogitsCache
+    from src.models.onnx_inference import read_onnx_from_dir
+
+    if backend == "onnx":
+        tokenizer, model = read_onnx_from_dir(input_dir)
     else:
-        test_dataset = get_financial_test_set(
-            shuffle_companies="mixed" in test_dataset,
-        )
-    evaluation_result = evaluate(
-        test_dataset=test_dataset,
+        tokenizer, model = read_from_dir(input_dir, quantized=quantized)
+    test_datasets = {name: _get_test_set(name) for name in dict.fromkeys(test_dataset)}
+    evaluation_results = evaluate_many(
         tokenizer=tokenizer,
         model=model,
-        batch_size=eval_batch
+        test_datasets=test_datasets,
+        batch_size=eval_batch,
+        encoding_cache=EncodingCache(tokenizer, truncation=not long_documents) if encoding_cache else None,
+        max_tokens=max_tokens,
+        long_documents=long_documents,
+        stride=stride,
+        aggregation=aggregation,
+        workers=workers,
+        threads_per_worker=threads_per_worker,
+        logits_cache=LogitsCache(tokenizer, model) if logits_cache else None,
+        chunk_size=chunk_size,
+        bootstrap_samples=bootstrap
+    )
+
+    report = {}
+    for name, evaluation_result in evaluation_results.items():
+        print(f"Dataset: {name}")
+        if not evaluation_result:
+            print("No texts")
+            continue
+        print(f"Confusion matrix: \n {evaluation_result['confusion_matrix']}")
+        print(f"Classification report \n {evaluation_result['classification_report']}")
+        report[name] = {
+            'texts': len(test_datasets[name][0]),
+            'metrics': {metric: float(value) for metric, value in evaluation_result['metrics'].items()},
+            'confusion_matrix': evaluation_result['confusion_matrix'].tolist()
+        }
+        if 'confidence_intervals' in evaluation_result:
+            report[name]['confidence_intervals'] = {
+                metric: bounds.tolist() for metric, bounds in evaluation_result['confidence_intervals'].items()
+            }
+    if report_path is not None:
+        write_json(report_path, {'model_dir': input_dir, 'datasets': report})
+
+
+def _get_test_set(test_dataset: str) -> Tuple[List[str], List[int]]:
+    from src.models.datasets import get_klej_test_set, get_financial_test_set
+
+    if "klej" in test_dataset:
+        return get_klej_test_set(
+            klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT
+        )
+    return get_financial_test_set(
+        shuffle_companies="mixed" in test_dataset,
     )
-    print(f"Confusion matrix: \n {evaluation_result['confusion_matrix']}")
-    print(f"Classification report \n {evaluation_result['classification_report']}")
 
 
 if __name__ == '__main__':
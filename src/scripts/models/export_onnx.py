@@ -0,0 +1,87 @@
+import click
+from click import STRING, INT, FLOAT
+
+from src.common.data_preparation import KlejType
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_dir",
+    type=STRING,
+    required=True,
+    help="Directory where a model and tokenizer is stored."
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    type=STRING,
+    default=None,
+    help="Directory where the ONNX model, tokenizer and configuration will be stored. Default to --input_dir."
+)
+@click.option(
+    "--opset",
+    type=INT,
+    default=18,
+    help="ONNX opset version. Default to 18."
+)
+@click.option(
+    "--test_dataset",
+    type=click.Choice(["klej_in", "klej_out", "financial_mixed", "financial"]),
+    default="financial",
+    help="Dataset whose texts are used to compare the ONNX and PyTorch models."
+)
+@click.option(
+    "--samples",
+    type=INT,
+    default=500,
+    help="Number of texts used for the comparison. Default to 500."
+)
+@click.option(
+    "--batch_size",
+    type=INT,
+    default=32,
+    help="Batch size used for the comparison. Default to 32."
+)
+@click.option(
+    "--tolerance",
+    type=FLOAT,
+    default=1e-3,
+    help="Maximal accepted absolute difference of logits of the ONNX and PyTorch models. Default to 1e-3."
+)
+def main(
+        input_dir: STRING,
+        output_dir: STRING,
+        opset: INT,
+        test_dataset: click.Choice,
+        samples: INT,
+        batch_size: INT,
+        tolerance: FLOAT
+):
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from src.models import read_from_dir
+    from src.models.datasets import get_klej_test_set, get_financial_test_set
+    from src.models.onnx_inference import export_onnx, read_onnx_from_dir, compare_backends
+
+    onnx_path = export_onnx(input_dir, output_dir, opset=opset)
+    print(f"Exported the model to {onnx_path}")
+
+    if "klej" in test_dataset:
+        texts, _ = get_klej_test_set(klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT)
+    else:
+        texts, _ = get_financial_test_set(shuffle_companies="mixed" in test_dataset)
+    tokenizer, model = read_from_dir(input_dir)
+    _, onnx_model = read_onnx_from_dir(output_dir or input_dir)
+    report = compare_backends(tokenizer, model, onnx_model, texts[:samples], batch_size=batch_size)
+
+    print(f"Max absolute difference of logits: {report['max_abs_diff']:.2e}")
+    print(f"Equal predictions: {report['prediction_agreement']:.2%}")
+    print(f"PyTorch: {report['pytorch_texts_per_second']:.1f} texts/s, "
+          f"ONNX Runtime: {report['onnx_texts_per_second']:.1f} texts/s, speedup: {report['speedup']:.2f}x")
+    if report['max_abs_diff'] > tolerance:
+        raise click.ClickException(
+            f"Logits of the ONNX model differ from the PyTorch model by more than {tolerance}")
+
+
+if __name__ == '__main__':
+    main()
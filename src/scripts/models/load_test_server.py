@@ -0,0 +1,99 @@
+import asyncio
+import time
+from typing import List
+
+import click
+import numpy as np
+from click import STRING, INT
+
+from src.common.data_preparation import KlejType
+from src.common.utils.http import read_http_message, write_http_message
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, start_line: str, payload=None):
+    write_http_message(writer, start_line, payload)
+    await writer.drain()
+    start_line, _, body = await read_http_message(reader)
+    if not start_line.split(' ')[1] == '200':
+        raise click.ClickException(f"Request failed: {start_line} {body.decode('utf-8')}")
+    return body
+
+
+async def _client(host: str, port: int, texts: List[str], latencies: List[float]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for text in texts:
+            start = time.perf_counter()
+            await _request(reader, writer, 'POST /classify HTTP/1.1', {'text': text})
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        writer.close()
+
+
+async def _run_load(host: str, port: int, texts: List[str], concurrency: int) -> None:
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, texts[i::concurrency], latencies) for i in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    print(f"{len(latencies)} requests from {concurrency} clients in {seconds:.1f}s, "
+          f"{len(latencies) / seconds:.1f} requests/s")
+    print("Client latency: " + ", ".join(
+        f"p{percentile} {np.percentile(latencies, percentile):.1f} ms" for percentile in LATENCY_PERCENTILES))
+    reader, writer = await asyncio.open_connection(host, port)
+    print(f"Server stats: {(await _request(reader, writer, 'GET /stats HTTP/1.1')).decode('utf-8')}")
+    writer.close()
+
+
+@click.command()
+@click.option(
+    "--host",
+    type=STRING,
+    default="127.0.0.1",
+    help="Address of the server started with serve_model. Default to 127.0.0.1."
+)
+@click.option(
+    "--port",
+    type=INT,
+    default=8000,
+    help="Port of the server. Default to 8000."
+)
+@click.option(
+    "--test_dataset",
+    type=click.Choice(["klej_in", "klej_out", "financial_mixed", "financial"]),
+    default="financial",
+    help="Dataset whose texts are sent to the server. Default to financial."
+)
+@click.option(
+    "--requests",
+    type=INT,
+    default=1000,
+    help="Number of requests, texts of the dataset are repeated if needed. Default to 1000."
+)
+@click.option(
+    "--concurrency",
+    type=INT,
+    default=32,
+    help="Number of clients sending requests one after another at the same time. Default to 32."
+)
+def main(
+        host: STRING,
+        port: INT,
+        test_dataset: click.Choice,
+        requests: INT,
+        concurrency: INT
+):
+    from src.models.datasets import get_klej_test_set, get_financial_test_set
+
+    if "klej" in test_dataset:
+        texts, _ = get_klej_test_set(klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT)
+    else:
+        texts, _ = get_financial_test_set(shuffle_companies="mixed" in test_dataset)
+    texts = [texts[i % len(texts)] for i in range(requests)]
+    asyncio.run(_run_load(host, port, texts, concurrency))
+
+
+if __name__ == '__main__':
+    main()
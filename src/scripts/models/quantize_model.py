@@ -0,0 +1,95 @@
+import click
+from click import STRING, INT, FLOAT
+
+from src.common.data_preparation import KlejType
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_dir",
+    type=STRING,
+    required=True,
+    help="Directory where a model and tokenizer is stored."
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    type=STRING,
+    default=None,
+    help="Directory where the quantized model will be stored if its F1 drop is acceptable. "
+         "If not set, the model is only evaluated."
+)
+@click.option(
+    "--test_dataset",
+    type=click.Choice(["klej_in", "klej_out", "financial_mixed", "financial"]),
+    required=True,
+    help="Choose the dataset used to compare the quantized and full-precision models."
+)
+@click.option(
+    "--eval_batch",
+    type=INT,
+    default=32,
+    help="Choose your evaluation batch size. Default to 32."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, texts of similar length are packed into batches of up to this number of padded tokens "
+         "instead of --eval_batch texts."
+)
+@click.option(
+    "--max_f1_drop",
+    type=FLOAT,
+    default=0.01,
+    help="Maximal accepted drop of macro F1 of the quantized model. Default to 0.01."
+)
+def main(
+        input_dir: STRING,
+        output_dir: STRING,
+        test_dataset: click.Choice,
+        eval_batch: INT,
+        max_tokens: INT,
+        max_f1_drop: FLOAT
+):
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from src.models import read_from_dir
+    from src.models.datasets import get_klej_test_set, get_financial_test_set
+    from src.models.encoding_cache import EncodingCache
+    from src.models.quantization import quantize_model, compare_quantized, save_quantized_model
+
+    tokenizer, model = read_from_dir(input_dir)
+    quantized_model = quantize_model(model)
+    if "klej" in test_dataset:
+        test_dataset = get_klej_test_set(
+            klej_type=KlejType.IN if test_dataset == "klej_in" else KlejType.OUT
+        )
+    else:
+        test_dataset = get_financial_test_set(
+            shuffle_companies="mixed" in test_dataset,
+        )
+    report = compare_quantized(
+        tokenizer,
+        model,
+        quantized_model,
+        test_dataset,
+        batch_size=eval_batch,
+        max_tokens=max_tokens,
+        encoding_cache=EncodingCache(tokenizer)
+    )
+    print(f"Macro F1: fp32 {report['fp32_f1']:.4f}, int8 {report['int8_f1']:.4f}, delta {report['f1_delta']:+.4f}")
+    print(f"Accuracy: fp32 {report['fp32_accuracy']:.4f}, int8 {report['int8_accuracy']:.4f}")
+    print(f"Inference time: fp32 {report['fp32_seconds']:.2f}s, int8 {report['int8_seconds']:.2f}s, "
+          f"speedup: {report['speedup']:.2f}x")
+
+    if -report['f1_delta'] > max_f1_drop:
+        raise click.ClickException(
+            f"Macro F1 of the quantized model dropped by more than {max_f1_drop}, the model was not saved")
+    if output_dir is not None:
+        save_quantized_model(quantized_model, tokenizer, output_dir)
+        print(f"Quantized model saved to {output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import click
+from click import STRING, INT
+
+from src.common.consts import SCRAPED_DISPATCHES_DIR
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_dir",
+    type=STRING,
+    required=True,
+    help="Directory where a model and tokenizer is stored."
+)
+@click.option(
+    "-o",
+    "--output_path",
+    type=STRING,
+    required=True,
+    help="JSONL file with predicted probabilities, one line per dispatch. If it exists, dispatches already "
+         "scored in it are skipped and new ones are appended."
+)
+@click.option(
+    "-d",
+    "--dispatches_dir",
+    type=STRING,
+    default=SCRAPED_DISPATCHES_DIR,
+    help=f"Directory with JSON files of scraped dispatches. Default to {SCRAPED_DISPATCHES_DIR}."
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["pytorch", "onnx"]),
+    default="pytorch",
+    help="Run the PyTorch model or the model exported by export_onnx with ONNX Runtime. Default to pytorch."
+)
+@click.option(
+    "--quantized",
+    is_flag=True,
+    default=False,
+    help="Run the PyTorch model with dynamically quantized INT8 Linear layers."
+)
+@click.option(
+    "--batch_size",
+    type=INT,
+    default=32,
+    help="Number of dispatches in a batch. Default to 32."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, dispatches of similar length are packed into batches of up to this number of padded tokens "
+         "instead of --batch_size dispatches."
+)
+@click.option(
+    "--chunk_size",
+    type=INT,
+    default=1000,
+    help="Number of dispatches sorted by length and classified at once. Results are saved after every chunk. "
+         "Default to 1000."
+)
+@click.option(
+    "--workers",
+    type=INT,
+    default=1,
+    help="Number of processes running the model on CPU (0 - one per CPU core). Default to 1."
+)
+@click.option(
+    "--threads_per_worker",
+    type=INT,
+    default=None,
+    help="Number of threads of every process. By default the cores are divided evenly between the processes."
+)
+def main(
+        input_dir: STRING,
+        output_path: STRING,
+        dispatches_dir: STRING,
+        backend: click.Choice,
+        quantized: bool,
+        batch_size: INT,
+        max_tokens: INT,
+        chunk_size: INT,
+        workers: INT,
+        threads_per_worker: INT
+):
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from src.models import read_from_dir
+    from src.models.onnx_inference import read_onnx_from_dir
+    from src.models.scoring import score_dispatches
+
+    if backend == "onnx":
+        tokenizer, model = read_onnx_from_dir(input_dir)
+    else:
+        tokenizer, model = read_from_dir(input_dir, quantized=quantized)
+    score_dispatches(
+        tokenizer=tokenizer,
+        model=model,
+        output_path=output_path,
+        dispatches_dir=dispatches_dir,
+        chunk_size=chunk_size,
+        batch_size=batch_size,
+        max_tokens=max_tokens,
+        workers=workers,
+        threads_per_worker=threads_per_worker
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+
+import click
+from click import STRING, INT, FLOAT
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--input_dir",
+    type=STRING,
+    required=True,
+    help="Directory where a model and tokenizer is stored."
+)
+@click.option(
+    "--host",
+    type=STRING,
+    default="127.0.0.1",
+    help="Address the server listens on. Default to 127.0.0.1."
+)
+@click.option(
+    "--port",
+    type=INT,
+    default=8000,
+    help="Port the server listens on. Default to 8000."
+)
+@click.option(
+    "--max_batch_size",
+    type=INT,
+    default=32,
+    help="Maximal number of requests classified in one batch. Default to 32."
+)
+@click.option(
+    "--max_wait_ms",
+    type=FLOAT,
+    default=5.,
+    help="Maximal time in milliseconds a request waits for other requests to form a batch. Default to 5."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, texts of a batch are sorted by length and run in parts of up to this number of padded tokens, "
+         "which limits padding of batches of texts with different lengths."
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["pytorch", "onnx"]),
+    default="pytorch",
+    help="Run the PyTorch model or the model exported by export_onnx with ONNX Runtime. Default to pytorch."
+)
+@click.option(
+    "--quantized",
+    is_flag=True,
+    default=False,
+    help="Run the PyTorch model with dynamically quantized INT8 Linear layers."
+)
+def main(
+        input_dir: STRING,
+        host: STRING,
+        port: INT,
+        max_batch_size: INT,
+        max_wait_ms: FLOAT,
+        max_tokens: INT,
+        backend: click.Choice,
+        quantized: bool
+):
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from src.models import read_from_dir
+    from src.models.onnx_inference import create_inference_engine, read_onnx_from_dir
+    from src.models.serving import MicroBatcher, serve
+
+    if backend == "onnx":
+        tokenizer, model = read_onnx_from_dir(input_dir)
+    else:
+        tokenizer, model = read_from_dir(input_dir, quantized=quantized)
+    engine = create_inference_engine(tokenizer, model, batch_size=max_batch_size, max_tokens=max_tokens,
+                                     verbose=False)
+    batcher = MicroBatcher(engine, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    try:
+        asyncio.run(serve(batcher, host=host, port=port))
+    except KeyboardInterrupt:
+        print(f"Stopped. {batcher.stats()}")
+
+
+if __name__ == '__main__':
+    main()
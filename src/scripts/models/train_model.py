@@ -1,10 +1,7 @@
-from click import STRING, INT
-from transformers import AutoTokenizer, Trainer, BertForSequenceClassification, TrainingArguments
+from click import STRING, INT, FLOAT
 import click
 from src.common.data_preparation import KlejType
 from src.models import MODEL_USED
-from src.models.metrics import compute_metrics
-from src.models.datasets import KlejDataset, FinancialDataset
 
 
 @click.command()
@@ -39,48 +36,235 @@ from src.models.datasets import KlejDataset, FinancialDataset
     default=8,
     help="Choose the eval batch size."
 )
+@click.option(
+    "--encoding_cache/--no_encoding_cache",
+    default=True,
+    help="Reuse tokenized texts stored in data/cache/encodings. Enabled by default. Ignored with --streaming."
+)
+@click.option(
+    "--tokenize_workers",
+    type=INT,
+    default=1,
+    help="Number of processes tokenizing the texts (0 - one per CPU core). The throughput is printed. "
+         "Ignored with --streaming."
+)
+@click.option(
+    "--group_by_length/--no_group_by_length",
+    default=True,
+    help="Batch together training texts of similar length to reduce padding. Enabled by default. "
+         "Ignored with --streaming."
+)
+@click.option(
+    "--max_tokens",
+    type=INT,
+    default=None,
+    help="If set, texts of similar length are packed into batches of up to this number of padded tokens "
+         "instead of --batch_size and --eval_batch_size texts. Cannot be used with --streaming."
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    default=False,
+    help="Read and tokenize training texts lazily, in constant memory. Requires --max_steps."
+)
+@click.option(
+    "--max_steps",
+    type=INT,
+    default=None,
+    help="If set, the training stops after this number of steps instead of --epochs."
+)
+@click.option(
+    "--dataloader_workers",
+    type=INT,
+    default=None,
+    help="Number of worker processes loading (and, with --streaming, tokenizing) the data. "
+         "Default to 0, or 1 with --profile cpu on machines with more than 2 cores."
+)
+@click.option(
+    "--shuffle_buffer",
+    type=INT,
+    default=10000,
+    help="Number of examples in the shuffle buffer used with --streaming."
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["default", "cpu"]),
+    default="default",
+    help="Training setup. cpu trains on CPU with bf16 autocast (if supported by the CPU), threads tuned "
+         "to the available cores, gradient accumulation and a DataLoader worker. Default to default."
+)
+@click.option(
+    "--gradient_accumulation_steps",
+    type=INT,
+    default=None,
+    help="Number of batches whose gradients are accumulated before an optimizer step. "
+         "Default to 1, or 4 with --profile cpu."
+)
+@click.option(
+    "--gradient_checkpointing",
+    is_flag=True,
+    default=False,
+    help="Recompute activations in the backward pass instead of storing them, which bounds memory usage."
+)
+@click.option(
+    "--threads",
+    type=INT,
+    default=None,
+    help="Number of threads used by --profile cpu. By default the cores not used by DataLoader workers."
+)
+@click.option(
+    "--peft",
+    type=click.Choice(["full", "freeze", "lora"]),
+    default="full",
+    help="Fine-tuning mode. full trains all parameters, freeze freezes the embeddings and the lower "
+         "--freeze_layers encoder layers, lora trains low-rank updates of the attention layers. With freeze and lora "
+         "only the trainable parameters are saved and read_from_dir loads them with the base model. Default to full."
+)
+@click.option(
+    "--freeze_layers",
+    type=INT,
+    default=8,
+    help="Number of the lower encoder layers frozen with --peft freeze. Default to 8."
+)
+@click.option(
+    "--lora_rank",
+    type=INT,
+    default=8,
+    help="Rank of the low-rank updates trained with --peft lora. Default to 8."
+)
+@click.option(
+    "--lora_alpha",
+    type=FLOAT,
+    default=16.,
+    help="Scaling of the low-rank updates trained with --peft lora. Default to 16."
+)
+@click.option(
+    "--learning_rate",
+    type=FLOAT,
+    default=None,
+    help="Peak learning rate. Default to 5e-5, or 5e-4 with --peft lora."
+)
 def main(
         output_dir: STRING,
         train_dataset: click.Choice,
         epochs: INT,
         batch_size: INT,
-        eval_batch_size: INT
+        eval_batch_size: INT,
+        encoding_cache: bool,
+        tokenize_workers: INT,
+        group_by_length: bool,
+        max_tokens: INT,
+        streaming: bool,
+        max_steps: INT,
+        dataloader_workers: INT,
+        shuffle_buffer: INT,
+        profile: click.Choice,
+        gradient_accumulation_steps: INT,
+        gradient_checkpointing: bool,
+        threads: INT,
+        peft: click.Choice,
+        freeze_layers: INT,
+        lora_rank: INT,
+        lora_alpha: FLOAT,
+        learning_rate: FLOAT
 ):
+    if streaming and max_steps is None:
+        raise click.UsageError("--max_steps is required with --streaming, as the size of the stream is unknown.")
+    if streaming and max_tokens is not None:
+        raise click.UsageError("--max_tokens cannot be used with --streaming, as lengths of streamed texts are "
+                               "unknown in advance.")
+    # Heavy modules are imported here, so that --help does not wait for them.
+    from transformers import AutoTokenizer, BertForSequenceClassification, TrainingArguments
+    from src.common.utils.startup import report_startup
+    from src.models.adapters import prepare_peft_model
+    from src.models.metrics import compute_metrics
+    from src.models.datasets import KlejDataset, FinancialDataset
+    from src.models.encoding_cache import EncodingCache
+    from src.models.streaming import StreamingKlejDataset, StreamingFinancialDataset
+    from src.models.training import BucketedTrainer, ThroughputTrainer, training_profile_arguments
+
+    report_startup('Imported modules')
+    # Thread counts are set before the model is created.
+    profile_arguments = training_profile_arguments(
+        profile,
+        gradient_accumulation_steps=gradient_accumulation_steps,
+        gradient_checkpointing=gradient_checkpointing,
+        dataloader_workers=dataloader_workers,
+        threads=threads
+    )
     tokenizer = AutoTokenizer.from_pretrained(MODEL_USED)
 
     model = BertForSequenceClassification.from_pretrained(MODEL_USED, num_labels=3)
+    model = prepare_peft_model(
+        model,
+        peft,
+        base_model=MODEL_USED,
+        freeze_layers=freeze_layers,
+        lora_rank=lora_rank,
+        lora_alpha=lora_alpha
+    )
+    if learning_rate is None:
+        # Low-rank updates start from zero and need larger steps than the full weights.
+        learning_rate = 5e-4 if peft == "lora" else 5e-5
 
     training_args = TrainingArguments(
         output_dir='./results',
         num_train_epochs=epochs,
+        learning_rate=learning_rate,
         per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=eval_batch_size,
         warmup_steps=500,
         weight_decay=0.01,
         logging_dir='./logs',
         logging_steps=10,
+        max_steps=max_steps if max_steps is not None else -1,
+        **profile_arguments
     )
-    dataset = (
-        KlejDataset(
-            tokenizer=tokenizer,
-            klej_type=KlejType.IN,
+    cache = EncodingCache(tokenizer, workers=tokenize_workers) if encoding_cache else None
+    if streaming:
+        dataset = (
+            StreamingKlejDataset(
+                tokenizer=tokenizer,
+                klej_type=KlejType.IN,
+                shuffle_buffer_size=shuffle_buffer
+            )
+            if "klej" in train_dataset
+            else StreamingFinancialDataset(
+                tokenizer=tokenizer,
+                shuffle_companies="mixed" in train_dataset,
+                shuffle_buffer_size=shuffle_buffer
+            )
         )
-        if "klej" in train_dataset
-        else FinancialDataset(
-            tokenizer=tokenizer,
-            shuffle_companies="mixed" in train_dataset
+    else:
+        dataset = (
+            KlejDataset(
+                tokenizer=tokenizer,
+                klej_type=KlejType.IN,
+                encoding_cache=cache,
+                tokenize_workers=tokenize_workers
+            )
+            if "klej" in train_dataset
+            else FinancialDataset(
+                tokenizer=tokenizer,
+                shuffle_companies="mixed" in train_dataset,
+                encoding_cache=cache,
+                tokenize_workers=tokenize_workers
+            )
         )
-    )
     train, val, test = dataset.get()
 
-    trainer = Trainer(
+    trainer_kwargs = dict(
         model=model,
         args=training_args,
         train_dataset=train,
         eval_dataset=val,
+        data_collator=dataset.data_collator,
         compute_metrics=compute_metrics,
-
     )
+    if group_by_length or max_tokens is not None:
+        trainer = BucketedTrainer(max_tokens=max_tokens, **trainer_kwargs)
+    else:
+        trainer = ThroughputTrainer(**trainer_kwargs)
 
     trainer.train()
 
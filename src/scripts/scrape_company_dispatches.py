@@ -4,9 +4,8 @@ from pathlib import Path
 import click
 from click import INT, STRING
 import os
-from src.common.consts import COMPANY_NAME_TO_ID
+from src.common import consts
 from src.common.utils.files_io import write_json
-from src.api.scraper import scrape_dispatches_for_company
 
 
 def _store_scrape_for_company(
@@ -15,6 +14,8 @@ def _store_scrape_for_company(
         year_end: int,
         sleep_time: int,
         output_dir: Path) -> None:
+    from src.api.scraper import scrape_dispatches_for_company
+
     print(f'Scraping dispatches for: {company_name} from {year_start} to {year_end}.')
     company_infos = scrape_dispatches_for_company(
         company_name,
@@ -94,7 +95,7 @@ def main(
             output_dir=output_dir)
 
     elif company_idx_start and company_idx_end:
-        for i, company_name in enumerate(COMPANY_NAME_TO_ID):
+        for i, company_name in enumerate(consts.COMPANY_NAME_TO_ID):
             if company_idx_start <= i < company_idx_end:
                 _store_scrape_for_company(
                     company_name,